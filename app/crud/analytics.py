@@ -0,0 +1,570 @@
+import calendar
+import heapq
+import os
+import threading
+from datetime import date, datetime, time, timedelta, timezone
+from typing import List
+import numpy as np
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.models import User, Wallet, PurchaseTransaction, SaleTransaction, WalletDailyValue, WalletDailyValueState
+from app.CoinCapAPI import fetch_dated_coin_price, valid_coin_names
+from app.utils.timeseries import day_range, holdings_matrix, price_matrix, value_series, candle_day
+from app.utils.risk import daily_returns, risk_metrics
+from app.utils.benchmark import basket_index, replay_cash_flows
+from app.utils.holdings_index import HoldingsIndex
+from app.utils.lots import LOT_EPSILON
+
+load_dotenv()
+
+MAX_SERIES_DAYS = 3660
+HOLDINGS_INDEX_CACHE_SIZE = 256
+RISK_CACHE_SIZE = 256
+
+# Annual rate the Sharpe and Sortino ratios measure excess returns against
+RISK_FREE_RATE = float(os.getenv("RISK_FREE_RATE", 0.0))
+
+# wallet_id -> (wallet version, HoldingsIndex), most recently used last
+_holdings_index_cache = {}
+
+# (scope, id, start, end) -> (wallet versions, last candle day, report), most recently used last
+_risk_cache = {}
+
+# Guards both caches, which request threads read and write and wallet deletion empties. Entries are built unlocked.
+_cache_lock = threading.Lock()
+
+
+def _cached(cache: dict, key):
+    with _cache_lock:
+        return cache.get(key)
+
+
+def _remember(cache: dict, key, entry, maxsize: int):
+    """Stores the entry as the most recently used, dropping the least recently used beyond maxsize."""
+    with _cache_lock:
+        cache.pop(key, None)
+        cache[key] = entry
+        if len(cache) > maxsize:
+            cache.pop(next(iter(cache)))
+
+
+def _check_wallet(db: Session, user_id: int, wallet_id: int) -> Wallet:
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+    wallet = db.query(Wallet).filter(Wallet.id == wallet_id).first()
+    if not wallet:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found")
+
+    if wallet.user_id != user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="This wallet does not belong to the user")
+
+    return wallet
+
+
+def _parse_series_range(start_date: str, end_date: str):
+    try:
+        start = datetime.strptime(start_date, "%Y-%m-%d").date()
+        end = datetime.strptime(end_date, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid date format. Expected format: YYYY-MM-DD"
+        )
+
+    if end < start:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="start_date must not be after end_date")
+
+    if (end - start).days + 1 > MAX_SERIES_DAYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Date range is limited to {MAX_SERIES_DAYS} days"
+        )
+
+    return start, end
+
+
+def _to_date(value) -> date:
+    # DATE() comes back as a string on SQLite and as a date on PostgreSQL
+    return value if isinstance(value, date) else date.fromisoformat(str(value))
+
+
+def _quantity_changes(db: Session, wallet_id: int, start: datetime, end: datetime):
+    """
+    Opening quantity per coin before start, and the net traded quantity per coin per day in [start, end).
+    Both are aggregated in the database, so only one row per coin per active day is read.
+    """
+    opening = {}
+    deltas = []
+
+    for model, date_column, quantity_column, sign in (
+        (PurchaseTransaction, PurchaseTransaction.purchase_date, PurchaseTransaction.quantity_purchased, 1),
+        (SaleTransaction, SaleTransaction.sale_date, SaleTransaction.quantity_sold, -1),
+    ):
+        opening_rows = (
+            db.query(model.coin_name, func.sum(quantity_column))
+            .filter(model.wallet_id == wallet_id, date_column < start)
+            .group_by(model.coin_name)
+        )
+        for coin, quantity in opening_rows:
+            opening[coin] = opening.get(coin, 0.0) + sign * quantity
+
+        trade_day = func.date(date_column)
+        daily_rows = (
+            db.query(model.coin_name, trade_day, func.sum(quantity_column))
+            .filter(model.wallet_id == wallet_id, date_column >= start, date_column < end)
+            .group_by(model.coin_name, trade_day)
+        )
+        deltas.extend((coin, _to_date(day), sign * quantity) for coin, day, quantity in daily_rows)
+
+    return opening, deltas
+
+
+def fetch_daily_candles(coins, start: date, end: date) -> dict:
+    """One d1 history request per coin for the whole range."""
+    start_timestamp = calendar.timegm(start.timetuple())
+    end_timestamp = calendar.timegm((end + timedelta(days=1)).timetuple())
+    return {
+        coin: fetch_dated_coin_price(coin_name=coin, start_timestamp=start_timestamp, end_timestamp=end_timestamp)
+        for coin in coins
+    }
+
+
+def _held_coins(db: Session, wallet_id: int, days):
+    """Coins held on any of the days and the holdings matrix for them, rebuilt from the transaction history."""
+    opening, deltas = _quantity_changes(
+        db, wallet_id, datetime.combine(days[0], datetime.min.time()),
+        datetime.combine(days[-1] + timedelta(days=1), datetime.min.time())
+    )
+
+    coins = sorted(set(opening) | {coin for coin, _, _ in deltas})
+    holdings = holdings_matrix(days, coins, opening, deltas)
+
+    # Coins sold out before the range and never bought back need no prices
+    held = holdings.any(axis=0)
+    return [coin for coin, is_held in zip(coins, held) if is_held], holdings[:, held]
+
+
+def compute_daily_values(
+        db: Session,
+        wallet_id: int,
+        start: date,
+        end: date,
+        fetch_candles=fetch_daily_candles
+) -> dict:
+    """
+    Value of the wallet at the end of each day in [start, end]. Holdings for each day are rebuilt from the transaction
+    history and priced with the daily candles of each coin, which fetch_candles(coins, start, end) returns.
+    """
+    days = day_range(start, end)
+    coins, holdings = _held_coins(db, wallet_id, days)
+
+    candles = fetch_candles(coins, start, end)
+    prices, missing_prices = price_matrix(days, coins, candles)
+
+    return {
+        "days": days,
+        "coins": coins,
+        "candles": candles,
+        "missing_prices": missing_prices,
+        "holdings": holdings,
+        "prices": prices,
+        "values": value_series(holdings, prices)
+    }
+
+
+def daily_cost_basis(db: Session, wallet_id: int, days) -> np.ndarray:
+    """
+    Cost basis held at the end of each day: purchases add what they cost and sales remove the cost basis of what
+    they sold, both summed per day in the database.
+    """
+    start = datetime.combine(days[0], datetime.min.time())
+    end = datetime.combine(days[-1] + timedelta(days=1), datetime.min.time())
+    day_index = {day: i for i, day in enumerate(days)}
+    changes = np.zeros(len(days))
+
+    for model, date_column, cost_column, sign in (
+        (PurchaseTransaction, PurchaseTransaction.purchase_date, PurchaseTransaction.total_purchase_price, 1),
+        (SaleTransaction, SaleTransaction.sale_date, SaleTransaction.cost_basis_usd, -1),
+    ):
+        opening = db.query(func.sum(cost_column)).filter(model.wallet_id == wallet_id, date_column < start).scalar()
+        changes[0] += sign * (opening or 0.0)
+
+        trade_day = func.date(date_column)
+        daily_rows = (
+            db.query(trade_day, func.sum(cost_column))
+            .filter(model.wallet_id == wallet_id, date_column >= start, date_column < end)
+            .group_by(trade_day)
+        )
+        for day, cost in daily_rows:
+            changes[day_index[_to_date(day)]] += sign * (cost or 0.0)
+
+    return np.cumsum(changes)
+
+
+def _materialized_series(db: Session, wallet: Wallet, start: date, end: date):
+    """
+    The days' values from wallet_daily_values, or None unless they are current for the wallet's trades and cover
+    every day. Returns ([(day, total_value_usd)], coins held on any of the days, missing_prices).
+    """
+    state = db.query(WalletDailyValueState).filter(WalletDailyValueState.wallet_id == wallet.id).first()
+    if state is None or state.version != wallet.version:
+        return None
+
+    rows = (
+        db.query(WalletDailyValue.day, WalletDailyValue.total_value_usd, WalletDailyValue.coin_prices)
+        .filter(WalletDailyValue.wallet_id == wallet.id, WalletDailyValue.day >= start, WalletDailyValue.day <= end)
+        .order_by(WalletDailyValue.day)
+        .all()
+    )
+    if len(rows) != (end - start).days + 1 or any(coin_prices is None for _, _, coin_prices in rows):
+        return None
+
+    coins = sorted({coin for _, _, coin_prices in rows for coin in coin_prices})
+    return [(day, value) for day, value, _ in rows], coins, state.missing_prices or []
+
+
+def crud_get_wallet_value_series(
+        db: Session,
+        user_id: int,
+        wallet_id: int,
+        start_date: str,
+        end_date: str
+):
+    """
+    Daily wallet value over [start_date, end_date]. Read from the materialized daily values when they are current
+    and cover the range; otherwise computed from the transaction history and one candle request per coin.
+    """
+    try:
+        wallet = _check_wallet(db, user_id, wallet_id)
+        start, end = _parse_series_range(start_date, end_date)
+
+        materialized = _materialized_series(db, wallet, start, end)
+        if materialized is not None:
+            series, coins, missing_prices = materialized
+        else:
+            daily = compute_daily_values(db, wallet_id, start, end)
+            coins, missing_prices = daily["coins"], daily["missing_prices"]
+            series = zip(daily["days"], daily["values"])
+
+        return {
+            "wallet_id": wallet_id,
+            "start_date": start,
+            "end_date": end,
+            "coins": coins,
+            "missing_prices": missing_prices,
+            "series": [
+                {"date": day, "total_value_usd": round(float(value), 4)} for day, value in series
+            ]
+        }
+
+    except SQLAlchemyError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Database error: " + str(e)
+        )
+
+
+def _wallet_trades(db: Session, wallet_id: int):
+    """Every trade of the wallet as (timestamp, coin_name, signed quantity), purchases first on equal timestamps."""
+    purchases = (
+        db.query(PurchaseTransaction.purchase_date, PurchaseTransaction.id, PurchaseTransaction.coin_name,
+                 PurchaseTransaction.quantity_purchased)
+        .filter(PurchaseTransaction.wallet_id == wallet_id)
+        .order_by(PurchaseTransaction.purchase_date, PurchaseTransaction.id)
+    )
+    sales = (
+        db.query(SaleTransaction.sale_date, SaleTransaction.id, SaleTransaction.coin_name, SaleTransaction.quantity_sold)
+        .filter(SaleTransaction.wallet_id == wallet_id)
+        .order_by(SaleTransaction.sale_date, SaleTransaction.id)
+    )
+
+    merged = heapq.merge(
+        ((timestamp, 0, trade_id, coin, quantity) for timestamp, trade_id, coin, quantity in purchases),
+        ((timestamp, 1, trade_id, coin, -quantity) for timestamp, trade_id, coin, quantity in sales),
+    )
+    return [(timestamp, coin, quantity) for timestamp, _, _, coin, quantity in merged]
+
+
+def get_holdings_index(db: Session, wallet: Wallet) -> HoldingsIndex:
+    """The wallet's holdings index, rebuilt only when a trade has bumped the wallet version since it was built."""
+    cached = _cached(_holdings_index_cache, wallet.id)
+    if cached and cached[0] == wallet.version:
+        index = cached[1]
+    else:
+        # Version is read before the trades, so a trade landing in between only makes the entry look stale
+        version = wallet.version
+        index = HoldingsIndex(_wallet_trades(db, wallet.id))
+        cached = (version, index)
+        print(f"Built holdings index for wallet {wallet.id} from {len(index)} trades")
+
+    _remember(_holdings_index_cache, wallet.id, cached, HOLDINGS_INDEX_CACHE_SIZE)
+
+    return index
+
+
+def forget_wallet(wallet_id: int):
+    """Drops a deleted wallet's cached results, since SQLite may hand its id to the next wallet."""
+    with _cache_lock:
+        _holdings_index_cache.pop(wallet_id, None)
+        for key in [key for key in _risk_cache if key[:2] == ("wallet", wallet_id)]:
+            del _risk_cache[key]
+
+
+def _parse_as_of(as_of: str) -> datetime:
+    """A full timestamp is used as given (converted to UTC); a bare date means the end of that day."""
+    try:
+        if len(as_of) == 10:
+            return datetime.combine(datetime.strptime(as_of, "%Y-%m-%d").date(), time.max)
+        moment = datetime.fromisoformat(as_of)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid timestamp format. Expected format: YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS"
+        )
+
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def crud_get_holdings_as_of(db: Session, user_id: int, wallet_id: int, as_of: str):
+    """Exact quantities held at any moment, replayed from the trade history instead of the nearest snapshot."""
+    try:
+        wallet = _check_wallet(db, user_id, wallet_id)
+        moment = _parse_as_of(as_of)
+
+        holdings = get_holdings_index(db, wallet).holdings_as_of(moment, epsilon=LOT_EPSILON)
+
+        return {
+            "wallet_id": wallet_id,
+            "as_of": moment,
+            "holdings": holdings
+        }
+
+    except SQLAlchemyError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Database error: " + str(e)
+        )
+
+
+def _risk_report(db: Session, wallet_ids, start: date, end: date):
+    """
+    Risk metrics of the combined holdings of the wallets over [start, end], and the last day every priced coin had
+    a candle for. Holdings and prices are (days, coins) matrices, so every metric is a handful of array operations.
+    """
+    days = day_range(start, end)
+    held = [_held_coins(db, wallet_id, days) for wallet_id in wallet_ids]
+
+    coins = sorted({coin for wallet_coins, _ in held for coin in wallet_coins})
+    coin_index = {coin: j for j, coin in enumerate(coins)}
+    holdings = np.zeros((len(days), len(coins)))
+    for wallet_coins, wallet_holdings in held:
+        holdings[:, [coin_index[coin] for coin in wallet_coins]] += wallet_holdings
+
+    candles = fetch_daily_candles(coins, start, end)
+    prices, missing_prices = price_matrix(days, coins, candles)
+    returns, contributions = daily_returns(holdings, prices)
+
+    last_candle_days = [
+        max(candle_day(candle) for candle in coin_candles) for coin_candles in candles.values() if coin_candles
+    ]
+
+    report = {
+        "start_date": start,
+        "end_date": end,
+        "coins": coins,
+        "missing_prices": missing_prices,
+        **risk_metrics(returns, contributions, coins, RISK_FREE_RATE),
+        "daily_returns": [
+            {"date": day, "daily_return": None if np.isnan(value) else float(value)}
+            for day, value in zip(days[1:], returns)
+        ]
+    }
+    return report, min(last_candle_days, default=None)
+
+
+def _memoized_risk_report(db: Session, key: tuple, versions, wallet_ids, start: date, end: date) -> dict:
+    """
+    The cached report while the wallets' versions are unchanged and it was built with every candle the range can
+    have (through yesterday at the latest), otherwise a fresh one.
+    """
+    expected_candle_day = min(end, datetime.utcnow().date() - timedelta(days=1))
+
+    cached = _cached(_risk_cache, key)
+    if not (cached and cached[0] == versions and (cached[1] is None or cached[1] >= expected_candle_day)):
+        report, last_candle_day = _risk_report(db, wallet_ids, start, end)
+        cached = (versions, last_candle_day, report)
+
+    _remember(_risk_cache, key, cached, RISK_CACHE_SIZE)
+
+    return cached[2]
+
+
+def crud_get_wallet_risk(db: Session, user_id: int, wallet_id: int, start_date: str, end_date: str):
+    """Daily returns, volatility, drawdown, Sharpe and Sortino ratios and per-coin contribution of one wallet."""
+    try:
+        wallet = _check_wallet(db, user_id, wallet_id)
+        start, end = _parse_series_range(start_date, end_date)
+
+        report = _memoized_risk_report(db, ("wallet", wallet_id, start, end), wallet.version, [wallet_id], start, end)
+
+        return {"wallet_id": wallet_id, **report}
+
+    except SQLAlchemyError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Database error: " + str(e)
+        )
+
+
+def crud_get_user_risk(db: Session, user_id: int, start_date: str, end_date: str):
+    """The same metrics for everything the user holds, with the holdings of all their wallets combined per coin."""
+    try:
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+        start, end = _parse_series_range(start_date, end_date)
+
+        versions = tuple(db.query(Wallet.id, Wallet.version).filter(Wallet.user_id == user_id).order_by(Wallet.id))
+        wallet_ids = [wallet_id for wallet_id, _ in versions]
+
+        report = _memoized_risk_report(db, ("user", user_id, start, end), versions, wallet_ids, start, end)
+
+        return {"user_id": user_id, "wallet_ids": wallet_ids, **report}
+
+    except SQLAlchemyError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Database error: " + str(e)
+        )
+
+
+def _parse_benchmark(benchmark: List[str]) -> dict:
+    """
+    {coin_name: weight} from entries of "coin_name" or "coin_name:weight", with weights scaled to sum to 1. Unweighted
+    entries weigh 1, and "top-N" stands for the N largest cached coins weighted equally.
+    """
+    coin_names = valid_coin_names()
+    weights = {}
+
+    for entry in benchmark:
+        name, _, weight = entry.partition(":")
+        try:
+            weight = float(weight) if weight else 1.0
+        except ValueError:
+            weight = 0.0
+        if not weight > 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid benchmark weight in '{entry}' - expected a positive number"
+            )
+
+        if name.startswith("top-") and name[4:].isdigit() and int(name[4:]) > 0:
+            members = coin_names[:int(name[4:])]
+        elif name in coin_names:
+            members = [name]
+        else:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid benchmark coin '{name}' - (e.g., 'bitcoin', 'ethereum:0.4', 'top-10')"
+            )
+
+        for coin in members:
+            weights[coin] = weights.get(coin, 0.0) + weight / len(members)
+
+    total = sum(weights.values())
+    return {coin: weight / total for coin, weight in weights.items()}
+
+
+def _daily_cash_flows(db: Session, wallet_id: int, days) -> np.ndarray:
+    """Money put into the wallet by purchases less money taken out by sales, per day."""
+    start = datetime.combine(days[0], datetime.min.time())
+    end = datetime.combine(days[-1] + timedelta(days=1), datetime.min.time())
+
+    flows = np.zeros(len(days))
+    for model, date_column, amount, sign in (
+        (PurchaseTransaction, PurchaseTransaction.purchase_date, PurchaseTransaction.total_purchase_price, 1.0),
+        (SaleTransaction, SaleTransaction.sale_date, SaleTransaction.total_sale_price, -1.0),
+    ):
+        rows = db.query(date_column, amount).filter(
+            model.wallet_id == wallet_id, date_column >= start, date_column < end
+        ).all()
+        if rows:
+            positions = [(when.date() - days[0]).days for when, _ in rows]
+            np.add.at(flows, positions, [sign * (value or 0.0) for _, value in rows])
+
+    return flows
+
+
+def crud_get_wallet_benchmark(
+        db: Session,
+        user_id: int,
+        wallet_id: int,
+        start_date: str,
+        end_date: str,
+        benchmark: List[str]
+):
+    """
+    The wallet's daily value next to what the same money would be worth in a benchmark coin or basket. The benchmark
+    starts with the wallet's value on start_date, then every purchase is put into it and every sale's proceeds taken
+    out on the day they happened.
+    """
+    try:
+        _check_wallet(db, user_id, wallet_id)
+        start, end = _parse_series_range(start_date, end_date)
+        weights = _parse_benchmark(benchmark)
+
+        # Coins in both the wallet and the benchmark are fetched once
+        candle_cache = {}
+
+        def fetch_candles(coins, first_day, last_day):
+            candle_cache.update(
+                fetch_daily_candles([coin for coin in coins if coin not in candle_cache], first_day, last_day)
+            )
+            return {coin: candle_cache[coin] for coin in coins}
+
+        daily = compute_daily_values(db, wallet_id, start, end, fetch_candles)
+        days, wallet_values = daily["days"], daily["values"]
+
+        basket = list(weights)
+        prices, unpriced = price_matrix(days, basket, fetch_candles(basket, start, end))
+        if unpriced:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"No price history found for benchmark coins: {', '.join(unpriced)}"
+            )
+
+        flows = _daily_cash_flows(db, wallet_id, days)
+        flows[0] = wallet_values[0]
+        benchmark_values = replay_cash_flows(flows, basket_index(prices, np.array([weights[coin] for coin in basket])))
+
+        return {
+            "wallet_id": wallet_id,
+            "start_date": start,
+            "end_date": end,
+            "benchmark": [{"coin_name": coin, "weight": weight} for coin, weight in weights.items()],
+            "missing_prices": daily["missing_prices"],
+            "series": [
+                {
+                    "date": day,
+                    "wallet_value_usd": round(float(wallet_value), 4),
+                    "benchmark_value_usd": round(float(benchmark_value), 4),
+                    "net_cash_flow_usd": round(float(flow), 4)
+                }
+                for day, wallet_value, benchmark_value, flow in zip(days, wallet_values, benchmark_values, flows)
+            ]
+        }
+
+    except SQLAlchemyError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Database error: " + str(e)
+        )
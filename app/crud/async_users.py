@@ -0,0 +1,63 @@
+"""
+Read-only user queries for the asyncio session from app.database.get_async_db. They mirror the functions of the same
+name in app.crud.users, with the same results and errors.
+"""
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi import HTTPException, status
+
+from app.models import User
+from app.crud.users import _prefix_end, _encode_cursor, _decode_cursor
+
+
+async def crud_get_user_by_username(db: AsyncSession, username: str):
+    user = (await db.execute(select(User).filter(User.username == username))).scalars().first()
+
+    if not user:
+        raise HTTPException(status_code=404, detail=f"{username} not found")
+
+    return user
+
+
+async def crud_get_user_by_id(db: AsyncSession, user_id: int):
+    user = await db.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    return user
+
+
+async def crud_get_all_users(db: AsyncSession, limit: int = 100, after_id: Optional[int] = None):
+    query = select(User)
+    if after_id is not None:
+        query = query.filter(User.id > after_id)
+    users = (await db.execute(query.order_by(User.id).limit(limit))).scalars().all()
+    return users
+
+
+async def crud_search_users(
+        db: AsyncSession,
+        field: str = "username",
+        prefix: Optional[str] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None
+) -> dict:
+    """One page of users ordered by username or email, as app.crud.users.crud_search_users."""
+    column = User.username if field == "username" else User.email
+
+    query = select(User.id, User.username, User.email)
+    if prefix:
+        query = query.filter(column >= prefix)
+        prefix_end = _prefix_end(prefix)
+        if prefix_end is not None:
+            query = query.filter(column < prefix_end)
+    if cursor:
+        query = query.filter(column > _decode_cursor(field, cursor))
+
+    rows = (await db.execute(query.order_by(column).limit(limit + 1))).all()
+    page = rows[:limit]
+
+    return {
+        "users": [{"id": user_id, "username": username, "email": email} for user_id, username, email in page],
+        "next_cursor": _encode_cursor(field, getattr(page[-1], field)) if len(rows) > limit else None
+    }
@@ -0,0 +1,49 @@
+"""
+Read-only wallet queries for the asyncio session from app.database.get_async_db. They mirror the functions of the
+same name in app.crud.wallets, with the same results and errors.
+"""
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from fastapi import HTTPException, status
+
+from app.models import Wallet, PurchaseTransaction, SaleTransaction
+from app.crud.wallets import _transaction_page
+
+
+async def crud_get_all_wallets(db: AsyncSession, user_id: int):
+    # Lazy loads can't run under asyncio, so the assets WalletResponse lists are loaded with the wallets
+    wallets = (await db.execute(
+        select(Wallet).filter(Wallet.user_id == user_id).options(selectinload(Wallet.assets))
+    )).scalars().all()
+
+    if not wallets:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No wallets found")
+
+    return wallets
+
+
+async def crud_get_all_transactions_for_wallet(
+    db: AsyncSession,
+    user_id: int,
+    wallet_id: int,
+    limit: int,
+    page: int
+):
+    wallet = (await db.execute(
+        select(Wallet.id).filter(Wallet.id == wallet_id, Wallet.user_id == user_id)
+    )).first()
+    if not wallet:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found")
+
+    offset = (page - 1) * limit
+
+    purchase_transactions = (await db.execute(
+        select(PurchaseTransaction).filter(PurchaseTransaction.wallet_id == wallet_id).offset(offset).limit(limit)
+    )).scalars().all()
+
+    sale_transactions = (await db.execute(
+        select(SaleTransaction).filter(SaleTransaction.wallet_id == wallet_id).offset(offset).limit(limit)
+    )).scalars().all()
+
+    return _transaction_page(purchase_transactions, sale_transactions, limit)
@@ -0,0 +1,51 @@
+from typing import List
+from sqlalchemy.orm import Session
+
+from app.models import User, Wallet, Asset, AssetLot, PurchaseTransaction, SaleTransaction, WalletActivityData
+from app.models import WalletDailyValue, WalletDailyValueState, IdempotencyRecord
+from app.crud.analytics import forget_wallet
+from app.utils.auth import forget_user, forget_wallet_owner
+
+# Everything keyed by wallet_id, children before the rows they reference
+WALLET_TABLES = [
+    AssetLot,
+    PurchaseTransaction,
+    SaleTransaction,
+    Asset,
+    WalletActivityData,
+    WalletDailyValue,
+    WalletDailyValueState,
+]
+
+
+def delete_wallet_rows(db: Session, wallet_ids: List[int]):
+    """
+    Deletes the wallets and every row that belongs to them with one DELETE ... WHERE wallet_id IN (...) per table,
+    without loading anything through the ORM. The caller commits, so it all happens in one transaction.
+    """
+    if not wallet_ids:
+        return
+    for model in WALLET_TABLES:
+        db.query(model).filter(model.wallet_id.in_(wallet_ids)).delete(synchronize_session=False)
+    # Wallets the caller has loaded are marked deleted, so their attributes stay readable after the commit
+    db.query(Wallet).filter(Wallet.id.in_(wallet_ids)).delete(synchronize_session="evaluate")
+
+
+def delete_user_rows(db: Session, user_id: int):
+    """Deletes the user, their wallets and everything in them, and their idempotency records. The caller commits."""
+    wallet_ids = [wallet_id for (wallet_id,) in db.query(Wallet.id).filter(Wallet.user_id == user_id)]
+    delete_wallet_rows(db, wallet_ids)
+    # Trades are keyed by user too, in case any outlived their wallet
+    for model in (PurchaseTransaction, SaleTransaction, IdempotencyRecord):
+        db.query(model).filter(model.user_id == user_id).delete(synchronize_session=False)
+    db.query(User).filter(User.id == user_id).delete(synchronize_session="evaluate")
+    return wallet_ids
+
+
+def forget_deleted(user_id: int = None, wallet_ids: List[int] = ()):
+    """Drops the in-memory caches that could otherwise serve a deleted user or wallet, or one reusing its id."""
+    for wallet_id in wallet_ids:
+        forget_wallet(wallet_id)
+        forget_wallet_owner(wallet_id)
+    if user_id is not None:
+        forget_user(user_id)
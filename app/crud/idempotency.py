@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+
+from app.models import IdempotencyRecord
+
+load_dotenv()
+
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", 24))
+
+
+def request_fingerprint(**params) -> str:
+    """Hashes the request parameters so a key reused for a different request can be rejected."""
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def get_stored_response(db: Session, user_id: int, endpoint: str, key: str, request_hash: str):
+    """Returns the response saved for this key, or None if the key is new or has expired."""
+    record = db.query(IdempotencyRecord).filter(
+        IdempotencyRecord.user_id == user_id,
+        IdempotencyRecord.endpoint == endpoint,
+        IdempotencyRecord.key == key
+    ).first()
+
+    if not record:
+        return None
+
+    if record.expires_at <= datetime.utcnow():
+        # Deleted in the caller's transaction, so it only goes once the new response is committed in its place
+        db.query(IdempotencyRecord).filter(IdempotencyRecord.id == record.id).delete(synchronize_session=False)
+        db.expunge(record)
+        return None
+
+    if record.request_hash != request_hash:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key has already been used for a different request"
+        )
+
+    print(f"Replaying stored response for Idempotency-Key {key}")
+    return record.response
+
+
+def store_response(db: Session, user_id: int, endpoint: str, key: str, request_hash: str, response: dict):
+    """Adds the response to the session. The caller commits it together with the trade it belongs to."""
+    now = datetime.utcnow()
+    db.add(IdempotencyRecord(
+        user_id=user_id,
+        endpoint=endpoint,
+        key=key,
+        request_hash=request_hash,
+        response=response,
+        created_at=now,
+        expires_at=now + timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS)
+    ))
+
+
+def purge_expired_records(db: Session) -> int:
+    """Deletes every expired record, including keys that are never reused. Run daily by app.jobs.scheduler."""
+    deleted = db.query(IdempotencyRecord).filter(IdempotencyRecord.expires_at <= datetime.utcnow()).delete()
+    db.commit()
+    print(f"Idempotency records: purged {deleted} expired")
+    return deleted
@@ -0,0 +1,114 @@
+import os
+from collections.abc import Mapping
+from typing import Iterable
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.models import SnapshotCoin, WalletActivityData
+from app.utils.snapshot_codec import HoldingsView, decode_records, encode_holdings
+
+load_dotenv()
+
+SNAPSHOT_HOLDINGS_FORMATS = ("json", "binary")
+
+# Format new snapshots are written in. Either can be read, so switching only affects snapshots written afterwards.
+SNAPSHOT_HOLDINGS_FORMAT = os.getenv("SNAPSHOT_HOLDINGS_FORMAT", "json")
+
+if SNAPSHOT_HOLDINGS_FORMAT not in SNAPSHOT_HOLDINGS_FORMATS:
+    raise ValueError(
+        f"Invalid SNAPSHOT_HOLDINGS_FORMAT: {SNAPSHOT_HOLDINGS_FORMAT}. Must be one of {list(SNAPSHOT_HOLDINGS_FORMATS)}"
+    )
+
+# Committed coin dictionary entries. Ids added inside a transaction wait in session.info until it commits, so a
+# rollback can never leave an id cached that another transaction then assigns to a different coin.
+_coin_ids = {}
+_coin_names = {}
+
+
+def _remember_coins(pairs: Iterable):
+    for coin_id, coin_name in pairs:
+        _coin_ids[coin_name] = coin_id
+        _coin_names[coin_id] = coin_name
+
+
+def forget_coin_dictionary():
+    _coin_ids.clear()
+    _coin_names.clear()
+
+
+@event.listens_for(Session, "after_commit")
+def _cache_committed_coins(session):
+    _remember_coins(session.info.pop("pending_snapshot_coins", {}).items())
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_uncommitted_coins(session):
+    session.info.pop("pending_snapshot_coins", None)
+
+
+def _load_coins(db: Session, query) -> dict:
+    """Runs a (id, coin_name) query, caching the rows other transactions committed and returning all of them."""
+    pending = db.info.get("pending_snapshot_coins", {})
+    rows = dict(query)
+    _remember_coins((coin_id, coin_name) for coin_id, coin_name in rows.items() if coin_id not in pending)
+    return rows
+
+
+def get_coin_ids(db: Session, coin_names: Iterable[str]) -> dict:
+    """Returns {coin_name: id} from the coin dictionary, adding coins it has not seen in the caller's transaction."""
+    coin_names = set(coin_names)
+    missing = [coin for coin in coin_names if coin not in _coin_ids]
+    coin_ids = {}
+
+    if missing:
+        dialect_insert = sqlite_insert if db.get_bind().dialect.name == "sqlite" else postgresql_insert
+        inserted = dict(db.execute(
+            dialect_insert(SnapshotCoin)
+            .values([{"coin_name": coin} for coin in missing])
+            .on_conflict_do_nothing(index_elements=["coin_name"])
+            .returning(SnapshotCoin.id, SnapshotCoin.coin_name)
+        ).all())
+        # Ids inserted here are only cached once the transaction commits
+        db.info.setdefault("pending_snapshot_coins", {}).update(inserted)
+
+        existing = _load_coins(db, db.query(SnapshotCoin.id, SnapshotCoin.coin_name).filter(
+            SnapshotCoin.coin_name.in_([coin for coin in missing if coin not in inserted.values()])
+        ))
+        coin_ids.update((coin_name, coin_id) for coin_id, coin_name in {**inserted, **existing}.items())
+
+    coin_ids.update((coin, _coin_ids[coin]) for coin in coin_names if coin in _coin_ids)
+    return coin_ids
+
+
+def get_coin_names(db: Session, coin_ids: Iterable[int]) -> dict:
+    """Returns {id: coin_name} for the given coin dictionary ids."""
+    coin_ids = set(coin_ids)
+    missing = [coin_id for coin_id in coin_ids if coin_id not in _coin_names]
+    coin_names = {coin_id: _coin_names[coin_id] for coin_id in coin_ids if coin_id in _coin_names}
+
+    if missing:
+        coin_names.update(_load_coins(
+            db, db.query(SnapshotCoin.id, SnapshotCoin.coin_name).filter(SnapshotCoin.id.in_(missing))
+        ))
+    return coin_names
+
+
+def holdings_columns(db: Session, holdings: dict) -> dict:
+    """Column values storing holdings in SNAPSHOT_HOLDINGS_FORMAT, for a WalletActivityData row or bulk insert."""
+    if SNAPSHOT_HOLDINGS_FORMAT == "binary":
+        return {"holdings_blob": encode_holdings(holdings, get_coin_ids(db, holdings))}
+    return {"holdings": holdings}
+
+
+def read_holdings(db: Session, snapshot: WalletActivityData) -> Mapping:
+    """
+    The snapshot's holdings whichever format they were stored in. Binary holdings come back as a HoldingsView
+    that decodes coins as they are read; use dict() on it for a plain copy.
+    """
+    if snapshot.holdings_blob is not None:
+        records = decode_records(snapshot.holdings_blob)
+        return HoldingsView(records, get_coin_names(db, records["coin_id"].tolist()))
+    return snapshot.holdings or {}
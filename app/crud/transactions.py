@@ -0,0 +1,575 @@
+from sqlalchemy.orm import Session, undefer_group
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import insert, literal
+from fastapi import HTTPException, status
+from pydantic import ValidationError
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Iterator, Optional
+import csv
+import heapq
+import io
+import json
+
+from app.models import Wallet, User, Asset, PurchaseTransaction, SaleTransaction, WalletActivityData, AssetLot
+from app.schemas.transactions import TransactionImportRow, TransactionTypeEnum
+from app.CoinCapAPI import fetch_all_assets
+from app.utils.lots import LotBook, LOT_EPSILON
+from app.crud.snapshots import holdings_columns, read_holdings
+
+IMPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 1000
+
+TRANSACTION_EXPORT_COLUMNS = [
+    "id", "type", "coin_name", "quantity", "price_per_coin", "total_price", "coin_quantity_after", "transaction_date"
+]
+SNAPSHOT_EXPORT_COLUMNS = ["id", "wallet_id", "date", "total_value_usd", "holdings"]
+
+
+def parse_import_rows(content: str, file_format: str) -> Iterator[dict]:
+    """
+    Yields raw trade rows from an import payload one at a time. CSV needs a header row of
+    type,coin_name,quantity,price,timestamp. JSON may be a single array of objects or one object per line.
+    """
+    if file_format == "csv":
+        yield from csv.DictReader(io.StringIO(content))
+
+    elif file_format == "json":
+        if content.lstrip().startswith("["):
+            try:
+                rows = json.loads(content)
+            except json.JSONDecodeError as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid JSON: {e}")
+            yield from rows
+        else:
+            for line_number, line in enumerate(io.StringIO(content), start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Invalid JSON on line {line_number}: {e}"
+                    )
+
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid import format: {file_format}. Must be one of ['csv', 'json']"
+        )
+
+
+def _build_import_snapshot(db: Session, wallet_id: int, snapshot_date, positions: dict, prices: dict) -> dict:
+    holdings = {}
+    total_value = 0
+
+    for coin, (quantity, purchase_value_usd) in sorted(positions.items()):
+        if quantity <= 0:
+            continue
+
+        value_on_date = round(quantity * prices.get(coin, 0), 4)
+        holdings[coin] = {
+            "quantity": quantity,
+            "purchase_value_usd": purchase_value_usd,
+            "value_on_date_usd": value_on_date
+        }
+        total_value += value_on_date
+
+    return {
+        "wallet_id": wallet_id,
+        "date": snapshot_date,
+        **holdings_columns(db, holdings),
+        "total_value_usd": total_value
+    }
+
+
+def _load_lot_book(db: Session, wallet: Wallet, asset: Optional[Asset]) -> LotBook:
+    """Seeds an in-memory lot book with the open lots already stored for this wallet and coin."""
+    book = LotBook(wallet.cost_basis_method)
+
+    if asset is None or asset.quantity <= 0:
+        return book
+
+    if wallet.cost_basis_method == "average":
+        book.add(asset.quantity, asset.purchase_value_usd / asset.quantity, asset.initial_purchase_date)
+        return book
+
+    lots = db.query(AssetLot).filter(
+        AssetLot.wallet_id == wallet.id, AssetLot.coin_name == asset.coin_name
+    ).order_by(AssetLot.acquired_at, AssetLot.id).all()
+
+    # Quantity bought before lots were tracked becomes one lot at its average cost, ahead of the tracked lots
+    untracked_quantity = asset.quantity - sum(lot.quantity_remaining for lot in lots)
+    if untracked_quantity > LOT_EPSILON:
+        untracked_cost = asset.purchase_value_usd - sum(lot.quantity_remaining * lot.cost_per_unit for lot in lots)
+        book.add(untracked_quantity, untracked_cost / untracked_quantity, asset.initial_purchase_date)
+
+    for lot in lots:
+        book.add(lot.quantity_remaining, lot.cost_per_unit, lot.acquired_at)
+
+    return book
+
+
+def crud_import_transactions(db: Session, user_id: int, wallet_id: int, rows: Iterable[dict]):
+    """
+    Imports historical trades with explicit prices and timestamps in one database transaction.
+    Rows are validated as they are read and written in executemany batches, sales are matched against in-memory
+    lot books, and positions and lots are written once at the end. A single snapshot is recorded for each day
+    that had trades. Rows must be in chronological order.
+    """
+    try:
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+        wallet = db.query(Wallet).filter(Wallet.id == wallet_id).first()
+        if not wallet:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found")
+
+        if wallet.user_id != user_id:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="This wallet does not belong to the user")
+
+        current_assets = fetch_all_assets()["assets"]
+
+        assets = {asset.coin_name: asset for asset in db.query(Asset).filter(Asset.wallet_id == wallet_id).all()}
+        positions = {coin: [asset.quantity, asset.purchase_value_usd] for coin, asset in assets.items()}
+
+        # Coins held before the import are valued at today's price until the file provides one
+        prices = {coin: float(current_assets[coin].get("priceUsd", 0)) for coin in assets if coin in current_assets}
+
+        books = {}
+        realized_by_coin = {}
+
+        purchases = []
+        sales = []
+        snapshots = []
+        purchases_imported = 0
+        sales_imported = 0
+        rows_imported = 0
+        previous_timestamp = None
+
+        for row_number, raw_row in enumerate(rows, start=1):
+            try:
+                row = TransactionImportRow.model_validate(raw_row)
+            except ValidationError as e:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Row {row_number}: {e.errors(include_url=False)}"
+                )
+
+            coin_name = row.coin_name.lower()
+            timestamp = row.timestamp
+            if timestamp.tzinfo is not None:
+                timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+            if coin_name not in current_assets:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Row {row_number}: Invalid coin name '{coin_name}'"
+                )
+
+            if previous_timestamp and timestamp < previous_timestamp:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Row {row_number}: Rows must be in chronological order"
+                )
+
+            # Rows arrive in order, so a new day means the previous day's holdings are final
+            if previous_timestamp and timestamp.date() != previous_timestamp.date():
+                snapshots.append(_build_import_snapshot(db, wallet_id, previous_timestamp, positions, prices))
+
+            if coin_name not in books:
+                books[coin_name] = _load_lot_book(db, wallet, assets.get(coin_name))
+
+            asset = assets.get(coin_name)
+            if asset is None:
+                asset = Asset(
+                    wallet_id=wallet_id,
+                    coin_name=coin_name,
+                    quantity=0.0,
+                    purchase_value_usd=0.0,
+                    initial_purchase_date=timestamp
+                )
+                db.add(asset)
+                db.flush()
+                assets[coin_name] = asset
+                positions[coin_name] = [0.0, 0.0]
+
+            book = books[coin_name]
+            position = positions[coin_name]
+            total_price = round(row.quantity * row.price, 4)
+
+            if row.type == TransactionTypeEnum.PURCHASE:
+                position[0] += row.quantity
+                position[1] += total_price
+                book.add(row.quantity, total_price / row.quantity, timestamp)
+
+                purchases.append({
+                    "user_id": user_id,
+                    "wallet_id": wallet_id,
+                    "asset_id": asset.id,
+                    "coin_name": coin_name,
+                    "quantity_purchased": row.quantity,
+                    "purchase_price": row.price,
+                    "total_purchase_price": total_price,
+                    "updated_coin_quantity": position[0],
+                    "purchase_date": timestamp
+                })
+                purchases_imported += 1
+
+            else:
+                if position[0] < row.quantity:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Row {row_number}: Insufficient quantity to sell"
+                    )
+                position[0] -= row.quantity
+
+                if position[0] <= LOT_EPSILON:
+                    # Selling everything releases the whole basis, whatever the method
+                    cost_basis = position[1]
+                    book.lots.clear()
+                else:
+                    cost_basis = round(book.consume(row.quantity), 4)
+
+                position[1] -= cost_basis
+                realized_gain_loss = round(total_price - cost_basis, 4)
+                realized_by_coin[coin_name] = realized_by_coin.get(coin_name, 0.0) + realized_gain_loss
+
+                sales.append({
+                    "user_id": user_id,
+                    "wallet_id": wallet_id,
+                    "asset_id": asset.id,
+                    "coin_name": coin_name,
+                    "quantity_sold": row.quantity,
+                    "sale_price": row.price,
+                    "total_sale_price": total_price,
+                    "remaining_coin_quantity": position[0],
+                    "cost_basis_usd": cost_basis,
+                    "realized_gain_loss_usd": realized_gain_loss,
+                    "sale_date": timestamp
+                })
+                sales_imported += 1
+
+            prices[coin_name] = row.price
+            previous_timestamp = timestamp
+            rows_imported += 1
+
+            if len(purchases) >= IMPORT_BATCH_SIZE:
+                db.execute(insert(PurchaseTransaction), purchases)
+                purchases = []
+
+            if len(sales) >= IMPORT_BATCH_SIZE:
+                db.execute(insert(SaleTransaction), sales)
+                sales = []
+
+        if rows_imported == 0:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No rows to import")
+
+        snapshots.append(_build_import_snapshot(db, wallet_id, previous_timestamp, positions, prices))
+
+        if purchases:
+            db.execute(insert(PurchaseTransaction), purchases)
+        if sales:
+            db.execute(insert(SaleTransaction), sales)
+
+        for coin_name, asset in assets.items():
+            asset.quantity, asset.purchase_value_usd = positions[coin_name]
+            asset.realized_gain_loss_usd = (asset.realized_gain_loss_usd or 0.0) + realized_by_coin.get(coin_name, 0.0)
+            if asset.quantity <= 0:
+                db.delete(asset)
+
+        wallet.realized_gain_loss_usd = (wallet.realized_gain_loss_usd or 0.0) + sum(realized_by_coin.values())
+        wallet.version = Wallet.version + 1
+
+        if wallet.cost_basis_method != "average":
+            db.query(AssetLot).filter(
+                AssetLot.wallet_id == wallet_id, AssetLot.coin_name.in_(list(books))
+            ).delete(synchronize_session=False)
+
+            open_lots = [
+                {
+                    "wallet_id": wallet_id,
+                    "coin_name": coin_name,
+                    "acquired_at": acquired_at,
+                    "quantity_remaining": quantity,
+                    "cost_per_unit": cost_per_unit
+                }
+                for coin_name, book in books.items()
+                for quantity, cost_per_unit, acquired_at in book.lots
+                if quantity > LOT_EPSILON
+            ]
+            if open_lots:
+                db.execute(insert(AssetLot), open_lots)
+
+        db.execute(insert(WalletActivityData), snapshots)
+        db.commit()
+
+        print(f"Imported {rows_imported} transactions into wallet {wallet_id}")
+
+        return {
+            "wallet_id": wallet_id,
+            "rows_imported": rows_imported,
+            "purchases_imported": purchases_imported,
+            "sales_imported": sales_imported,
+            "snapshots_created": len(snapshots)
+        }
+
+    except HTTPException:
+        db.rollback()
+        raise
+
+    except SQLAlchemyError as e:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error: " + str(e))
+
+
+class _ExportSink(io.RawIOBase):
+    """Write-only file object that hands back whatever pyarrow has written since the last drain."""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _parse_export_date_range(start_date: Optional[str], end_date: Optional[str]):
+    """Returns a half-open [start, end) datetime range, where end is the day after end_date."""
+    try:
+        start = datetime.strptime(start_date, "%Y-%m-%d") if start_date else None
+        end = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1) if end_date else None
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid date format. Expected format: YYYY-MM-DD"
+        )
+
+    if start and end and start >= end:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="start_date must be before end_date")
+
+    return start, end
+
+
+def _check_export_format(file_format: str):
+    if file_format not in ("csv", "parquet"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid export format: {file_format}. Must be one of ['csv', 'parquet']"
+        )
+
+    if file_format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Parquet export requires pyarrow to be installed"
+            )
+
+
+def _check_export_wallet(db: Session, user_id: int, wallet_id: int):
+    wallet = db.query(Wallet).filter(Wallet.id == wallet_id, Wallet.user_id == user_id).first()
+    if not wallet:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found")
+
+
+def _encode_csv(rows: Iterable[dict], columns: list) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+
+    for count, row in enumerate(rows, start=1):
+        writer.writerow([row[column] for column in columns])
+
+        if count % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue().encode("utf-8")
+
+
+def _encode_parquet(rows: Iterable[dict], schema) -> Iterator[bytes]:
+    """Writes one parquet row group per EXPORT_CHUNK_SIZE rows and yields the bytes as each group is finished."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    sink = _ExportSink()
+    writer = pq.ParquetWriter(sink, schema)
+    chunk = {name: [] for name in schema.names}
+
+    def write_chunk():
+        writer.write_table(pa.Table.from_pydict(chunk, schema=schema))
+        for values in chunk.values():
+            values.clear()
+
+    try:
+        for count, row in enumerate(rows, start=1):
+            for name in schema.names:
+                chunk[name].append(row[name])
+
+            if count % EXPORT_CHUNK_SIZE == 0:
+                write_chunk()
+                yield sink.drain()
+
+        if chunk[schema.names[0]]:
+            write_chunk()
+    finally:
+        writer.close()
+
+    yield sink.drain()
+
+
+def _stream_wallet_trades(session: Session, wallet_id: int, start: Optional[datetime], end: Optional[datetime]):
+    """Merges the purchase and sale cursors by date, so neither table is ever held in memory."""
+    purchase_query = session.query(
+        PurchaseTransaction.id,
+        literal("purchase"),
+        PurchaseTransaction.coin_name,
+        PurchaseTransaction.quantity_purchased,
+        PurchaseTransaction.purchase_price,
+        PurchaseTransaction.total_purchase_price,
+        PurchaseTransaction.updated_coin_quantity,
+        PurchaseTransaction.purchase_date
+    ).filter(PurchaseTransaction.wallet_id == wallet_id)
+
+    sale_query = session.query(
+        SaleTransaction.id,
+        literal("sale"),
+        SaleTransaction.coin_name,
+        SaleTransaction.quantity_sold,
+        SaleTransaction.sale_price,
+        SaleTransaction.total_sale_price,
+        SaleTransaction.remaining_coin_quantity,
+        SaleTransaction.sale_date
+    ).filter(SaleTransaction.wallet_id == wallet_id)
+
+    if start:
+        purchase_query = purchase_query.filter(PurchaseTransaction.purchase_date >= start)
+        sale_query = sale_query.filter(SaleTransaction.sale_date >= start)
+    if end:
+        purchase_query = purchase_query.filter(PurchaseTransaction.purchase_date < end)
+        sale_query = sale_query.filter(SaleTransaction.sale_date < end)
+
+    purchases = purchase_query.order_by(
+        PurchaseTransaction.purchase_date, PurchaseTransaction.id).yield_per(EXPORT_CHUNK_SIZE)
+    sales = sale_query.order_by(SaleTransaction.sale_date, SaleTransaction.id).yield_per(EXPORT_CHUNK_SIZE)
+
+    for row in heapq.merge(purchases, sales, key=lambda trade: trade[-1]):
+        yield dict(zip(TRANSACTION_EXPORT_COLUMNS, row))
+
+
+def _stream_wallet_snapshots(session: Session, wallet_id: int, start: Optional[datetime], end: Optional[datetime]):
+    query = (
+        session.query(WalletActivityData)
+        .options(undefer_group("holdings"))
+        .filter(WalletActivityData.wallet_id == wallet_id)
+    )
+
+    if start:
+        query = query.filter(WalletActivityData.date >= start)
+    if end:
+        query = query.filter(WalletActivityData.date < end)
+
+    for snapshot in query.order_by(WalletActivityData.date, WalletActivityData.id).yield_per(EXPORT_CHUNK_SIZE):
+        yield {
+            "id": snapshot.id,
+            "wallet_id": snapshot.wallet_id,
+            "date": snapshot.date,
+            "total_value_usd": snapshot.total_value_usd,
+            "holdings": json.dumps(dict(read_holdings(session, snapshot)))
+        }
+
+
+def _export_stream(db: Session, stream_rows, wallet_id: int, start, end, file_format: str, columns, schema):
+    # The request's session is closed once the route returns, so the stream reads through its own session
+    session = Session(bind=db.get_bind())
+    try:
+        rows = stream_rows(session, wallet_id, start, end)
+        if file_format == "csv":
+            yield from _encode_csv(rows, columns)
+        else:
+            yield from _encode_parquet(rows, schema())
+    finally:
+        session.close()
+
+
+def _transaction_parquet_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("id", pa.int64()),
+        ("type", pa.string()),
+        ("coin_name", pa.string()),
+        ("quantity", pa.float64()),
+        ("price_per_coin", pa.float64()),
+        ("total_price", pa.float64()),
+        ("coin_quantity_after", pa.float64()),
+        ("transaction_date", pa.timestamp("us")),
+    ])
+
+
+def _snapshot_parquet_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("id", pa.int64()),
+        ("wallet_id", pa.int64()),
+        ("date", pa.timestamp("us")),
+        ("total_value_usd", pa.float64()),
+        ("holdings", pa.string()),
+    ])
+
+
+def crud_export_wallet_transactions(
+    db: Session,
+    user_id: int,
+    wallet_id: int,
+    file_format: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None
+) -> Iterator[bytes]:
+    """Streams every purchase and sale for a wallet in date order as CSV or Parquet."""
+    _check_export_format(file_format)
+    start, end = _parse_export_date_range(start_date, end_date)
+    _check_export_wallet(db, user_id, wallet_id)
+
+    return _export_stream(
+        db, _stream_wallet_trades, wallet_id, start, end, file_format,
+        TRANSACTION_EXPORT_COLUMNS, _transaction_parquet_schema
+    )
+
+
+def crud_export_wallet_snapshots(
+    db: Session,
+    user_id: int,
+    wallet_id: int,
+    file_format: str,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None
+) -> Iterator[bytes]:
+    """Streams a wallet's activity snapshots in date order as CSV or Parquet, with holdings as a JSON string."""
+    _check_export_format(file_format)
+    start, end = _parse_export_date_range(start_date, end_date)
+    _check_export_wallet(db, user_id, wallet_id)
+
+    return _export_stream(
+        db, _stream_wallet_snapshots, wallet_id, start, end, file_format,
+        SNAPSHOT_EXPORT_COLUMNS, _snapshot_parquet_schema
+    )
@@ -1,28 +1,32 @@
+import base64
+import binascii
+import json
+import sys
+from typing import List, Optional
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
-import bcrypt
 
-from app.models import User
+from app.models import User, PurgeRequest
 from app.schemas.users import UserCreate, UserUpdate, UserLogin, UserLoginResponse
 from app.schemas.users import UserResponse, UserUpdateResponse, UserDeleteResponse
-from app.utils.security import hash_password, verify_password, create_access_token
+from app.utils.security import hash_password, hash_passwords, verify_password, verify_and_update_password
+from app.utils.security import create_access_token
+from app.crud.deletion import delete_user_rows, forget_deleted
 
 
-def crud_create_user(db: Session, user: UserCreate) -> User:
-    db_user = db.query(User).filter(User.username == user.username).first()
-    if db_user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username already registered"
-        )
+MAX_BULK_USERS = 1000
+
+
+def _conflict_detail(db: Session, username: str) -> str:
+    # Only asked after the unique constraints rejected a user, to say which one did
+    if db.query(User.id).filter(User.username == username).first():
+        return "Username already registered"
+    return "Email already registered"
 
-    db_user = db.query(User).filter(User.email == user.email).first()
-    if db_user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email already registered"
-        )
 
+def crud_create_user(db: Session, user: UserCreate) -> User:
     hashed_password = hash_password(user.password)
 
     new_user = User(
@@ -31,13 +35,86 @@ def crud_create_user(db: Session, user: UserCreate) -> User:
         password_hash=hashed_password
     )
 
-    db.add(new_user)
-    db.commit()
+    # The unique constraints on username and email do the duplicate checks
+    try:
+        db.add(new_user)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=_conflict_detail(db, user.username)
+        )
+
     db.refresh(new_user)
 
     return new_user
 
 
+def crud_create_users(db: Session, users: List[UserCreate]) -> dict:
+    """
+    Creates every user in the batch that doesn't clash with an existing user or an earlier row, and reports each
+    row's id or error. Existing usernames and emails are found with one IN query each, passwords are hashed across
+    the password hasher's workers, and the new users are inserted with a single executemany.
+    """
+    if not 1 <= len(users) <= MAX_BULK_USERS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Between 1 and {MAX_BULK_USERS} users can be created at once"
+        )
+
+    usernames = {user.username for user in users}
+    emails = {user.email for user in users}
+    taken_usernames = {username for (username,) in db.query(User.username).filter(User.username.in_(usernames))}
+    taken_emails = {email for (email,) in db.query(User.email).filter(User.email.in_(emails))}
+
+    results = [
+        {"index": index, "username": user.username, "id": None, "error": None} for index, user in enumerate(users)
+    ]
+    accepted = []
+
+    for result, user in zip(results, users):
+        if user.username in taken_usernames:
+            result["error"] = "Username already registered"
+        elif user.email in taken_emails:
+            result["error"] = "Email already registered"
+        else:
+            accepted.append((result, user))
+        # Later rows with the same username or email clash with this one
+        taken_usernames.add(user.username)
+        taken_emails.add(user.email)
+
+    if accepted:
+        hashed_passwords = hash_passwords([user.password for _, user in accepted])
+        rows = [
+            {"username": user.username, "email": user.email, "password_hash": hashed_password}
+            for (_, user), hashed_password in zip(accepted, hashed_passwords)
+        ]
+
+        try:
+            ids = db.execute(insert(User).returning(User.id, sort_by_parameter_order=True), rows).scalars().all()
+            db.commit()
+        except IntegrityError:
+            # A user registered concurrently, so find out row by row which ones still fit
+            db.rollback()
+            ids = []
+            for row in rows:
+                try:
+                    with db.begin_nested():
+                        ids.append(db.execute(insert(User).returning(User.id), row).scalar_one())
+                except IntegrityError:
+                    ids.append(None)
+            db.commit()
+
+        for (result, user), user_id in zip(accepted, ids):
+            if user_id is None:
+                result["error"] = _conflict_detail(db, user.username)
+            result["id"] = user_id
+
+    created = sum(1 for result in results if result["id"] is not None)
+    return {"created": created, "failed": len(results) - created, "results": results}
+
+
 def crud_get_user_by_username(db: Session, username: str):
     user = db.query(User).filter(User.username == username).first()
 
@@ -54,11 +131,79 @@ def crud_get_user_by_id(db: Session, user_id: int):
     return user
 
 
-def crud_get_all_users(db: Session):
-    users = db.query(User).all()
+def crud_get_all_users(db: Session, limit: int = 100, after_id: Optional[int] = None):
+    # Paged by id: after_id is the last id of the previous page, so each page starts from the primary key
+    query = db.query(User)
+    if after_id is not None:
+        query = query.filter(User.id > after_id)
+    users = query.order_by(User.id).limit(limit).all()
     return users
 
 
+def _prefix_end(prefix: str) -> Optional[str]:
+    """
+    The first string after every string starting with prefix, so a prefix match is an index range scan. None when
+    the prefix is nothing but U+10FFFF, which no string comes after, so the range is left open-ended.
+    """
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        return None
+
+    code = ord(stem[-1]) + 1
+    # Surrogates can't be encoded, so U+D7FF is followed by U+E000
+    if 0xD800 <= code <= 0xDFFF:
+        code = 0xE000
+    return stem[:-1] + chr(code)
+
+
+def _encode_cursor(field: str, value: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([field, value]).encode()).decode()
+
+
+def _decode_cursor(field: str, cursor: str) -> str:
+    try:
+        cursor_field, value = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        cursor_field, value = None, None
+
+    if cursor_field != field or not isinstance(value, str):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    return value
+
+
+def crud_search_users(
+        db: Session,
+        field: str = "username",
+        prefix: Optional[str] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None
+) -> dict:
+    """
+    One page of users ordered by username or email, optionally only those starting with prefix (case-sensitive).
+    Pages are keyset paginated: the cursor holds the last value of the previous page, so every page is a range scan
+    of the unique index on the field and never reads the rows before it.
+    """
+    column = User.username if field == "username" else User.email
+
+    query = db.query(User.id, User.username, User.email)
+    if prefix:
+        query = query.filter(column >= prefix)
+        prefix_end = _prefix_end(prefix)
+        if prefix_end is not None:
+            query = query.filter(column < prefix_end)
+    if cursor:
+        query = query.filter(column > _decode_cursor(field, cursor))
+
+    rows = query.order_by(column).limit(limit + 1).all()
+    page = rows[:limit]
+
+    return {
+        "users": [{"id": user_id, "username": username, "email": email} for user_id, username, email in page],
+        "next_cursor": _encode_cursor(field, getattr(page[-1], field)) if len(rows) > limit else None
+    }
+
+
 def crud_update_user(db: Session, user_id: int, user_update: UserUpdate) -> UserUpdateResponse:
     db_user = db.query(User).filter(User.id == user_id).first()
 
@@ -76,7 +221,7 @@ def crud_update_user(db: Session, user_id: int, user_update: UserUpdate) -> User
         db_user.email = user_update.email
 
     if user_update.password:
-        if bcrypt.checkpw(user_update.password.encode('utf-8'), db_user.password_hash.encode('utf-8')):
+        if verify_password(user_update.password, db_user.password_hash):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="New password must be different from the current password"
@@ -96,8 +241,12 @@ def crud_update_user(db: Session, user_id: int, user_update: UserUpdate) -> User
     )
 
 
-def crud_delete_user(db: Session, user_id: int) -> UserDeleteResponse:
-    db_user = db.query(User).filter(User.id == user_id).first()
+def crud_delete_user(db: Session, user_id: int, background: bool = False) -> UserDeleteResponse:
+    """
+    Deletes the user with all their wallets and everything in them in one transaction. With background, the user
+    is queued for app.jobs.purge instead, which deletes it in short chunks.
+    """
+    db_user = db.query(User.id).filter(User.id == user_id).first()
 
     if not db_user:
         raise HTTPException(
@@ -105,19 +254,40 @@ def crud_delete_user(db: Session, user_id: int) -> UserDeleteResponse:
             detail=f"User: {user_id} not found"
         )
 
-    db.delete(db_user)
+    if background:
+        pending = db.query(PurgeRequest.id).filter(PurgeRequest.user_id == user_id, PurgeRequest.wallet_id.is_(None))
+        if not pending.first():
+            db.add(PurgeRequest(user_id=user_id))
+            db.commit()
+        return UserDeleteResponse(message="User deletion scheduled", user_id=user_id)
+
+    wallet_ids = delete_user_rows(db, user_id)
     db.commit()
+    forget_deleted(user_id, wallet_ids)
 
     return UserDeleteResponse(message="User deleted successfully", user_id=user_id)
 
 
 def crud_authenticate_user(db: Session, username: str, password: str):
     user = db.query(User).filter(User.username == username).first()
-    if user is None or not verify_password(password, user.password_hash):
+    if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid credentials",
         )
+
+    verified, new_hash = verify_and_update_password(password, user.password_hash)
+    if not verified:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid credentials",
+        )
+
+    # The stored hash used an outdated cost factor, so replace it while the plain password is at hand
+    if new_hash:
+        user.password_hash = new_hash
+        db.commit()
+
     return user
 
 
@@ -1,20 +1,48 @@
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import desc, asc, func
+from sqlalchemy.orm import Session, undefer_group
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy import desc, asc, func, update, select, literal, union_all, case
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm.attributes import set_committed_value
 from fastapi import HTTPException, status
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+import calendar
 import time
 
-from app.models import Wallet, User, Asset, PurchaseTransaction, SaleTransaction, WalletActivityData
-from app.CoinCapAPI import valid_coin_names, get_current_coin_data, fetch_dated_coin_price
+from app.models import Wallet, User, Asset, PurchaseTransaction, SaleTransaction, WalletActivityData, AssetLot
+from app.models import WalletDailyValue, WalletDailyValueState, PurgeRequest
+from app.schemas.transactions import BatchOrderLeg, OrderSideEnum
+from app.schemas.transactions import PurchaseTransactionResponse, SaleTransactionResponse
+from app.crud.idempotency import request_fingerprint, get_stored_response, store_response
+from app.CoinCapAPI import valid_coin_names, get_current_coin_data, fetch_dated_coin_price, fetch_all_assets
+from app.utils.lots import COST_BASIS_METHODS, LOT_EPSILON
+from app.utils.timeseries import price_column
+from app.jobs.snapshot_writer import snapshot_writer
+from app.crud.deletion import delete_wallet_rows, forget_deleted
+from app.crud.snapshots import holdings_columns, read_holdings
+
+LOT_FETCH_SIZE = 16
+# One UNION ALL branch per date; SQLite allows 500
+MAX_VALUATION_DATES = 366
+
+
+def _check_cost_basis_method(cost_basis_method: str):
+    if cost_basis_method not in COST_BASIS_METHODS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid cost basis method: {cost_basis_method}. Must be one of {list(COST_BASIS_METHODS)}"
+        )
 
 
-def crud_create_wallet(db: Session, user_id: int):
+def crud_create_wallet(db: Session, user_id: int, cost_basis_method: str = "fifo"):
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    wallet = Wallet(user_id=user_id)
+    _check_cost_basis_method(cost_basis_method)
+
+    wallet = Wallet(user_id=user_id, cost_basis_method=cost_basis_method)
     db.add(wallet)
     db.commit()
     db.refresh(wallet)
@@ -22,6 +50,32 @@ def crud_create_wallet(db: Session, user_id: int):
     return wallet
 
 
+def crud_set_cost_basis_method(db: Session, user_id: int, wallet_id: int, cost_basis_method: str):
+    """
+    FIFO and LIFO read the same lots, so a wallet can move between them at any time. Average cost keeps no lots,
+    so switching to or from it is only allowed while the wallet holds nothing.
+    """
+    wallet = db.query(Wallet).filter(Wallet.id == wallet_id, Wallet.user_id == user_id).first()
+    if not wallet:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found")
+
+    _check_cost_basis_method(cost_basis_method)
+
+    switches_average = "average" in (wallet.cost_basis_method, cost_basis_method)
+    if switches_average and wallet.cost_basis_method != cost_basis_method:
+        if db.query(Asset).filter(Asset.wallet_id == wallet_id).first():
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Average cost can only be switched to or from while the wallet holds no assets"
+            )
+
+    wallet.cost_basis_method = cost_basis_method
+    db.commit()
+    db.refresh(wallet)
+
+    return wallet
+
+
 def crud_get_wallet_by_id(
         db: Session,
         user_id: int,
@@ -87,10 +141,11 @@ def crud_get_wallet_by_id(
             "id": asset.id,
             "coin_name": asset.coin_name,
             "quantity": asset.quantity,
-            "purchase_value_usd": asset.purchase_value_usd,  # Summation of purchase price of asset
+            "purchase_value_usd": asset.purchase_value_usd,  # Cost basis of the quantity still held
             "current_price_usd": coin_data.get("priceUsd", 0),  # Price for one coin on current date
             "current_value_usd": current_value,
-            "net_gain_loss": net_gain_loss,
+            "net_gain_loss": net_gain_loss,  # Unrealized, against the cost basis of what is still held
+            "realized_gain_loss_usd": asset.realized_gain_loss_usd or 0.0,
             "initial_purchase_date": asset.initial_purchase_date,
             "coin_cap_id": coin_data.get("id", ""),
             "coin_cap_rank": int(coin_data.get("rank", 0)),
@@ -117,38 +172,117 @@ def crud_get_wallet_by_id(
     return total_count, total_pages, total_wallet_value, paginated_assets
 
 
-def create_wallet_activity_snapshot(db: Session, user_id: int, wallet_id: int):
-    total_count, total_pages, total_wallet_value, enhanced_assets = crud_get_wallet_by_id(
-        db=db,
-        user_id=user_id,
-        wallet_id=wallet_id,
-        limit=1000,
-        page=1,
-        sort_by="coin_name",
-        sort_order="asc"
-    )
+def _value_holding(quantity: float, purchase_value_usd: float, coin_data: dict) -> dict:
+    return {
+        "quantity": quantity,
+        "purchase_value_usd": purchase_value_usd,  # Cost basis of the quantity still held
+        "value_on_date_usd": round(quantity * float(coin_data.get("priceUsd", 0)), 4)  # Valuation on snapshot date
+    }
+
 
+def build_wallet_holdings(db: Session, wallet_id: int, market_assets: dict) -> dict:
+    """Values every asset row of the wallet against the in-memory price table."""
     holdings = {}
-    for asset in enhanced_assets:
-        holdings[asset["coin_name"]] = {
-            "quantity": asset["quantity"],
-            "purchase_value_usd": asset["purchase_value_usd"],  # Summation of asset total purchase cost
-            "value_on_date_usd": asset["current_value_usd"]  # Valuation of asset quantity on date of snapshot
+    for asset in db.query(Asset).filter(Asset.wallet_id == wallet_id).all():
+        coin_data = market_assets.get(asset.coin_name)
+        if coin_data is None:
+            print(f"missing {asset.coin_name}")
+            continue
+        holdings[asset.coin_name] = _value_holding(asset.quantity, asset.purchase_value_usd, coin_data)
+
+    return holdings
+
+
+def _traded_since(db: Session, wallet_id: int, since: datetime, coin_names: set) -> bool:
+    """Whether the wallet traded coins other than coin_names after since, which a snapshot taken then misses."""
+    for model, date_column in (
+        (PurchaseTransaction, PurchaseTransaction.purchase_date),
+        (SaleTransaction, SaleTransaction.sale_date),
+    ):
+        query = db.query(model.id).filter(model.wallet_id == wallet_id, date_column > since)
+        if coin_names:
+            query = query.filter(model.coin_name.notin_(coin_names))
+        if query.first() is not None:
+            return True
+    return False
+
+
+def build_wallet_activity_snapshot(
+        db: Session,
+        wallet_id: int,
+        coin_names: Optional[Iterable[str]] = None,
+        snapshot_date: Optional[datetime] = None
+) -> WalletActivityData:
+    """
+    Builds the wallet's holdings after a trade. When the coins touched by the trade are given, the snapshot is
+    the previous one with only those coins re-read from their asset rows; every holding is then re-priced from the
+    cached asset table. Without touched coins or a previous snapshot, or when the previous one is dated before
+    trades in other coins (an end-of-day row written late), every asset row is valued instead.
+    """
+    market_assets = fetch_all_assets()["assets"]
+
+    previous = None
+    touched = set(coin_names) if coin_names is not None else None
+    if touched is not None:
+        # Latest written rather than latest dated, so backfilled history from an import is never the base
+        previous = db.query(WalletActivityData).options(undefer_group("holdings")).filter(
+            WalletActivityData.wallet_id == wallet_id
+        ).order_by(desc(WalletActivityData.id)).first()
+        if previous is not None and _traded_since(db, wallet_id, previous.date, touched):
+            previous = None
+
+    if previous is None:
+        holdings = build_wallet_holdings(db, wallet_id, market_assets)
+    else:
+        holdings = {
+            coin: dict(holding) for coin, holding in read_holdings(db, previous).items() if coin not in touched
         }
 
-    snapshot = WalletActivityData(
+        if touched:
+            for asset in db.query(Asset).filter(Asset.wallet_id == wallet_id, Asset.coin_name.in_(touched)):
+                holdings[asset.coin_name] = {
+                    "quantity": asset.quantity,
+                    "purchase_value_usd": asset.purchase_value_usd
+                }
+
+        for coin, holding in list(holdings.items()):
+            coin_data = market_assets.get(coin)
+            if coin_data is not None:
+                holdings[coin] = _value_holding(holding["quantity"], holding["purchase_value_usd"], coin_data)
+            elif "value_on_date_usd" not in holding:
+                print(f"missing {coin}")
+                del holdings[coin]
+            # A coin missing from the price table keeps its last valuation
+
+    return WalletActivityData(
         wallet_id=wallet_id,
-        date=datetime.utcnow(),
-        holdings=holdings,
-        total_value_usd=total_wallet_value
+        date=snapshot_date or datetime.utcnow(),
+        **holdings_columns(db, dict(sorted(holdings.items()))),
+        total_value_usd=sum(holding["value_on_date_usd"] for _, holding in sorted(holdings.items()))
     )
 
-    db.add(snapshot)
+
+def create_wallet_activity_snapshot(
+        db: Session,
+        user_id: int,
+        wallet_id: int,
+        coin_names: Optional[Iterable[str]] = None
+):
+    db.add(build_wallet_activity_snapshot(db, wallet_id, coin_names))
     db.commit()
 
 
-def crud_get_all_wallets(db: Session):
-    wallets = db.query(Wallet).all()
+def record_wallet_activity(db: Session, user_id: int, wallet_id: int, coin_names: Optional[Iterable[str]] = None):
+    """Hands the snapshot to the background writer, or writes it now when the writer isn't running."""
+    if snapshot_writer.submit(user_id=user_id, wallet_id=wallet_id, coin_names=coin_names):
+        return "queued"
+
+    create_wallet_activity_snapshot(db=db, user_id=user_id, wallet_id=wallet_id, coin_names=coin_names)
+    return "created"
+
+
+def crud_get_all_wallets(db: Session, user_id: int):
+    wallets = db.query(Wallet).filter(Wallet.user_id == user_id).all()
 
     if not wallets:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No wallets found")
@@ -156,25 +290,95 @@ def crud_get_all_wallets(db: Session):
     return wallets
 
 
-def crud_get_all_transactions_for_wallet(
-    db: Session,
-    user_id: int,
-    wallet_id: int,
-    limit: int,
-    page: int
-):
-    wallet = db.query(Wallet).filter(Wallet.id == wallet_id, Wallet.user_id == user_id).first()
-    if not wallet:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found")
+def crud_get_user_portfolio(db: Session, user_id: int):
+    """
+    Values everything a user holds across all their wallets. Quantities are summed per coin in one grouped query,
+    each distinct coin is priced once from the cached asset table, and the per-wallet totals are computed by a second
+    grouped query with those prices passed in, so no row per wallet and coin is read.
+    """
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    offset = (page - 1) * limit
+    coin_rows = (
+        db.query(
+            Asset.coin_name,
+            func.sum(Asset.quantity),
+            func.sum(Asset.purchase_value_usd),
+            func.count(Asset.wallet_id)
+        )
+        .join(Wallet, Wallet.id == Asset.wallet_id)
+        .filter(Wallet.user_id == user_id, Asset.quantity > LOT_EPSILON)
+        .group_by(Asset.coin_name)
+        .order_by(Asset.coin_name)
+        .all()
+    )
 
-    purchase_transactions = db.query(
-        PurchaseTransaction).filter(PurchaseTransaction.wallet_id == wallet_id).offset(offset).limit(limit).all()
+    market_assets = fetch_all_assets()["assets"] if coin_rows else {}
+    prices = {}
+    missing_prices = []
+    coins = []
 
-    sale_transactions = db.query(
-        SaleTransaction).filter(SaleTransaction.wallet_id == wallet_id).offset(offset).limit(limit).all()
+    for coin_name, quantity, purchase_value_usd, wallet_count in coin_rows:
+        coin_data = market_assets.get(coin_name)
+        if coin_data is None:
+            print(f"missing {coin_name}")
+            missing_prices.append(coin_name)
+        prices[coin_name] = float(coin_data.get("priceUsd", 0)) if coin_data else 0.0
+
+        current_value = round(quantity * prices[coin_name], 4)
+        coins.append({
+            "coin_name": coin_name,
+            "quantity": quantity,
+            "purchase_value_usd": purchase_value_usd,
+            "current_price_usd": prices[coin_name],
+            "current_value_usd": current_value,
+            "net_gain_loss": round(current_value - purchase_value_usd, 4),
+            "wallet_count": wallet_count
+        })
+
+    held = Asset.quantity > LOT_EPSILON
+    price = case(prices, value=Asset.coin_name, else_=0.0) if prices else literal(0.0)
+    wallet_rows = (
+        db.query(
+            Wallet.id,
+            func.count(Asset.id).filter(held),
+            func.coalesce(func.sum(Asset.purchase_value_usd).filter(held), 0.0),
+            func.coalesce(func.sum(Asset.quantity * price).filter(held), 0.0)
+        )
+        .outerjoin(Asset, Asset.wallet_id == Wallet.id)
+        .filter(Wallet.user_id == user_id)
+        .group_by(Wallet.id)
+        .order_by(Wallet.id)
+    )
+
+    wallets = []
+    for wallet_id, coin_count, purchase_value_usd, current_value in wallet_rows:
+        current_value = round(current_value, 4)
+        wallets.append({
+            "wallet_id": wallet_id,
+            "coin_count": coin_count,
+            "purchase_value_usd": purchase_value_usd,
+            "current_value_usd": current_value,
+            "net_gain_loss": round(current_value - purchase_value_usd, 4)
+        })
 
+    total_value = round(sum(coin["current_value_usd"] for coin in coins), 4)
+    total_purchase_value = sum(coin["purchase_value_usd"] for coin in coins)
+
+    return {
+        "user_id": user_id,
+        "total_value_usd": total_value,
+        "total_purchase_value_usd": total_purchase_value,
+        "net_gain_loss": round(total_value - total_purchase_value, 4),
+        "missing_prices": missing_prices,
+        "coins": coins,
+        "wallets": wallets
+    }
+
+
+def _transaction_page(purchase_transactions: List, sale_transactions: List, limit: int):
+    """A page of a wallet's purchases and sales as transaction rows, newest first, with the page counts."""
     if not purchase_transactions and not sale_transactions:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="No Transactions for Wallet... Try buying a coin"
@@ -211,6 +415,54 @@ def crud_get_all_transactions_for_wallet(
     return all_transactions, total_transactions, total_pages
 
 
+def crud_get_all_transactions_for_wallet(
+    db: Session,
+    user_id: int,
+    wallet_id: int,
+    limit: int,
+    page: int
+):
+    wallet = db.query(Wallet).filter(Wallet.id == wallet_id, Wallet.user_id == user_id).first()
+    if not wallet:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found")
+
+    offset = (page - 1) * limit
+
+    purchase_transactions = db.query(
+        PurchaseTransaction).filter(PurchaseTransaction.wallet_id == wallet_id).offset(offset).limit(limit).all()
+
+    sale_transactions = db.query(
+        SaleTransaction).filter(SaleTransaction.wallet_id == wallet_id).offset(offset).limit(limit).all()
+
+    return _transaction_page(purchase_transactions, sale_transactions, limit)
+
+
+def _materialized_values(db: Session, wallet: Wallet, days: List) -> dict:
+    """
+    {day: (total_value_usd, coin_prices)} from wallet_daily_values for whichever of the days it has, in one indexed
+    lookup. Rows are only used while they reflect every trade of the wallet.
+    """
+    rows = (
+        db.query(WalletDailyValue.day, WalletDailyValue.total_value_usd, WalletDailyValue.coin_prices)
+        .join(WalletDailyValueState, WalletDailyValueState.wallet_id == WalletDailyValue.wallet_id)
+        .filter(
+            WalletDailyValue.wallet_id == wallet.id,
+            WalletDailyValue.day.in_(days),
+            WalletDailyValue.coin_prices.isnot(None),
+            WalletDailyValueState.version == wallet.version
+        )
+    )
+    return {day: (total_value_usd, coin_prices) for day, total_value_usd, coin_prices in rows}
+
+
+def _price_holdings(holdings: dict, coin_prices: dict) -> dict:
+    """Copies of the snapshot holdings with each coin's value_on_date_requested at the given prices."""
+    priced = {coin: dict(holding) for coin, holding in holdings.items()}
+    for coin, holding in priced.items():
+        holding["value_on_date_requested"] = holding["quantity"] * coin_prices.get(coin, 0)
+    return priced
+
+
 def crud_get_wallet_valuation(db: Session, user_id: int, wallet_id: int, historical_date: str):
 
     try:
@@ -238,92 +490,93 @@ def crud_get_wallet_valuation(db: Session, user_id: int, wallet_id: int, histori
 
         snap_shot_date_relative_to_historic_date = ""
         date_requested_total_value = 0
+        holdings = {}
+
+        # Half-open range on the raw column, so the (wallet_id, date) index answers exact and past in one query
+        day_start = datetime.combine(historical_date_dt, datetime.min.time())
+        next_day_start = day_start + timedelta(days=1)
 
-        # Step 1: Try to find the latest snapshot from the exact date
+        # Step 1: The latest snapshot before the end of the requested date
         activity = (
             db.query(WalletActivityData)
+            .options(undefer_group("holdings"))
             .filter(
                 WalletActivityData.wallet_id == wallet_id,
-                func.date(WalletActivityData.date) == historical_date_dt  # Ensure exact date match
+                WalletActivityData.date < next_day_start
             )
-            .order_by(desc(WalletActivityData.date))  # Get the most recent snapshot from that day
+            .order_by(desc(WalletActivityData.date))  # Get the most recent snapshot up to that day
             .first()
         )
 
-        if activity:
+        if activity and activity.date >= day_start:
             print("found exact date requested")
+            holdings = dict(read_holdings(db, activity))
             snap_shot_date_relative_to_historic_date = "current"
             date_requested_total_value = activity.total_value_usd
 
-        # Step 2: If no exact match, find the closest past snapshot
-        if not activity:
-            print("No exact match, checking closest past snapshot")
-            activity = (
-                db.query(WalletActivityData)
-                .filter(
-                    WalletActivityData.wallet_id == wallet_id,
-                    WalletActivityData.date < historical_date_dt  # Any date before the requested date
-                )
-                .order_by(desc(WalletActivityData.date))  # Get the most recent past snapshot
-                .first()
-            )
+        # Step 2: If no exact match, the snapshot found is the closest past snapshot
+        elif activity:
+            print("Found past snapshot")
+            snap_shot_date_relative_to_historic_date = "past"
 
-            if activity:
-                print("Found past snapshot")
-                snap_shot_date_relative_to_historic_date = "past"
+            """
+            If snap shot is from the past then the user is requesting the value of assets from a future date.
+            Now we query CoinCapAPI for the price of each asset on the date requested and add this value to the data
+            for each of the coins within holding. These added up are used for date_requested_total_value
+            """
 
-                """
-                If snap shot is from the past then the user is requesting the value of assets from a future date.
-                Now we query CoinCapAPI for the price of each asset on the date requested and add this value to the data
-                for each of the coins within holding. These added up are used for date_requested_total_value
-                """
+            materialized = _materialized_values(db, wallet, [historical_date_dt])
 
+            if historical_date_dt in materialized:
+                print("Using materialized daily value")
+                date_requested_total_value, coin_prices = materialized[historical_date_dt]
+                holdings = _price_holdings(read_holdings(db, activity), coin_prices)
+            else:
                 date_in_seconds = int(time.mktime(time.strptime(historical_date, "%Y-%m-%d")))
 
-                for coin in activity.holdings:
+                holdings = {coin: dict(holding) for coin, holding in read_holdings(db, activity).items()}
+
+                for coin in holdings:
                     data = fetch_dated_coin_price(
                         coin_name=coin,
                         start_timestamp=date_in_seconds,
                         end_timestamp=date_in_seconds
                     )
                     data_price_per_coin = data[-1]["priceUsd"]
-                    asset_quantity = activity.holdings[coin]["quantity"]
+                    asset_quantity = holdings[coin]["quantity"]
                     value_on_date_requested = float(data_price_per_coin) * asset_quantity
                     date_requested_total_value += value_on_date_requested
-                    activity.holdings[coin]["value_on_date_requested"] = date_requested_total_value
+                    holdings[coin]["value_on_date_requested"] = date_requested_total_value
 
-        # Step 3: If no past snapshot exists, get the closest future snapshot
+        # Step 3: If no past snapshot exists, get the last snapshot of the nearest future date with activity
         if not activity:
             print("No exact match, checking closest future snapshot")
 
-            # Step 1: Find the nearest future date with activity
-            nearest_future_date = (
-                db.query(func.date(WalletActivityData.date))  # Extract only the date
+            nearest_future_day = (
+                db.query(func.min(WalletActivityData.snapshot_day))
                 .filter(
                     WalletActivityData.wallet_id == wallet_id,
-                    WalletActivityData.date > historical_date_dt  # Any date after the requested date
+                    WalletActivityData.snapshot_day > historical_date_dt
                 )
-                .order_by(asc(WalletActivityData.date))  # Get the nearest future date
-                .limit(1)
-                .scalar()  # Fetch the single value (earliest future date)
+                .scalar_subquery()
             )
 
-            # Step 2: If we found nearest future date, get the last snapshot of that date
-            if nearest_future_date:
-                nearest_future_date = str(nearest_future_date)
-                activity = (
-                    db.query(WalletActivityData)
-                    .filter(
-                        WalletActivityData.wallet_id == wallet_id,
-                        func.date(WalletActivityData.date) == nearest_future_date
-                    )
-                    .order_by(desc(WalletActivityData.date))
-                    .first()
+            activity = (
+                db.query(WalletActivityData)
+                .options(undefer_group("holdings"))
+                .filter(
+                    WalletActivityData.wallet_id == wallet_id,
+                    WalletActivityData.snapshot_day == nearest_future_day
                 )
-                if activity:
-                    print("Found future snapshot")
-                    snap_shot_date_relative_to_historic_date = "future"
-                    date_requested_total_value = activity.total_value_usd
+                .order_by(desc(WalletActivityData.date))
+                .first()
+            )
+
+            if activity:
+                print("Found future snapshot")
+                holdings = dict(read_holdings(db, activity))
+                snap_shot_date_relative_to_historic_date = "future"
+                date_requested_total_value = activity.total_value_usd
 
         # If no activity data found at all, raise an error
         if not activity:
@@ -337,7 +590,7 @@ def crud_get_wallet_valuation(db: Session, user_id: int, wallet_id: int, histori
             "wallet_id": activity.wallet_id,
             "snap_shot_date": activity.date.strftime("%Y-%m-%d %H:%M:%S"),
             "snap_shot_date_relative_to_historic_date": snap_shot_date_relative_to_historic_date,
-            "holdings": activity.holdings,
+            "holdings": holdings,
             "total_value_usd_on_snapshot_date": activity.total_value_usd,
             "date_requested_total_value": date_requested_total_value,
             "net_gain_loss": date_requested_total_value - activity.total_value_usd
@@ -350,12 +603,413 @@ def crud_get_wallet_valuation(db: Session, user_id: int, wallet_id: int, histori
         )
 
 
+def _resolve_valuation_snapshots(db: Session, wallet_id: int, days: List) -> dict:
+    """
+    The snapshot valuation-by-date would use for each day, in one query: per day, the latest snapshot before the
+    end of the day, or failing that the last snapshot of the nearest later day with activity. Returns
+    {day: WalletActivityData}, without the days no snapshot resolves for.
+    """
+    lookups = []
+    for position, day in enumerate(days):
+        next_day_start = datetime.combine(day + timedelta(days=1), datetime.min.time())
+
+        latest_before = (
+            select(WalletActivityData.id)
+            .where(WalletActivityData.wallet_id == wallet_id, WalletActivityData.date < next_day_start)
+            .order_by(desc(WalletActivityData.date))
+            .limit(1)
+            .scalar_subquery()
+        )
+        nearest_future_day = (
+            select(func.min(WalletActivityData.snapshot_day))
+            .where(WalletActivityData.wallet_id == wallet_id, WalletActivityData.snapshot_day > day)
+            .scalar_subquery()
+        )
+        last_of_future_day = (
+            select(WalletActivityData.id)
+            .where(WalletActivityData.wallet_id == wallet_id, WalletActivityData.snapshot_day == nearest_future_day)
+            .order_by(desc(WalletActivityData.date))
+            .limit(1)
+            .scalar_subquery()
+        )
+        lookups.append(select(
+            literal(position).label("position"),
+            func.coalesce(latest_before, last_of_future_day).label("snapshot_id")
+        ))
+
+    resolved = union_all(*lookups).subquery()
+    rows = (
+        db.query(resolved.c.position, WalletActivityData)
+        .join(WalletActivityData, WalletActivityData.id == resolved.c.snapshot_id)
+        .options(undefer_group("holdings"))
+    )
+    return {days[position]: activity for position, activity in rows}
+
+
+def crud_get_wallet_valuations(db: Session, user_id: int, wallet_id: int, historical_dates: List[str]):
+    """
+    valuation-by-date for several dates at once. The snapshots for every date are resolved in one query, and coins
+    held in past snapshots are priced from one history request per coin covering all the dates that need it.
+    """
+    try:
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+        wallet = db.query(Wallet).filter(Wallet.id == wallet_id).first()
+        if not wallet:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found")
+
+        if wallet.user_id != user_id:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="This wallet does not belong to the user"
+            )
+
+        try:
+            days = sorted({
+                datetime.strptime(historical_date, "%Y-%m-%d").date() for historical_date in historical_dates
+            })
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid date format. Expected format: YYYY-MM-DD"
+            )
+
+        if not days or len(days) > MAX_VALUATION_DATES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Between 1 and {MAX_VALUATION_DATES} dates can be valued at once"
+            )
+
+        activities = _resolve_valuation_snapshots(db, wallet_id, days)
+        # Days without a snapshot are left out of the valuations rather than failing the others
+        days = [day for day in days if day in activities]
+        if not activities:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No wallet activity data found for the given date or nearby dates"
+            )
+
+        holdings_by_day = {day: dict(read_holdings(db, activity)) for day, activity in activities.items()}
+        past_days = [day for day in days if activities[day].date < datetime.combine(day, datetime.min.time())]
+        materialized = _materialized_values(db, wallet, past_days) if past_days else {}
+
+        # Snapshots older than their date are re-priced at the date, from the materialized daily values where they
+        # exist and otherwise from one history request per coin covering all the remaining dates
+        unpriced_days = [day for day in past_days if day not in materialized]
+        prices = {}
+        missing_prices = []
+        if unpriced_days:
+            coins = sorted({coin for day in unpriced_days for coin in holdings_by_day[day]})
+            for coin in coins:
+                candles = fetch_dated_coin_price(
+                    coin_name=coin,
+                    start_timestamp=calendar.timegm(unpriced_days[0].timetuple()),
+                    end_timestamp=calendar.timegm(unpriced_days[-1].timetuple())
+                )
+                column = price_column(unpriced_days, candles)
+                if column is None:
+                    missing_prices.append(coin)
+                else:
+                    prices[coin] = dict(zip(unpriced_days, column.tolist()))
+
+        valuations = []
+        for day in days:
+            activity = activities[day]
+            day_start = datetime.combine(day, datetime.min.time())
+
+            if day in materialized:
+                relative = "past"
+                date_requested_total_value, coin_prices = materialized[day]
+                holdings = _price_holdings(holdings_by_day[day], coin_prices)
+            elif activity.date < day_start:
+                relative = "past"
+                holdings = _price_holdings(
+                    holdings_by_day[day], {coin: coin_prices.get(day, 0) for coin, coin_prices in prices.items()}
+                )
+                date_requested_total_value = sum(holding["value_on_date_requested"] for holding in holdings.values())
+            else:
+                relative = "current" if activity.date < day_start + timedelta(days=1) else "future"
+                holdings = holdings_by_day[day]
+                date_requested_total_value = activity.total_value_usd
+
+            valuations.append({
+                "historical_date": day,
+                "snap_shot_date": activity.date.strftime("%Y-%m-%d %H:%M:%S"),
+                "snap_shot_date_relative_to_historic_date": relative,
+                "holdings": holdings,
+                "total_value_usd_on_snapshot_date": activity.total_value_usd,
+                "date_requested_total_value": date_requested_total_value,
+                "net_gain_loss": date_requested_total_value - activity.total_value_usd
+            })
+
+        return {"wallet_id": wallet_id, "missing_prices": missing_prices, "valuations": valuations}
+
+    except SQLAlchemyError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Database error: " + str(e)
+        )
+
+
+def _get_or_create_asset(db: Session, wallet_id: int, coin_name: str) -> Asset:
+    """
+    Returns the wallet's asset row for a coin, inserting an empty one if needed. The insert is a no-op on conflict
+    so two first purchases of the same coin racing each other end up sharing one row instead of failing.
+    """
+    asset = db.query(Asset).filter(Asset.wallet_id == wallet_id, Asset.coin_name == coin_name).first()
+    if asset:
+        return asset
+
+    values = dict(
+        wallet_id=wallet_id,
+        coin_name=coin_name,
+        quantity=0.0,
+        purchase_value_usd=0.0,
+        initial_purchase_date=datetime.utcnow()
+    )
+    dialect = db.get_bind().dialect.name
+
+    if dialect in ("sqlite", "postgresql"):
+        dialect_insert = sqlite_insert if dialect == "sqlite" else postgresql_insert
+        db.execute(
+            dialect_insert(Asset).values(**values).on_conflict_do_nothing(index_elements=["wallet_id", "coin_name"])
+        )
+    else:
+        db.add(Asset(**values))
+        db.flush()
+
+    return db.query(Asset).filter(Asset.wallet_id == wallet_id, Asset.coin_name == coin_name).one()
+
+
+def _apply_purchase(
+        db: Session,
+        user_id: int,
+        wallet_id: int,
+        asset: Optional[Asset],
+        coin_name: str,
+        quantity: float,
+        coin_value: float,
+        cost_basis_method: str = "fifo"
+):
+    """
+    Adds a purchase to the session without committing, creating the asset on its first purchase and opening a lot
+    for it. The position is incremented in SQL rather than read-modify-write, so concurrent buys never lose an update.
+    """
+    calculated_value_of_coin_quantity = round(quantity * coin_value, 4)
+
+    for _ in range(3):
+        if asset is None:
+            asset = _get_or_create_asset(db, wallet_id, coin_name)
+
+        updated = db.execute(
+            update(Asset)
+            .where(Asset.id == asset.id)
+            .values(
+                quantity=Asset.quantity + quantity,
+                purchase_value_usd=Asset.purchase_value_usd + calculated_value_of_coin_quantity
+            )
+            .returning(Asset.quantity, Asset.purchase_value_usd)
+            .execution_options(synchronize_session=False)
+        ).first()
+
+        if updated:
+            break
+
+        # The row was removed by a concurrent sale that emptied it, so start a new one
+        asset = None
+    else:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Asset changed during purchase, try again")
+
+    set_committed_value(asset, "quantity", updated.quantity)
+    set_committed_value(asset, "purchase_value_usd", updated.purchase_value_usd)
+
+    db.execute(
+        update(Wallet)
+        .where(Wallet.id == wallet_id)
+        .values(version=Wallet.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+    purchase_transaction = PurchaseTransaction(
+        user_id=user_id,
+        wallet_id=wallet_id,
+        asset_id=asset.id,
+        coin_name=coin_name,
+        quantity_purchased=quantity,
+        purchase_price=coin_value,
+        total_purchase_price=calculated_value_of_coin_quantity,
+        updated_coin_quantity=updated.quantity,
+        purchase_date=datetime.utcnow()
+    )
+    db.add(purchase_transaction)
+
+    # Average cost only needs the asset totals, so it keeps no lots
+    if cost_basis_method != "average":
+        db.add(AssetLot(
+            wallet_id=wallet_id,
+            coin_name=coin_name,
+            purchase_transaction=purchase_transaction,
+            acquired_at=purchase_transaction.purchase_date,
+            quantity_remaining=quantity,
+            cost_per_unit=calculated_value_of_coin_quantity / quantity
+        ))
+
+    return asset, purchase_transaction
+
+
+def _consume_lots(db: Session, wallet_id: int, coin_name: str, quantity: float, cost_basis_method: str):
+    """
+    Matches a sale against open lots, oldest first for FIFO or newest first for LIFO, and returns the cost of the
+    matched quantity plus any quantity no lot covered. The composite lot index means only the lots actually
+    consumed are read. Lots used up by the sale are deleted.
+    """
+    if cost_basis_method == "lifo":
+        lot_order = (desc(AssetLot.acquired_at), desc(AssetLot.id))
+    else:
+        lot_order = (asc(AssetLot.acquired_at), asc(AssetLot.id))
+
+    lots = db.execute(
+        select(AssetLot)
+        .filter(AssetLot.wallet_id == wallet_id, AssetLot.coin_name == coin_name)
+        .order_by(*lot_order)
+        .execution_options(yield_per=LOT_FETCH_SIZE)
+    ).scalars()
+
+    cost = 0.0
+    remaining = quantity
+
+    try:
+        for lot in lots:
+            taken = min(lot.quantity_remaining, remaining)
+            cost += taken * lot.cost_per_unit
+            remaining -= taken
+
+            if lot.quantity_remaining - taken <= LOT_EPSILON:
+                db.delete(lot)
+            else:
+                lot.quantity_remaining -= taken
+
+            if remaining <= LOT_EPSILON:
+                break
+    finally:
+        lots.close()
+
+    # A later sale in the same transaction must not see the lots this one used
+    db.flush()
+
+    return cost, max(remaining, 0.0)
+
+
+def _apply_sale(
+        db: Session,
+        user_id: int,
+        wallet_id: int,
+        asset: Asset,
+        quantity: float,
+        coin_value: float,
+        cost_basis_method: str = "fifo"
+):
+    """
+    Adds a sale to the session without committing. The quantity check and the decrement are a single conditional
+    UPDATE, so two concurrent sales can never take a position below zero. That UPDATE also locks the asset row,
+    so the lot matching and cost basis release that follow are serialized per (wallet, coin).
+    """
+    updated = db.execute(
+        update(Asset)
+        .where(Asset.id == asset.id, Asset.quantity >= quantity)
+        .values(quantity=Asset.quantity - quantity)
+        .returning(Asset.quantity, Asset.purchase_value_usd)
+        .execution_options(synchronize_session=False)
+    ).first()
+
+    if updated is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Insufficient quantity to sell")
+
+    quantity_before_sale = updated.quantity + quantity
+    average_cost = updated.purchase_value_usd / quantity_before_sale if quantity_before_sale else 0.0
+
+    if updated.quantity <= LOT_EPSILON:
+        # Selling everything releases the whole basis, whatever the method
+        cost_basis_usd = updated.purchase_value_usd
+        if cost_basis_method != "average":
+            _consume_lots(db, wallet_id, asset.coin_name, quantity, cost_basis_method)
+    elif cost_basis_method == "average":
+        cost_basis_usd = quantity * average_cost
+    else:
+        cost_basis_usd, unmatched_quantity = _consume_lots(db, wallet_id, asset.coin_name, quantity, cost_basis_method)
+        # Positions bought before lots were tracked have no lots, so that part is costed at the average
+        cost_basis_usd += unmatched_quantity * average_cost
+
+    cost_basis_usd = round(cost_basis_usd, 4)
+    sale_price_usd = round(quantity * coin_value, 4)
+    realized_gain_loss_usd = round(sale_price_usd - cost_basis_usd, 4)
+
+    updated_cost = db.execute(
+        update(Asset)
+        .where(Asset.id == asset.id)
+        .values(
+            purchase_value_usd=Asset.purchase_value_usd - cost_basis_usd,
+            realized_gain_loss_usd=Asset.realized_gain_loss_usd + realized_gain_loss_usd
+        )
+        .returning(Asset.purchase_value_usd, Asset.realized_gain_loss_usd)
+        .execution_options(synchronize_session=False)
+    ).first()
+
+    db.execute(
+        update(Wallet)
+        .where(Wallet.id == wallet_id)
+        .values(
+            realized_gain_loss_usd=Wallet.realized_gain_loss_usd + realized_gain_loss_usd,
+            version=Wallet.version + 1
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+    set_committed_value(asset, "quantity", updated.quantity)
+    set_committed_value(asset, "purchase_value_usd", updated_cost.purchase_value_usd)
+    set_committed_value(asset, "realized_gain_loss_usd", updated_cost.realized_gain_loss_usd)
+
+    sale_transaction = SaleTransaction(
+        user_id=user_id,
+        wallet_id=wallet_id,
+        asset_id=asset.id,
+        coin_name=asset.coin_name,
+        quantity_sold=quantity,
+        sale_price=coin_value,
+        total_sale_price=sale_price_usd,
+        remaining_coin_quantity=updated.quantity,
+        cost_basis_usd=cost_basis_usd,
+        realized_gain_loss_usd=realized_gain_loss_usd,
+        sale_date=datetime.utcnow()
+    )
+    db.add(sale_transaction)
+
+    return sale_transaction
+
+
+def _delete_if_empty(db: Session, asset_id: int, wallet_id: int, coin_name: str):
+    """
+    Removes an asset only if it is still empty, in case another trade bought more in the meantime.
+    Takes plain values because the committed Asset instance may already have been deleted by a concurrent sale.
+    """
+    deleted = db.query(Asset).filter(
+        Asset.id == asset_id, Asset.quantity <= LOT_EPSILON
+    ).delete(synchronize_session=False)
+    if deleted:
+        db.query(AssetLot).filter(
+            AssetLot.wallet_id == wallet_id, AssetLot.coin_name == coin_name
+        ).delete(synchronize_session=False)
+
+
 def crud_purchase_asset(
         db: Session,
         user_id: int,
         wallet_id: int,
         coin_name: str,
-        quantity: float
+        quantity: float,
+        idempotency_key: Optional[str] = None
 ):
     try:
         user = db.query(User).filter(User.id == user_id).first()
@@ -371,6 +1025,12 @@ def crud_purchase_asset(
 
         coin_name = coin_name.lower()
 
+        if idempotency_key:
+            request_hash = request_fingerprint(wallet_id=wallet_id, coin_name=coin_name, quantity=quantity)
+            stored_response = get_stored_response(db, user_id, "purchase_asset", idempotency_key, request_hash)
+            if stored_response is not None:
+                return stored_response
+
         coin_names = valid_coin_names()
         if coin_name not in coin_names:
             raise HTTPException(
@@ -386,69 +1046,41 @@ def crud_purchase_asset(
         if current_coin_value == 0:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"{coin_name} is valued at 0")
 
-        calculated_value_of_coin_quantity = round(quantity * current_coin_value, 4)
-
-        existing_asset = db.query(Asset).filter(
-            Asset.wallet_id == wallet_id, Asset.coin_name == coin_name).first()
-
-        if existing_asset:
-            updated_coin_quantity = existing_asset.quantity + quantity
-            existing_asset.quantity += quantity
-            existing_asset.purchase_value_usd += calculated_value_of_coin_quantity
-
-            purchase_transaction = PurchaseTransaction(
-                user_id=user_id,
-                wallet_id=wallet_id,
-                asset_id=existing_asset.id,
-                coin_name=coin_name,
-                quantity_purchased=quantity,
-                purchase_price=current_coin_value,
-                total_purchase_price=calculated_value_of_coin_quantity,
-                updated_coin_quantity=updated_coin_quantity,
-                purchase_date=datetime.utcnow()
-            )
-
-            db.add(purchase_transaction)
-            db.commit()
-            db.refresh(existing_asset)
-            db.refresh(purchase_transaction)
-
-            create_wallet_activity_snapshot(db=db, user_id=user_id, wallet_id=wallet_id)
-            print("Snapshot created for purchase")
-
-            return purchase_transaction
+        _, purchase_transaction = _apply_purchase(
+            db=db,
+            user_id=user_id,
+            wallet_id=wallet_id,
+            asset=None,
+            coin_name=coin_name,
+            quantity=quantity,
+            coin_value=current_coin_value,
+            cost_basis_method=wallet.cost_basis_method
+        )
 
-        else:
-            new_asset = Asset(
-                wallet_id=wallet_id,
-                coin_name=coin_name,
-                quantity=quantity,
-                purchase_value_usd=calculated_value_of_coin_quantity
-            )
-            db.add(new_asset)
+        if idempotency_key:
             db.flush()
-
-            purchase_transaction = PurchaseTransaction(
-                user_id=user_id,
-                wallet_id=wallet_id,
-                asset_id=new_asset.id,
-                coin_name=coin_name,
-                quantity_purchased=quantity,
-                purchase_price=current_coin_value,
-                total_purchase_price=calculated_value_of_coin_quantity,
-                updated_coin_quantity=quantity,
-                purchase_date=datetime.utcnow()
+            store_response(
+                db, user_id, "purchase_asset", idempotency_key, request_hash,
+                PurchaseTransactionResponse.model_validate(purchase_transaction).model_dump(mode="json")
             )
 
-            db.add(purchase_transaction)
+        try:
             db.commit()
-            db.refresh(new_asset)
-            db.refresh(purchase_transaction)
+        except IntegrityError:
+            db.rollback()
+            # A concurrent retry with the same key committed first, so hand back its response
+            stored_response = get_stored_response(db, user_id, "purchase_asset", idempotency_key, request_hash) \
+                if idempotency_key else None
+            if stored_response is None:
+                raise
+            return stored_response
+
+        db.refresh(purchase_transaction)
 
-            create_wallet_activity_snapshot(db=db, user_id=user_id, wallet_id=wallet_id)
-            print("Snapshot created for purchase")
+        outcome = record_wallet_activity(db=db, user_id=user_id, wallet_id=wallet_id, coin_names=[coin_name])
+        print(f"Snapshot {outcome} for purchase")
 
-            return purchase_transaction
+        return purchase_transaction
 
     except SQLAlchemyError as e:
         db.rollback()
@@ -460,7 +1092,8 @@ def crud_sell_asset(
         wallet_id: int,
         user_id: int,
         coin_name: str,
-        quantity: float
+        quantity: float,
+        idempotency_key: Optional[str] = None
 ):
     try:
         user = db.query(User).filter(User.id == user_id).first()
@@ -476,6 +1109,12 @@ def crud_sell_asset(
 
         coin_name = coin_name.lower()
 
+        if idempotency_key:
+            request_hash = request_fingerprint(wallet_id=wallet_id, coin_name=coin_name, quantity=quantity)
+            stored_response = get_stored_response(db, user_id, "sell_asset", idempotency_key, request_hash)
+            if stored_response is not None:
+                return stored_response
+
         asset = db.query(Asset).filter(Asset.wallet_id == wallet_id, Asset.coin_name == coin_name).first()
         if not asset:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{coin_name} asset not found in wallet")
@@ -491,35 +1130,43 @@ def crud_sell_asset(
         if current_coin_value == 0:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"{coin_name} is valued at 0")
 
-        sale_price_usd = round(quantity * current_coin_value, 4)
-        coins_remaining_after_sale = asset.quantity - quantity
-
-        sale_transaction = SaleTransaction(
+        sale_transaction = _apply_sale(
+            db=db,
             user_id=user_id,
             wallet_id=wallet_id,
-            asset_id=asset.id,
-            coin_name=coin_name,
-            quantity_sold=quantity,
-            sale_price=current_coin_value,
-            total_sale_price=sale_price_usd,
-            remaining_coin_quantity=coins_remaining_after_sale,
-            sale_date=datetime.utcnow()
+            asset=asset,
+            quantity=quantity,
+            coin_value=current_coin_value,
+            cost_basis_method=wallet.cost_basis_method
         )
 
-        db.add(sale_transaction)
+        if idempotency_key:
+            db.flush()
+            store_response(
+                db, user_id, "sell_asset", idempotency_key, request_hash,
+                SaleTransactionResponse.model_validate(sale_transaction).model_dump(mode="json")
+            )
 
-        asset.quantity = coins_remaining_after_sale
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            # A concurrent retry with the same key committed first, so hand back its response
+            stored_response = get_stored_response(db, user_id, "sell_asset", idempotency_key, request_hash) \
+                if idempotency_key else None
+            if stored_response is None:
+                raise
+            return stored_response
 
-        db.commit()
         db.refresh(sale_transaction)
 
-        create_wallet_activity_snapshot(db=db, user_id=user_id, wallet_id=wallet_id)
-        print("Snapshot created for sale")
-
-        if asset.quantity == 0:
-            db.delete(asset)
+        if sale_transaction.remaining_coin_quantity <= LOT_EPSILON:
+            _delete_if_empty(db, sale_transaction.asset_id, wallet_id, coin_name)
             db.commit()
 
+        outcome = record_wallet_activity(db=db, user_id=user_id, wallet_id=wallet_id, coin_names=[coin_name])
+        print(f"Snapshot {outcome} for sale")
+
         return sale_transaction
 
     except SQLAlchemyError as e:
@@ -528,7 +1175,124 @@ def crud_sell_asset(
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error: " + str(e))
 
 
-def crud_delete_wallet(db: Session, wallet_id: int, user_id: int):
+def crud_batch_order(db: Session, user_id: int, wallet_id: int, legs: List[BatchOrderLeg]):
+    """
+    Executes many buy and sell legs against one wallet as a single all-or-nothing transaction.
+    Prices come from one read of the asset cache and one snapshot is written once every leg has been applied.
+    Legs run in order, so a sell may use coins bought by an earlier leg of the same batch.
+    """
+    try:
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+        wallet = db.query(Wallet).filter(Wallet.id == wallet_id).first()
+        if not wallet:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Wallet not found")
+
+        if wallet.user_id != user_id:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="This wallet does not belong to the user")
+
+        if not legs:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Batch order has no legs")
+
+        market_assets = fetch_all_assets()["assets"]
+        assets = {asset.coin_name: asset for asset in db.query(Asset).filter(Asset.wallet_id == wallet_id).all()}
+
+        purchases = []
+        sales = []
+
+        for leg_number, leg in enumerate(legs, start=1):
+            coin_name = leg.coin_name.lower()
+
+            coin_data = market_assets.get(coin_name)
+            if coin_data is None:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Leg {leg_number}: Invalid coin name '{coin_name}'"
+                )
+
+            coin_value = float(coin_data.get("priceUsd", 0))
+            if coin_value == 0:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Leg {leg_number}: {coin_name} is valued at 0"
+                )
+
+            if leg.side == OrderSideEnum.BUY:
+                asset, purchase_transaction = _apply_purchase(
+                    db=db,
+                    user_id=user_id,
+                    wallet_id=wallet_id,
+                    asset=assets.get(coin_name),
+                    coin_name=coin_name,
+                    quantity=leg.quantity,
+                    coin_value=coin_value,
+                    cost_basis_method=wallet.cost_basis_method
+                )
+                assets[coin_name] = asset
+                purchases.append(purchase_transaction)
+
+            else:
+                asset = assets.get(coin_name)
+                if not asset:
+                    raise HTTPException(
+                        status_code=status.HTTP_404_NOT_FOUND,
+                        detail=f"Leg {leg_number}: {coin_name} asset not found in wallet"
+                    )
+
+                if asset.quantity < leg.quantity:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Leg {leg_number}: Insufficient quantity to sell"
+                    )
+
+                sales.append(_apply_sale(
+                    db=db,
+                    user_id=user_id,
+                    wallet_id=wallet_id,
+                    asset=asset,
+                    quantity=leg.quantity,
+                    coin_value=coin_value,
+                    cost_basis_method=wallet.cost_basis_method
+                ))
+
+        # Read before commit expires the assets, since a concurrent sale may delete them afterwards
+        emptied_assets = [
+            (asset.id, asset.coin_name) for asset in assets.values() if asset.quantity <= LOT_EPSILON
+        ]
+
+        db.commit()
+        for transaction in purchases + sales:
+            db.refresh(transaction)
+
+        if emptied_assets:
+            for asset_id, coin_name in emptied_assets:
+                _delete_if_empty(db, asset_id, wallet_id, coin_name)
+            db.commit()
+
+        outcome = record_wallet_activity(
+            db=db, user_id=user_id, wallet_id=wallet_id, coin_names={leg.coin_name.lower() for leg in legs}
+        )
+        print(f"Snapshot {outcome} for batch order of {len(legs)} legs")
+
+        return {"wallet_id": wallet_id, "purchases": purchases, "sales": sales}
+
+    except HTTPException:
+        db.rollback()
+        raise
+
+    except SQLAlchemyError as e:
+        db.rollback()
+        print(f"Database error during batch order: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Database error: " + str(e))
+
+
+def crud_delete_wallet(db: Session, wallet_id: int, user_id: int, background: bool = False):
+    """
+    Deletes the wallet with its assets, lots, transactions, snapshots and daily values in one transaction. With
+    background, the wallet is queued for app.jobs.purge instead, which deletes it in short chunks.
+    """
     wallet = db.query(Wallet).filter(Wallet.id == wallet_id).first()
 
     if not wallet:
@@ -536,9 +1300,14 @@ def crud_delete_wallet(db: Session, wallet_id: int, user_id: int):
     if wallet.user_id != user_id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="This wallet does not belong to the user")
 
-    db.query(Asset).filter(Asset.wallet_id == wallet_id).delete()
+    if background:
+        if not db.query(PurgeRequest.id).filter(PurgeRequest.wallet_id == wallet_id).first():
+            db.add(PurgeRequest(user_id=user_id, wallet_id=wallet_id))
+            db.commit()
+        return "Wallet deletion scheduled"
 
-    db.delete(wallet)
+    delete_wallet_rows(db, [wallet_id])
     db.commit()
+    forget_deleted(wallet_ids=[wallet_id])
 
     return "Wallet and associated assets deleted successfully"
@@ -1,14 +1,56 @@
-from sqlalchemy import create_engine
+import os
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, make_url
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-DATABASE_URL = "sqlite:///./test.db"
+load_dotenv()
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db")
+
+# The asyncio driver for each sync URL scheme, used when ASYNC_DATABASE_URL isn't set
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+
+def async_database_url(url: str) -> str:
+    """The same database reached through its asyncio driver."""
+    scheme, _, rest = url.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", async_database_url(DATABASE_URL))
+# A sync route keeps its connection until its response is validated in another threadpool thread, so sync routes
+# stall until the pool times out once concurrent requests outnumber the pool and the 40 threads. Async routes don't.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 20))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+
+
+def pool_args(url: str) -> dict:
+    """
+    The pool size settings, for the URLs whose engines get a queue pool. In-memory SQLite gets a singleton or static
+    pool instead, which doesn't take them.
+    """
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and (
+            parsed.database in (None, "", ":memory:") or parsed.query.get("mode") == "memory"
+    ):
+        return {}
+    return {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW}
+
+
+connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+engine = create_engine(DATABASE_URL, connect_args=connect_args, **pool_args(DATABASE_URL))
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# Created on first use, so the sync path runs without an asyncio driver installed
+_async_session_factory = None
+
 
 def get_db():
     db = SessionLocal()
@@ -16,3 +58,29 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def get_async_session_factory():
+    global _async_session_factory
+
+    if _async_session_factory is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_args(ASYNC_DATABASE_URL))
+        # Not expiring on commit, since reloading an expired attribute can't happen implicitly under asyncio
+        _async_session_factory = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+    return _async_session_factory
+
+
+async def get_async_db():
+    async with get_async_session_factory()() as db:
+        yield db
+
+
+async def dispose_async_engine():
+    global _async_session_factory
+
+    if _async_session_factory is not None:
+        await _async_session_factory.kw["bind"].dispose()
+        _async_session_factory = None
@@ -0,0 +1,13 @@
+from sqlalchemy.orm import Session
+
+from app.models import JobCheckpoint
+
+
+def get_checkpoint(db: Session, job_name: str) -> JobCheckpoint:
+    """Returns the job's checkpoint row, creating an empty one the first time the job runs."""
+    checkpoint = db.query(JobCheckpoint).filter(JobCheckpoint.job_name == job_name).first()
+    if not checkpoint:
+        checkpoint = JobCheckpoint(job_name=job_name)
+        db.add(checkpoint)
+        db.commit()
+    return checkpoint
@@ -0,0 +1,173 @@
+"""
+Thins out wallet_activity_data as snapshots age. Every snapshot is kept for SNAPSHOT_KEEP_ALL_DAYS, then only the
+last snapshot per wallet per hour until SNAPSHOT_KEEP_HOURLY_DAYS, then only the last per wallet per day.
+
+    python -m app.jobs.compaction
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+from dotenv import load_dotenv
+from sqlalchemy import desc, func
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import JobCheckpoint, WalletActivityData
+from app.jobs.checkpoints import get_checkpoint
+
+load_dotenv()
+
+SNAPSHOT_KEEP_ALL_DAYS = int(os.getenv("SNAPSHOT_KEEP_ALL_DAYS", 7))
+SNAPSHOT_KEEP_HOURLY_DAYS = int(os.getenv("SNAPSHOT_KEEP_HOURLY_DAYS", 30))
+COMPACTION_BATCH_SIZE = int(os.getenv("COMPACTION_BATCH_SIZE", 500))
+WALLET_LOOKUP_CHUNK_SIZE = 500
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+
+def _bucket_start(moment: datetime, bucket: timedelta) -> datetime:
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if bucket == DAY else moment
+
+
+def _newest_written_ids(db: Session, wallet_ids: list) -> set:
+    """
+    The newest written snapshot of each wallet, which the next incremental snapshot builds on. Looked up per wallet
+    through the wallet index, in chunks, for the wallets a bucket would thin out.
+    """
+    newest_ids = set()
+    for i in range(0, len(wallet_ids), WALLET_LOOKUP_CHUNK_SIZE):
+        newest_ids.update(
+            snapshot_id for (snapshot_id,) in
+            db.query(func.max(WalletActivityData.id))
+            .filter(WalletActivityData.wallet_id.in_(wallet_ids[i:i + WALLET_LOOKUP_CHUNK_SIZE]))
+            .group_by(WalletActivityData.wallet_id)
+        )
+    return newest_ids
+
+
+def _superseded_in_bucket(db: Session, start: datetime, end: datetime) -> list:
+    """Ids of every snapshot in [start, end) except the last one of each wallet and each wallet's newest written."""
+    rows = (
+        db.query(WalletActivityData.id, WalletActivityData.wallet_id)
+        .filter(WalletActivityData.date >= start, WalletActivityData.date < end)
+        .order_by(WalletActivityData.wallet_id, desc(WalletActivityData.date), desc(WalletActivityData.id))
+        .all()
+    )
+
+    superseded = []
+    kept_wallets = set()
+    for snapshot_id, wallet_id in rows:
+        if wallet_id not in kept_wallets:
+            kept_wallets.add(wallet_id)
+        else:
+            superseded.append((snapshot_id, wallet_id))
+
+    if not superseded:
+        return []
+
+    protected_ids = _newest_written_ids(db, sorted({wallet_id for _, wallet_id in superseded}))
+    return [snapshot_id for snapshot_id, _ in superseded if snapshot_id not in protected_ids]
+
+
+def _delete_and_checkpoint(db: Session, snapshot_ids: list, checkpoint: JobCheckpoint, position: datetime,
+                           batch_size: int, last_snapshot_id: Optional[int] = None):
+    """
+    Deletes in batches, each its own short transaction, and moves the checkpoint with the last one. last_snapshot_id
+    is recorded once a run has covered every snapshot up to that id.
+    """
+    for i in range(0, len(snapshot_ids), batch_size):
+        db.query(WalletActivityData).filter(
+            WalletActivityData.id.in_(snapshot_ids[i:i + batch_size])
+        ).delete(synchronize_session=False)
+        if i + batch_size < len(snapshot_ids):
+            db.commit()
+
+    checkpoint.checkpoint_at = position
+    if last_snapshot_id is not None:
+        checkpoint.position = last_snapshot_id
+    db.commit()
+
+
+def compact_tier(db: Session, tier: str, bucket: timedelta, older_than: datetime, batch_size: int) -> int:
+    """
+    Keeps the last snapshot per wallet per bucket for everything before older_than. Work resumes from the tier's
+    checkpoint and jumps straight to the next bucket that has snapshots, so each run only reads the newly aged rows.
+    The checkpoint also holds the last snapshot id the previous run covered: snapshots added since then but dated
+    before the checkpoint, like backdated imports or end-of-day rows, send the run back to the first bucket they
+    fall in.
+    """
+    checkpoint = get_checkpoint(db, f"snapshot_compaction:{tier}")
+    cutoff = _bucket_start(older_than, bucket)
+    last_snapshot_id = db.query(func.max(WalletActivityData.id)).scalar() or 0
+
+    position = checkpoint.checkpoint_at
+    if position:
+        first_late = db.query(func.min(WalletActivityData.date)).filter(
+            WalletActivityData.id > (checkpoint.position or 0), WalletActivityData.date < position
+        ).scalar()
+        if first_late is not None:
+            position = _bucket_start(first_late, bucket)
+
+    if position and position >= cutoff:
+        return 0
+
+    pending_ids = []
+    deleted = 0
+
+    while True:
+        query = db.query(func.min(WalletActivityData.date)).filter(WalletActivityData.date < cutoff)
+        if position:
+            query = query.filter(WalletActivityData.date >= position)
+        next_date = query.scalar()
+        if next_date is None:
+            break
+
+        start = _bucket_start(next_date, bucket)
+        position = start + bucket
+        pending_ids.extend(_superseded_in_bucket(db, start, position))
+
+        if len(pending_ids) >= batch_size:
+            _delete_and_checkpoint(db, pending_ids, checkpoint, position, batch_size)
+            deleted += len(pending_ids)
+            pending_ids = []
+
+    _delete_and_checkpoint(db, pending_ids, checkpoint, cutoff, batch_size, last_snapshot_id)
+
+    return deleted + len(pending_ids)
+
+
+def run_snapshot_compaction(
+        db: Session,
+        now: Optional[datetime] = None,
+        keep_all_days: int = SNAPSHOT_KEEP_ALL_DAYS,
+        keep_hourly_days: int = SNAPSHOT_KEEP_HOURLY_DAYS,
+        batch_size: int = COMPACTION_BATCH_SIZE
+) -> dict:
+    if keep_hourly_days < keep_all_days:
+        raise ValueError("keep_hourly_days must be at least keep_all_days")
+
+    now = now or datetime.utcnow()
+    snapshots_before = db.query(func.count(WalletActivityData.id)).scalar()
+
+    deleted_hourly = compact_tier(db, "hourly", HOUR, now - timedelta(days=keep_all_days), batch_size)
+    deleted_daily = compact_tier(db, "daily", DAY, now - timedelta(days=keep_hourly_days), batch_size)
+
+    report = {
+        "snapshots_before": snapshots_before,
+        "snapshots_after": snapshots_before - deleted_hourly - deleted_daily,
+        "deleted_hourly": deleted_hourly,
+        "deleted_daily": deleted_daily
+    }
+    print(f"Snapshot compaction: {report}")
+
+    return report
+
+
+if __name__ == "__main__":
+    session = SessionLocal()
+    try:
+        run_snapshot_compaction(session)
+    finally:
+        session.close()
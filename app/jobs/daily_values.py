@@ -0,0 +1,194 @@
+"""
+Keeps wallet_daily_values, one row per wallet per day with its end-of-day value and cost basis, up to date. Only the
+days that changed are recomputed for each wallet: from the earliest trade added since it was last materialized,
+from the first day valued before that day's candles were out, or from the day after its last row.
+
+    python -m app.jobs.daily_values [YYYY-MM-DD]
+"""
+import os
+import sys
+from datetime import date, datetime, timedelta
+from typing import Optional
+from dotenv import load_dotenv
+from sqlalchemy import func, insert, or_
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import Wallet, PurchaseTransaction, SaleTransaction, WalletDailyValue, WalletDailyValueState
+from app.crud.analytics import compute_daily_values, daily_cost_basis, fetch_daily_candles
+from app.utils.timeseries import candle_day
+
+load_dotenv()
+
+DAILY_VALUES_CHUNK_SIZE = int(os.getenv("DAILY_VALUES_CHUNK_SIZE", 100))
+
+
+def _dirty_wallets(db: Session, through_day: date) -> dict:
+    """
+    {wallet_id: first day to recompute} for every wallet whose daily values are out of date. The day is None for
+    wallets whose version moved without new trades, which only need their state refreshed.
+    """
+    starts = {}
+
+    def recompute_from(wallet_id: int, day: date):
+        if day <= through_day and (starts.get(wallet_id) is None or day < starts[wallet_id]):
+            starts[wallet_id] = day
+
+    # Trades added since the wallet was last materialized, or every trade of a wallet never materialized
+    for model, date_column, last_id in (
+        (PurchaseTransaction, PurchaseTransaction.purchase_date, WalletDailyValueState.last_purchase_id),
+        (SaleTransaction, SaleTransaction.sale_date, WalletDailyValueState.last_sale_id),
+    ):
+        new_trades = (
+            db.query(model.wallet_id, func.min(date_column))
+            .outerjoin(WalletDailyValueState, WalletDailyValueState.wallet_id == model.wallet_id)
+            .filter(or_(WalletDailyValueState.wallet_id.is_(None), model.id > last_id))
+            .group_by(model.wallet_id)
+        )
+        for wallet_id, first_trade in new_trades:
+            recompute_from(wallet_id, first_trade.date())
+
+    # Days valued with a stand-in price because their own candle was not out yet
+    provisional = (
+        db.query(WalletDailyValue.wallet_id, func.min(WalletDailyValue.day))
+        .filter(WalletDailyValue.prices_final.is_(False))
+        .group_by(WalletDailyValue.wallet_id)
+    )
+    for wallet_id, day in provisional:
+        recompute_from(wallet_id, day)
+
+    # Days materialized before their coin prices were stored
+    without_prices = (
+        db.query(WalletDailyValue.wallet_id, func.min(WalletDailyValue.day))
+        .filter(WalletDailyValue.coin_prices.is_(None))
+        .group_by(WalletDailyValue.wallet_id)
+    )
+    for wallet_id, day in without_prices:
+        recompute_from(wallet_id, day)
+
+    # Days that have passed since the last materialized one
+    for wallet_id, day in db.query(WalletDailyValue.wallet_id, func.max(WalletDailyValue.day)).group_by(
+            WalletDailyValue.wallet_id
+    ):
+        recompute_from(wallet_id, day + timedelta(days=1))
+
+    stale = (
+        db.query(WalletDailyValueState.wallet_id)
+        .join(Wallet, Wallet.id == WalletDailyValueState.wallet_id)
+        .filter(WalletDailyValueState.version != Wallet.version)
+    )
+    for (wallet_id,) in stale:
+        starts.setdefault(wallet_id, None)
+
+    return starts
+
+
+def _materialize_wallet(db: Session, wallet_id: int, start: Optional[date], through_day: date, fetch_candles) -> int:
+    """Rewrites the wallet's daily values from start through through_day and records what they were built from."""
+    wallet = db.query(Wallet).filter(Wallet.id == wallet_id).first()
+    if not wallet:
+        return 0
+
+    # Read before the trades, so a trade landing in between only makes the next run recompute its days again
+    version = wallet.version
+    last_purchase_id = db.query(func.max(PurchaseTransaction.id)).filter(
+        PurchaseTransaction.wallet_id == wallet_id
+    ).scalar() or 0
+    last_sale_id = db.query(func.max(SaleTransaction.id)).filter(SaleTransaction.wallet_id == wallet_id).scalar() or 0
+
+    state = db.query(WalletDailyValueState).filter(WalletDailyValueState.wallet_id == wallet_id).first()
+    if not state:
+        state = WalletDailyValueState(wallet_id=wallet_id)
+        db.add(state)
+
+    rows = []
+    if start is not None:
+        daily = compute_daily_values(db, wallet_id, start, through_day, fetch_candles)
+        cost_basis = daily_cost_basis(db, wallet_id, daily["days"])
+
+        # A day is final once every priced coin has a candle on or after it
+        last_candle_days = [
+            max(candle_day(candle) for candle in candles) for candles in daily["candles"].values() if candles
+        ]
+        final_through = min(last_candle_days, default=through_day)
+
+        rows = [
+            {
+                "wallet_id": wallet_id,
+                "day": day,
+                "total_value_usd": round(float(value), 4),
+                "cost_basis_usd": round(float(cost), 4),
+                "coin_prices": {
+                    coin: float(price) for coin, quantity, price in zip(daily["coins"], held, prices) if quantity
+                },
+                "prices_final": day <= final_through
+            }
+            for day, value, cost, held, prices in zip(
+                daily["days"], daily["values"], cost_basis, daily["holdings"], daily["prices"]
+            )
+        ]
+        db.query(WalletDailyValue).filter(
+            WalletDailyValue.wallet_id == wallet_id, WalletDailyValue.day >= start
+        ).delete(synchronize_session=False)
+        db.execute(insert(WalletDailyValue), rows)
+        state.missing_prices = daily["missing_prices"]
+
+    state.version = version
+    state.last_purchase_id = last_purchase_id
+    state.last_sale_id = last_sale_id
+
+    return len(rows)
+
+
+def run_daily_value_refresh(
+        db: Session,
+        through_day: Optional[date] = None,
+        chunk_size: int = DAILY_VALUES_CHUNK_SIZE,
+        should_stop=lambda: False
+) -> dict:
+    """
+    Brings every wallet's daily values up to through_day (yesterday by default). Each coin's candles are fetched
+    once for the whole run, covering the earliest day any wallet needs. Wallets are committed chunk_size at a time
+    together with their state rows, so an interrupted run resumes with the wallets it had not reached.
+    should_stop is polled between chunks.
+    """
+    through_day = through_day or (datetime.utcnow().date() - timedelta(days=1))
+    starts = _dirty_wallets(db, through_day)
+    first_day = min((day for day in starts.values() if day is not None), default=through_day)
+
+    candle_cache = {}
+
+    def fetch_candles(coins, start, end):
+        new_coins = [coin for coin in coins if coin not in candle_cache]
+        candle_cache.update(fetch_daily_candles(new_coins, first_day, through_day))
+        return {coin: candle_cache[coin] for coin in coins}
+
+    wallet_ids = sorted(starts)
+    wallets_refreshed = 0
+    days_written = 0
+
+    for offset in range(0, len(wallet_ids), chunk_size):
+        if should_stop():
+            break
+        for wallet_id in wallet_ids[offset:offset + chunk_size]:
+            days_written += _materialize_wallet(db, wallet_id, starts[wallet_id], through_day, fetch_candles)
+            wallets_refreshed += 1
+        db.commit()
+
+    report = {
+        "through_day": through_day,
+        "wallets_refreshed": wallets_refreshed,
+        "days_written": days_written,
+        "completed": wallets_refreshed == len(wallet_ids)
+    }
+    print(f"Daily values: {report}")
+
+    return report
+
+
+if __name__ == "__main__":
+    session = SessionLocal()
+    try:
+        run_daily_value_refresh(session, date.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else None)
+    finally:
+        session.close()
@@ -0,0 +1,137 @@
+"""
+Writes one end-of-day WalletActivityData row for every wallet, so wallets that did not trade still have a
+snapshot on each day.
+
+    python -m app.jobs.eod_snapshots [YYYY-MM-DD]
+"""
+import os
+import sys
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+from dotenv import load_dotenv
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import PurchaseTransaction, SaleTransaction, Wallet, WalletActivityData
+from app.CoinCapAPI import fetch_all_assets
+from app.jobs.checkpoints import get_checkpoint
+from app.crud.snapshots import holdings_columns
+from app.utils.lots import LOT_EPSILON
+
+load_dotenv()
+
+EOD_SNAPSHOT_CHUNK_SIZE = int(os.getenv("EOD_SNAPSHOT_CHUNK_SIZE", 1000))
+
+
+def _positions_as_of(db: Session, wallet_ids: list, as_of: datetime) -> dict:
+    """
+    Quantity and cost basis of every coin each wallet held at as_of, summed from its trades in the database:
+    purchases add what they bought and cost, sales remove what they sold and its cost basis.
+    """
+    positions = {}
+    for model, date_column, quantity_column, cost_column, sign in (
+        (PurchaseTransaction, PurchaseTransaction.purchase_date, PurchaseTransaction.quantity_purchased,
+         PurchaseTransaction.total_purchase_price, 1),
+        (SaleTransaction, SaleTransaction.sale_date, SaleTransaction.quantity_sold, SaleTransaction.cost_basis_usd, -1),
+    ):
+        rows = (
+            db.query(model.wallet_id, model.coin_name, func.sum(quantity_column), func.sum(cost_column))
+            .filter(model.wallet_id.in_(wallet_ids), date_column <= as_of)
+            .group_by(model.wallet_id, model.coin_name)
+        )
+        for wallet_id, coin_name, quantity, cost in rows:
+            position = positions.setdefault((wallet_id, coin_name), [0.0, 0.0])
+            position[0] += sign * (quantity or 0.0)
+            position[1] += sign * (cost or 0.0)
+
+    return positions
+
+
+def _eod_snapshot_rows(db: Session, wallet_ids: list, prices: dict, snapshot_date: datetime) -> list:
+    holdings_by_wallet = {wallet_id: {} for wallet_id in wallet_ids}
+
+    for (wallet_id, coin_name), (quantity, purchase_value_usd) in sorted(
+            _positions_as_of(db, wallet_ids, snapshot_date).items()
+    ):
+        if quantity <= LOT_EPSILON:
+            continue
+        if coin_name not in prices:
+            print(f"missing {coin_name}")
+            continue
+        holdings_by_wallet[wallet_id][coin_name] = {
+            "quantity": quantity,
+            "purchase_value_usd": round(purchase_value_usd, 4),
+            "value_on_date_usd": round(quantity * prices[coin_name], 4)
+        }
+
+    return [
+        {
+            "wallet_id": wallet_id,
+            "date": snapshot_date,
+            **holdings_columns(db, dict(sorted(holdings.items()))),
+            "total_value_usd": sum(holding["value_on_date_usd"] for _, holding in sorted(holdings.items()))
+        }
+        for wallet_id, holdings in holdings_by_wallet.items()
+    ]
+
+
+def run_eod_snapshots(
+        db: Session,
+        snapshot_day: Optional[date] = None,
+        chunk_size: int = EOD_SNAPSHOT_CHUNK_SIZE,
+        should_stop=lambda: False
+) -> dict:
+    """
+    Snapshots every wallet for snapshot_day (yesterday by default), valuing what it held at the end of that day,
+    summed from its trades up to then, against one read of the price table. Trades made after the day, including
+    those made while the job runs, are left out. Wallets are read in id order, chunk_size at a time, and each chunk is
+    bulk-inserted in the same transaction that advances the day's checkpoint, so a crashed run resumes after the
+    last committed chunk without writing duplicates. should_stop is polled between chunks.
+    """
+    snapshot_day = snapshot_day or (datetime.utcnow().date() - timedelta(days=1))
+    # Last moment of the day, so it is the day's latest snapshot for valuation-by-date
+    snapshot_date = datetime.combine(snapshot_day, time.max)
+
+    checkpoint = get_checkpoint(db, f"eod_snapshots:{snapshot_day.isoformat()}")
+    if checkpoint.completed_at:
+        return {"snapshot_day": snapshot_day, "snapshots_written": 0, "completed": True}
+
+    prices = {coin: float(data.get("priceUsd", 0)) for coin, data in fetch_all_assets()["assets"].items()}
+    last_wallet_id = checkpoint.position or 0
+    written = 0
+
+    while not should_stop():
+        wallet_ids = [
+            wallet_id for (wallet_id,) in db.query(Wallet.id)
+            .filter(Wallet.id > last_wallet_id)
+            .order_by(Wallet.id)
+            .limit(chunk_size)
+        ]
+        if not wallet_ids:
+            checkpoint.completed_at = datetime.utcnow()
+            db.commit()
+            break
+
+        db.execute(insert(WalletActivityData), _eod_snapshot_rows(db, wallet_ids, prices, snapshot_date))
+        last_wallet_id = wallet_ids[-1]
+        checkpoint.position = last_wallet_id
+        db.commit()
+        written += len(wallet_ids)
+
+    report = {
+        "snapshot_day": snapshot_day,
+        "snapshots_written": written,
+        "completed": checkpoint.completed_at is not None
+    }
+    print(f"End-of-day snapshots: {report}")
+
+    return report
+
+
+if __name__ == "__main__":
+    session = SessionLocal()
+    try:
+        run_eod_snapshots(session, date.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else None)
+    finally:
+        session.close()
@@ -0,0 +1,100 @@
+"""
+Deletes the users and wallets queued in purge_requests. Rows are deleted a chunk at a time, each chunk in its own
+short transaction, so purging a very large account never holds the write lock for long. Only the final chunk
+removes the user or wallet rows themselves, together with anything added since the purge began.
+
+    python -m app.jobs.purge
+"""
+import os
+import threading
+from dotenv import load_dotenv
+from sqlalchemy import inspect, select
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models import Wallet, PurgeRequest
+from app.crud.deletion import WALLET_TABLES, delete_wallet_rows, delete_user_rows, forget_deleted
+
+load_dotenv()
+
+PURGE_CHUNK_SIZE = int(os.getenv("PURGE_CHUNK_SIZE", 5000))
+
+# Background purges started by delete requests run one at a time
+_purge_lock = threading.Lock()
+
+
+def _delete_in_chunks(db: Session, wallet_ids, chunk_size: int, should_stop) -> tuple:
+    """Deletes the wallets' rows chunk_size at a time. Returns (rows deleted, whether every table was emptied)."""
+    deleted = 0
+    for model in WALLET_TABLES:
+        key = inspect(model).primary_key[0]
+        while True:
+            if should_stop():
+                return deleted, False
+            chunk = select(key).where(model.wallet_id.in_(wallet_ids)).limit(chunk_size).scalar_subquery()
+            count = db.query(model).filter(key.in_(chunk)).delete(synchronize_session=False)
+            db.commit()
+            deleted += count
+            if count < chunk_size:
+                break
+    return deleted, True
+
+
+def run_purge(db: Session, chunk_size: int = PURGE_CHUNK_SIZE, should_stop=lambda: False) -> dict:
+    """Works through the purge requests oldest first, until none are left or should_stop() says to stop."""
+    requests_completed = 0
+    rows_deleted = 0
+    completed = True
+
+    while True:
+        request = db.query(PurgeRequest).order_by(PurgeRequest.id).first()
+        if request is None:
+            break
+
+        request_id, user_id, wallet_id = request.id, request.user_id, request.wallet_id
+        if wallet_id is not None:
+            wallet_ids = [wallet_id]
+        else:
+            wallet_ids = [owned_id for (owned_id,) in db.query(Wallet.id).filter(Wallet.user_id == user_id)]
+
+        deleted, finished = _delete_in_chunks(db, wallet_ids, chunk_size, should_stop)
+        rows_deleted += deleted
+        if not finished:
+            completed = False
+            break
+
+        if wallet_id is not None:
+            delete_wallet_rows(db, wallet_ids)
+        else:
+            wallet_ids = delete_user_rows(db, user_id)
+        db.query(PurgeRequest).filter(PurgeRequest.id == request_id).delete(synchronize_session=False)
+        db.commit()
+
+        forget_deleted(user_id if wallet_id is None else None, wallet_ids)
+        requests_completed += 1
+
+    report = {"requests_completed": requests_completed, "rows_deleted": rows_deleted, "completed": completed}
+    print(f"Purge: {report}")
+
+    return report
+
+
+def purge_in_background():
+    """Runs the purge with its own session, for FastAPI to call after a delete request has been answered."""
+    with _purge_lock:
+        db = SessionLocal()
+        try:
+            run_purge(db)
+        except Exception as e:
+            db.rollback()
+            print(f"Purge failed, it will resume on the next run: {e}")
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    session = SessionLocal()
+    try:
+        run_purge(session)
+    finally:
+        session.close()
@@ -0,0 +1,80 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+
+from app.database import SessionLocal
+from app.jobs.compaction import run_snapshot_compaction
+from app.jobs.eod_snapshots import run_eod_snapshots
+from app.jobs.daily_values import run_daily_value_refresh
+from app.jobs.purge import run_purge
+from app.crud.idempotency import purge_expired_records
+
+load_dotenv()
+
+# Time of day (UTC) the daily jobs run, shortly after the day they snapshot has closed
+DAILY_JOBS_TIME_UTC = os.getenv("DAILY_JOBS_TIME_UTC", "00:05")
+
+
+class JobScheduler:
+    """
+    Runs the daily jobs on a background thread: end-of-day snapshots for the previous day, the materialized daily
+    values, snapshot compaction, any background purges left unfinished, then expired idempotency keys. On start it
+    runs them once straight away, which finishes a day that was interrupted by a crash (the jobs resume from their
+    checkpoints and skip days already done).
+    """
+
+    def __init__(self, session_factory=SessionLocal, run_at: str = DAILY_JOBS_TIME_UTC):
+        self.session_factory = session_factory
+        self.run_at = datetime.strptime(run_at, "%H:%M").time()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="job-scheduler", daemon=True)
+        self._thread.start()
+        print("Job scheduler started")
+
+    def stop(self):
+        if self._thread is None:
+            return
+        # Jobs check this between chunks and leave their checkpoint at the last committed one
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        print("Job scheduler stopped")
+
+    def seconds_until_next_run(self, now: datetime) -> float:
+        next_run = datetime.combine(now.date(), self.run_at)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        return (next_run - now).total_seconds()
+
+    def run_daily_jobs(self):
+        db = self.session_factory()
+        try:
+            run_eod_snapshots(db, should_stop=self._stop.is_set)
+            if not self._stop.is_set():
+                run_daily_value_refresh(db, should_stop=self._stop.is_set)
+            if not self._stop.is_set():
+                run_snapshot_compaction(db)
+            if not self._stop.is_set():
+                run_purge(db, should_stop=self._stop.is_set)
+            if not self._stop.is_set():
+                purge_expired_records(db)
+        except Exception as e:
+            db.rollback()
+            print(f"Daily jobs failed, they will resume from their checkpoints on the next run: {e}")
+        finally:
+            db.close()
+
+    def _run(self):
+        self.run_daily_jobs()
+        while not self._stop.wait(self.seconds_until_next_run(datetime.utcnow())):
+            self.run_daily_jobs()
+
+
+job_scheduler = JobScheduler()
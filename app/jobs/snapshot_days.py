@@ -0,0 +1,66 @@
+"""
+Fills in snapshot_day on snapshots written before the column existed, so valuation-by-date finds them through the
+wallet/day index. Runs once at startup; rows are updated in id order, chunk_size at a time, each chunk in the same
+transaction that advances the checkpoint, and a finished backfill is not repeated.
+
+    python -m app.jobs.snapshot_days
+"""
+import os
+from datetime import datetime
+from dotenv import load_dotenv
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from app.database import Base, SessionLocal, engine
+from app.models import WalletActivityData
+from app.jobs.checkpoints import get_checkpoint
+from app.utils.schema import upgrade_schema
+
+load_dotenv()
+
+SNAPSHOT_DAY_BACKFILL_CHUNK_SIZE = int(os.getenv("SNAPSHOT_DAY_BACKFILL_CHUNK_SIZE", 5000))
+
+
+def run_snapshot_day_backfill(db: Session, chunk_size: int = SNAPSHOT_DAY_BACKFILL_CHUNK_SIZE) -> dict:
+    checkpoint = get_checkpoint(db, "snapshot_day_backfill")
+    if checkpoint.completed_at:
+        return {"snapshots_updated": 0, "completed": True}
+
+    last_snapshot_id = checkpoint.position or 0
+    updated = 0
+
+    while True:
+        snapshots = (
+            db.query(WalletActivityData.id, WalletActivityData.date)
+            .filter(WalletActivityData.id > last_snapshot_id, WalletActivityData.snapshot_day.is_(None))
+            .order_by(WalletActivityData.id)
+            .limit(chunk_size)
+            .all()
+        )
+        if not snapshots:
+            checkpoint.completed_at = datetime.utcnow()
+            db.commit()
+            break
+
+        db.execute(update(WalletActivityData), [
+            {"id": snapshot_id, "snapshot_day": snapshot_date.date()} for snapshot_id, snapshot_date in snapshots
+        ])
+        last_snapshot_id = snapshots[-1].id
+        checkpoint.position = last_snapshot_id
+        db.commit()
+        updated += len(snapshots)
+
+    report = {"snapshots_updated": updated, "completed": True}
+    print(f"Snapshot day backfill: {report}")
+
+    return report
+
+
+if __name__ == "__main__":
+    # Databases from before snapshot_day existed need the column added first
+    upgrade_schema(engine, Base.metadata)
+    session = SessionLocal()
+    try:
+        run_snapshot_day_backfill(session)
+    finally:
+        session.close()
@@ -0,0 +1,193 @@
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Iterable, Optional
+from dotenv import load_dotenv
+
+from app.database import SessionLocal
+from app.models import Wallet
+
+load_dotenv()
+
+SNAPSHOT_COALESCE_SECONDS = float(os.getenv("SNAPSHOT_COALESCE_SECONDS", 0.25))
+SNAPSHOT_BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", 100))
+# A snapshot that fails to write is queued again after 1s, 2s, 4s, ... up to this, and given up after the last attempt
+SNAPSHOT_RETRY_MAX_SECONDS = float(os.getenv("SNAPSHOT_RETRY_MAX_SECONDS", 60))
+SNAPSHOT_MAX_ATTEMPTS = int(os.getenv("SNAPSHOT_MAX_ATTEMPTS", 10))
+
+
+class SnapshotWriter:
+    """
+    Writes wallet activity snapshots on a background thread. Trades on the same wallet that arrive within
+    SNAPSHOT_COALESCE_SECONDS of the first one share a single snapshot, and ready snapshots are committed
+    together in batches of up to SNAPSHOT_BATCH_SIZE. Snapshots that fail to write, whatever the error, are queued
+    again with a backoff. Stopping the writer flushes everything still queued. Once a snapshot is given up on, the
+    latest written one misses its trades, so the wallet's next snapshot revalues every asset instead of building on it.
+    """
+
+    def __init__(self, session_factory=SessionLocal, coalesce_seconds: float = SNAPSHOT_COALESCE_SECONDS,
+                 batch_size: int = SNAPSHOT_BATCH_SIZE):
+        self.session_factory = session_factory
+        self.coalesce_seconds = coalesce_seconds
+        self.batch_size = batch_size
+        self._pending = {}  # wallet_id -> {"ready_at", "last_trade", "coin_names", "attempts"}
+        self._stale_wallets = set()  # Wallets whose last snapshot was given up on
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._condition:
+            if self.running:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="snapshot-writer", daemon=True)
+            self._thread.start()
+        print("Snapshot writer started")
+
+    def stop(self):
+        with self._condition:
+            if not self.running:
+                return
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+        print("Snapshot writer stopped")
+
+    def submit(self, user_id: int, wallet_id: int, coin_names: Optional[Iterable[str]] = None) -> bool:
+        """Queues a snapshot for the wallet. Returns False when the writer isn't running so the caller writes it."""
+        with self._condition:
+            if not self.running or self._stopping:
+                return False
+
+            now = time.monotonic()
+            entry = self._pending.get(wallet_id)
+            if entry is None:
+                entry = self._pending[wallet_id] = {
+                    "ready_at": now + self.coalesce_seconds,
+                    "coin_names": None if wallet_id in self._stale_wallets else set(),
+                    "attempts": 0
+                }
+                self._stale_wallets.discard(wallet_id)
+                self._condition.notify()
+
+            entry["last_trade"] = datetime.utcnow()
+            # None means the whole wallet is revalued, which covers any coins queued alongside it
+            if coin_names is None or entry["coin_names"] is None:
+                entry["coin_names"] = None
+            else:
+                entry["coin_names"].update(coin_names)
+
+            return True
+
+    def _take_ready(self, force: bool = False) -> dict:
+        now = time.monotonic()
+        ready = {}
+        for wallet_id, entry in list(self._pending.items()):
+            if len(ready) >= self.batch_size:
+                break
+            if force or now >= entry["ready_at"]:
+                ready[wallet_id] = self._pending.pop(wallet_id)
+        return ready
+
+    def _next_wait(self) -> Optional[float]:
+        if not self._pending:
+            return None
+        return max(0.0, min(entry["ready_at"] for entry in self._pending.values()) - time.monotonic())
+
+    def _run(self):
+        while True:
+            with self._condition:
+                batch = self._take_ready(force=self._stopping)
+                while not batch:
+                    if self._stopping and not self._pending:
+                        return
+                    self._condition.wait(timeout=self._next_wait())
+                    batch = self._take_ready(force=self._stopping)
+
+            try:
+                failed = self._write_batch(batch)
+            except Exception as e:
+                # Nothing may end this thread, or no snapshot would be written again until a restart
+                print(f"Snapshot writer batch failed: {e}")
+                failed = batch
+            self._retry(failed)
+
+    def _retry(self, failed: dict):
+        now = time.monotonic()
+        with self._condition:
+            for wallet_id, entry in failed.items():
+                attempts = entry["attempts"] + 1
+                queued = self._pending.get(wallet_id)
+                if attempts >= SNAPSHOT_MAX_ATTEMPTS or self._stopping:
+                    print(f"Snapshot writer gave up on wallet {wallet_id} after {attempts} attempts")
+                    if queued is None:
+                        self._stale_wallets.add(wallet_id)
+                    else:
+                        queued["coin_names"] = None
+                    continue
+
+                if queued is None:
+                    backoff = min(2 ** (attempts - 1), SNAPSHOT_RETRY_MAX_SECONDS)
+                    self._pending[wallet_id] = {**entry, "ready_at": now + backoff, "attempts": attempts}
+                    continue
+
+                # The wallet traded again meanwhile, so its queued snapshot also covers this one
+                queued["last_trade"] = max(queued["last_trade"], entry["last_trade"])
+                queued["attempts"] = max(queued["attempts"], attempts)
+                if queued["coin_names"] is None or entry["coin_names"] is None:
+                    queued["coin_names"] = None
+                else:
+                    queued["coin_names"].update(entry["coin_names"])
+
+            self._condition.notify()
+
+    def _write_batch(self, batch: dict) -> dict:
+        """Writes the batch in one commit, or one wallet at a time if that fails. Returns the entries not written."""
+        # Imported here because the trade crud queues its snapshots through this module
+        from app.crud.wallets import build_wallet_activity_snapshot
+
+        db = self.session_factory()
+        try:
+            live_wallets = {
+                wallet_id for (wallet_id,) in db.query(Wallet.id).filter(Wallet.id.in_(list(batch))).all()
+            }
+            for wallet_id, entry in batch.items():
+                if wallet_id in live_wallets:
+                    db.add(build_wallet_activity_snapshot(
+                        db, wallet_id, entry["coin_names"], snapshot_date=entry["last_trade"]
+                    ))
+            db.commit()
+            print(f"Snapshot writer committed {len(live_wallets)} snapshots")
+            return {}
+
+        except Exception as e:
+            db.rollback()
+            print(f"Snapshot writer batch failed, writing snapshots one at a time: {e}")
+            return self._write_individually(db, batch, build_wallet_activity_snapshot)
+
+        finally:
+            db.close()
+
+    @staticmethod
+    def _write_individually(db, batch: dict, build_snapshot) -> dict:
+        failed = {}
+        for wallet_id, entry in batch.items():
+            try:
+                if db.query(Wallet.id).filter(Wallet.id == wallet_id).first():
+                    db.add(build_snapshot(db, wallet_id, entry["coin_names"], snapshot_date=entry["last_trade"]))
+                    db.commit()
+            except Exception as e:
+                db.rollback()
+                print(f"Snapshot for wallet {wallet_id} failed, it will be retried: {e}")
+                failed[wallet_id] = entry
+        return failed
+
+
+snapshot_writer = SnapshotWriter()
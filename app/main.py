@@ -2,9 +2,14 @@ import uvicorn
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 
-from app.routes import users, wallets
-from app.database import engine
+from app.routes import users, wallets, transactions, analytics
+from app.database import engine, SessionLocal, dispose_async_engine
 from app.models import Base
+from app.jobs.snapshot_writer import snapshot_writer
+from app.jobs.snapshot_days import run_snapshot_day_backfill
+from app.jobs.scheduler import job_scheduler
+from app.utils.security import password_hasher
+from app.utils.schema import upgrade_schema
 
 
 @asynccontextmanager
@@ -14,16 +19,33 @@ async def lifespan(app_name: FastAPI):
     after I would terminate the server and this led to no feedback coming from the terminal when re-running
     uvicorn. Thus, I've moved to this approach to control start and stop of the server, documented in FastAPI docs.
     """
+    # Before anything is served, so valuations find snapshots written before snapshot_day existed
+    db = SessionLocal()
+    try:
+        run_snapshot_day_backfill(db)
+    finally:
+        db.close()
+    snapshot_writer.start()
+    job_scheduler.start()
+    password_hasher.start()
     print("App has started!")
     yield
+    password_hasher.stop()
+    job_scheduler.stop()
+    # Flush queued snapshots before the process exits
+    snapshot_writer.stop()
+    await dispose_async_engine()
     print("App has shut down!")
 
 
 app = FastAPI(lifespan=lifespan)
 app.include_router(users.router)
 app.include_router(wallets.router)
+app.include_router(transactions.router)
+app.include_router(analytics.router)
 
-Base.metadata.create_all(bind=engine)
+# Also adds the columns and indexes newer models have to tables an earlier version created
+upgrade_schema(engine, Base.metadata)
 
 
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Float, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, ForeignKey, Float, Boolean, Date, DateTime, LargeBinary
+from sqlalchemy import UniqueConstraint, Index
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.types import JSON
 from datetime import datetime
 
@@ -24,6 +25,10 @@ class Wallet(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
+    cost_basis_method = Column(String, default="fifo", nullable=False)
+    realized_gain_loss_usd = Column(Float, default=0.0, nullable=False)
+    # Bumped by every trade, so anything derived from the trade history can tell when it is stale
+    version = Column(Integer, default=0, nullable=False)
 
     user = relationship("User", back_populates="wallets")
     assets = relationship("Asset", back_populates="wallet")
@@ -42,26 +47,86 @@ class Wallet(Base):
         return sum(asset.purchase_value_usd for asset in self.assets)
 
 
+def _snapshot_day(context):
+    snapshot_date = context.get_current_parameters().get("date")
+    return (snapshot_date or datetime.utcnow()).date()
+
+
 class WalletActivityData(Base):
     __tablename__ = "wallet_activity_data"
+    __table_args__ = (
+        # Compaction walks snapshots by time across all wallets
+        Index("ix_wallet_activity_data_date", "date"),
+        # Valuation lookups: latest snapshot up to a date, and last snapshot of the next day with activity
+        Index("ix_wallet_activity_data_wallet_date", "wallet_id", "date"),
+        Index("ix_wallet_activity_data_wallet_day_date", "wallet_id", "snapshot_day", "date"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     wallet_id = Column(Integer, ForeignKey("wallets.id"))
     date = Column(DateTime, default=datetime.utcnow(), nullable=False)
-    holdings = Column(JSON, nullable=False)
+    # Calendar day of date, stored so day lookups can use an index instead of DATE(date)
+    snapshot_day = Column(Date, default=_snapshot_day, nullable=True)
+    # Holdings are stored in one of two formats (see SNAPSHOT_HOLDINGS_FORMAT in app/crud/snapshots.py) and are
+    # only loaded when read, so queries that need the total do not fetch or parse them
+    holdings = deferred(Column(JSON, nullable=True), group="holdings")
+    holdings_blob = deferred(Column(LargeBinary, nullable=True), group="holdings")
     total_value_usd = Column(Float, nullable=False)
 
     wallet = relationship("Wallet", back_populates="activity_data")
 
 
+class WalletDailyValue(Base):
+    """End-of-day value and cost basis of a wallet, materialized by app/jobs/daily_values.py."""
+    __tablename__ = "wallet_daily_values"
+    __table_args__ = (
+        # Also serves as the index for (wallet, day) and (wallet, day range) lookups
+        UniqueConstraint("wallet_id", "day", name="uq_wallet_daily_values_wallet_day"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    wallet_id = Column(Integer, ForeignKey("wallets.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    total_value_usd = Column(Float, nullable=False)
+    cost_basis_usd = Column(Float, nullable=False)
+    coin_prices = Column(JSON, nullable=True)  # {coin: price_usd} for the coins held at the end of the day
+    # False while a held coin's candle for the day was not out yet and an earlier price stood in for it
+    prices_final = Column(Boolean, default=False, nullable=False)
+    computed_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class WalletDailyValueState(Base):
+    """What a wallet's daily values were computed from, so the job can tell which days later trades affect."""
+    __tablename__ = "wallet_daily_value_states"
+
+    wallet_id = Column(Integer, ForeignKey("wallets.id"), primary_key=True)
+    version = Column(Integer, nullable=False)  # Wallet.version the values reflect
+    last_purchase_id = Column(Integer, default=0, nullable=False)
+    last_sale_id = Column(Integer, default=0, nullable=False)
+    missing_prices = Column(JSON, nullable=True)  # Held coins without candles, valued at 0
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class SnapshotCoin(Base):
+    """Coin dictionary for binary snapshot holdings. Ids are never reassigned, so encoded snapshots stay readable."""
+    __tablename__ = "snapshot_coins"
+
+    id = Column(Integer, primary_key=True)
+    coin_name = Column(String, unique=True, nullable=False)
+
+
 class Asset(Base):
     __tablename__ = "assets"
+    __table_args__ = (
+        UniqueConstraint("wallet_id", "coin_name", name="uq_assets_wallet_coin"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     wallet_id = Column(Integer, ForeignKey("wallets.id"))
     coin_name = Column(String, index=True)
     quantity = Column(Float, default=0.0)
-    purchase_value_usd = Column(Float, default=0.0)
+    purchase_value_usd = Column(Float, default=0.0)  # Cost basis of the quantity still held
+    realized_gain_loss_usd = Column(Float, default=0.0)
     initial_purchase_date = Column(DateTime, default=datetime.utcnow())
 
     wallet = relationship("Wallet", back_populates="assets")
@@ -71,6 +136,10 @@ class Asset(Base):
 
 class PurchaseTransaction(Base):
     __tablename__ = "purchase_transactions"
+    __table_args__ = (
+        # A wallet's trades up to or after a moment: end-of-day holdings and the snapshot base check
+        Index("ix_purchase_transactions_wallet_date", "wallet_id", "purchase_date"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -90,6 +159,9 @@ class PurchaseTransaction(Base):
 
 class SaleTransaction(Base):
     __tablename__ = "sale_transactions"
+    __table_args__ = (
+        Index("ix_sale_transactions_wallet_date", "wallet_id", "sale_date"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -100,8 +172,67 @@ class SaleTransaction(Base):
     sale_price = Column(Float)
     total_sale_price = Column(Float)
     remaining_coin_quantity = Column(Float)
+    cost_basis_usd = Column(Float)
+    realized_gain_loss_usd = Column(Float)
     sale_date = Column(DateTime, default=datetime.utcnow())
 
     user = relationship("User", back_populates="sale_transactions")
     wallet = relationship("Wallet", back_populates="sale_transactions")
     asset = relationship("Asset", back_populates="sale_transactions")
+
+
+class AssetLot(Base):
+    """An open purchase lot. Lots are deleted once fully sold, so the table only holds what is still owned."""
+    __tablename__ = "asset_lots"
+    __table_args__ = (
+        Index("ix_asset_lots_wallet_coin_acquired", "wallet_id", "coin_name", "acquired_at", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    wallet_id = Column(Integer, ForeignKey("wallets.id"), nullable=False)
+    coin_name = Column(String, nullable=False)
+    purchase_transaction_id = Column(Integer, ForeignKey("purchase_transactions.id"), nullable=True)
+    acquired_at = Column(DateTime, nullable=False)
+    quantity_remaining = Column(Float, nullable=False)
+    cost_per_unit = Column(Float, nullable=False)
+
+    purchase_transaction = relationship("PurchaseTransaction")
+
+
+class IdempotencyRecord(Base):
+    __tablename__ = "idempotency_records"
+    __table_args__ = (
+        # Also serves as the index for replay lookups
+        UniqueConstraint("user_id", "endpoint", "key", name="uq_idempotency_records_user_endpoint_key"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    endpoint = Column(String, nullable=False)
+    key = Column(String, nullable=False)
+    request_hash = Column(String, nullable=False)
+    response = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class PurgeRequest(Base):
+    """A user or wallet whose rows are being deleted in the background, a chunk at a time."""
+    __tablename__ = "purge_requests"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    wallet_id = Column(Integer, nullable=True)  # None purges the user and all of their wallets
+    requested_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class JobCheckpoint(Base):
+    """How far a background job has got, so an interrupted run resumes instead of starting over."""
+    __tablename__ = "job_checkpoints"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_name = Column(String, unique=True, nullable=False)
+    checkpoint_at = Column(DateTime, nullable=True)  # Time-based progress, e.g. compacted up to here
+    position = Column(Integer, nullable=True)  # Key-based progress, e.g. last wallet id processed
+    completed_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
@@ -0,0 +1,77 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+from typing import List
+
+from app.schemas.wallets import (
+    WalletValueSeriesResponse, WalletHoldingsAsOfResponse, WalletRiskResponse, UserRiskResponse,
+    WalletBenchmarkResponse
+)
+from app.crud.analytics import (
+    crud_get_wallet_value_series, crud_get_holdings_as_of, crud_get_wallet_risk, crud_get_user_risk,
+    crud_get_wallet_benchmark
+)
+from app.database import get_db
+from app.utils.auth import authorize_wallet_access
+
+# Same access rule as the wallet routes: a bearer token for the {user_id} in the path, who must own the {wallet_id}
+router = APIRouter(dependencies=[Depends(authorize_wallet_access)])
+
+
+# Route to chart a wallet's daily value over a date range
+@router.get("/users/{user_id}/wallet/{wallet_id}/value-series", response_model=WalletValueSeriesResponse)
+def get_wallet_value_series(
+    user_id: int,
+    wallet_id: int,
+    start_date: str,
+    end_date: str,
+    db: Session = Depends(get_db)
+):
+    return crud_get_wallet_value_series(db, user_id, wallet_id, start_date, end_date)
+
+
+# Route to get the exact holdings of a wallet at any timestamp (a bare date means the end of that day)
+@router.get("/users/{user_id}/wallet/{wallet_id}/holdings-as-of", response_model=WalletHoldingsAsOfResponse)
+def get_holdings_as_of(
+    user_id: int,
+    wallet_id: int,
+    as_of: str,
+    db: Session = Depends(get_db)
+):
+    return crud_get_holdings_as_of(db, user_id, wallet_id, as_of)
+
+
+# Route to get a wallet's returns, volatility, drawdown, Sharpe/Sortino ratios and per-coin contribution
+@router.get("/users/{user_id}/wallet/{wallet_id}/risk", response_model=WalletRiskResponse)
+def get_wallet_risk(
+    user_id: int,
+    wallet_id: int,
+    start_date: str,
+    end_date: str,
+    db: Session = Depends(get_db)
+):
+    return crud_get_wallet_risk(db, user_id, wallet_id, start_date, end_date)
+
+
+# Route to get the same metrics for all of a user's wallets combined
+@router.get("/users/{user_id}/risk", response_model=UserRiskResponse)
+def get_user_risk(
+    user_id: int,
+    start_date: str,
+    end_date: str,
+    db: Session = Depends(get_db)
+):
+    return crud_get_user_risk(db, user_id, start_date, end_date)
+
+
+# Route to compare a wallet with the same cash flows put into a coin or a weighted basket
+# (benchmark=bitcoin, benchmark=bitcoin:0.6&benchmark=ethereum:0.4, or benchmark=top-10)
+@router.get("/users/{user_id}/wallet/{wallet_id}/benchmark", response_model=WalletBenchmarkResponse)
+def get_wallet_benchmark(
+    user_id: int,
+    wallet_id: int,
+    start_date: str,
+    end_date: str,
+    benchmark: List[str] = Query(...),
+    db: Session = Depends(get_db)
+):
+    return crud_get_wallet_benchmark(db, user_id, wallet_id, start_date, end_date, benchmark)
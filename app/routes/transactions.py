@@ -0,0 +1,87 @@
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from typing import Optional
+
+from app.schemas.transactions import TransactionImportResponse
+from app.crud.transactions import crud_import_transactions, parse_import_rows
+from app.crud.transactions import crud_export_wallet_transactions, crud_export_wallet_snapshots
+from app.database import get_db
+from app.utils.auth import authorize_wallet_access
+
+# Same access rule as the wallet routes: a bearer token for the {user_id} in the path, who must own the {wallet_id}
+router = APIRouter(dependencies=[Depends(authorize_wallet_access)])
+
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+
+def _export_response(stream, filename: str, file_format: str):
+    return StreamingResponse(
+        stream,
+        media_type=EXPORT_MEDIA_TYPES[file_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{file_format}"'}
+    )
+
+
+@router.post(
+    "/users/{user_id}/wallet/{wallet_id}/import-transactions",
+    response_model=TransactionImportResponse
+)
+async def import_transactions(
+    user_id: int,
+    wallet_id: int,
+    request: Request,
+    file_format: str = Query("csv", pattern="^(csv|json)$"),
+    db: Session = Depends(get_db)
+):
+    # The body is the raw CSV or JSON file, so it's read directly instead of through a pydantic model
+    content = (await request.body()).decode("utf-8")
+
+    return await run_in_threadpool(
+        crud_import_transactions,
+        db=db,
+        user_id=user_id,
+        wallet_id=wallet_id,
+        rows=parse_import_rows(content, file_format)
+    )
+
+
+@router.get("/users/{user_id}/wallet/{wallet_id}/export-transactions")
+def export_transactions(
+    user_id: int,
+    wallet_id: int,
+    file_format: str = Query("csv", pattern="^(csv|parquet)$"),
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    stream = crud_export_wallet_transactions(
+        db=db,
+        user_id=user_id,
+        wallet_id=wallet_id,
+        file_format=file_format,
+        start_date=start_date,
+        end_date=end_date
+    )
+    return _export_response(stream, f"wallet_{wallet_id}_transactions", file_format)
+
+
+@router.get("/users/{user_id}/wallet/{wallet_id}/export-snapshots")
+def export_snapshots(
+    user_id: int,
+    wallet_id: int,
+    file_format: str = Query("csv", pattern="^(csv|parquet)$"),
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    stream = crud_export_wallet_snapshots(
+        db=db,
+        user_id=user_id,
+        wallet_id=wallet_id,
+        file_format=file_format,
+        start_date=start_date,
+        end_date=end_date
+    )
+    return _export_response(stream, f"wallet_{wallet_id}_snapshots", file_format)
@@ -1,12 +1,16 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, BackgroundTasks, Depends, Query
 from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 
 from app.schemas.users import UserCreate, UserUpdate, UserResponse, UserUpdateResponse, UserDeleteResponse
-from app.schemas.users import UserLogin, UserLoginResponse
-from app.crud.users import crud_update_user, crud_delete_user, crud_get_user_by_username, crud_get_all_users
-from app.crud.users import crud_login_user, crud_create_user
-from app.database import get_db
+from app.schemas.users import UserLogin, UserLoginResponse, BulkUserCreateResponse
+from app.schemas.users import UserSearchFieldEnum, UserSearchResponse
+from app.crud.users import crud_update_user, crud_delete_user, crud_login_user, crud_create_user, crud_create_users
+from app.crud.async_users import crud_get_user_by_username, crud_get_all_users, crud_search_users
+from app.database import get_db, get_async_db
+from app.jobs.purge import purge_in_background
+from app.utils.auth import authorize_user_or_admin, require_admin
 
 router = APIRouter()
 
@@ -16,24 +20,64 @@ def create_new_user(user: UserCreate, db: Session = Depends(get_db)):
     return crud_create_user(db=db, user=user)
 
 
+# Route to create many users at once, e.g. for a migration; each row reports its new id or why it was rejected.
+# Only admins (ADMIN_USER_IDS) may call it
+@router.post("/users/bulk", response_model=BulkUserCreateResponse, dependencies=[Depends(require_admin)])
+def create_users_in_bulk(users: List[UserCreate], db: Session = Depends(get_db)):
+    return crud_create_users(db=db, users=users)
+
+
+# Route to page through users by username or email, optionally only those starting with a prefix
+@router.get("/users/search", response_model=UserSearchResponse)
+async def search_users(
+    prefix: Optional[str] = None,
+    field: UserSearchFieldEnum = UserSearchFieldEnum.USERNAME,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await crud_search_users(db=db, field=field.value, prefix=prefix, limit=limit, cursor=cursor)
+
+
 @router.get("/users/{username}", response_model=UserResponse)
-def fetch_user_by_name(username: str, db: Session = Depends(get_db)):
-    return crud_get_user_by_username(db=db, username=username)
+async def fetch_user_by_name(username: str, db: AsyncSession = Depends(get_async_db)):
+    return await crud_get_user_by_username(db=db, username=username)
 
 
+# Route to list users in id order, a page at a time; pass the last id of a page as after_id for the next one
 @router.get("/users/", response_model=List[UserResponse])
-def fetch_all_users(db: Session = Depends(get_db)):
-    return crud_get_all_users(db=db)
+async def fetch_all_users(
+    limit: int = Query(100, ge=1, le=500),
+    after_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await crud_get_all_users(db=db, limit=limit, after_id=after_id)
 
 
+# Routes to change or delete a user; only the user themselves or an admin (ADMIN_USER_IDS) may call them
 @router.put("/users/{user_id}", response_model=UserUpdateResponse)
-def modify_user(user_id: int, user_update: UserUpdate, db: Session = Depends(get_db)):
+def modify_user(
+    user_id: int,
+    user_update: UserUpdate,
+    current_user_id: int = Depends(authorize_user_or_admin),
+    db: Session = Depends(get_db)
+):
     return crud_update_user(db=db, user_id=user_id, user_update=user_update)
 
 
+# Route to delete a user and everything they own; background=true purges it in chunks after responding
 @router.delete("/users/{user_id}", response_model=UserDeleteResponse)
-def remove_user(user_id: int, db: Session = Depends(get_db)):
-    return crud_delete_user(db=db, user_id=user_id)
+def remove_user(
+    user_id: int,
+    background_tasks: BackgroundTasks,
+    background: bool = False,
+    current_user_id: int = Depends(authorize_user_or_admin),
+    db: Session = Depends(get_db)
+):
+    response = crud_delete_user(db=db, user_id=user_id, background=background)
+    if background:
+        background_tasks.add_task(purge_in_background)
+    return response
 
 
 @router.post("/login", response_model=UserLoginResponse)
@@ -1,22 +1,49 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, Query, Header
 from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 
 from app.schemas.wallets import WalletBase, WalletResponse, WalletDeleteResponse, WalletValuationResponse
+from app.schemas.wallets import CostBasisMethodEnum, WalletValuationsResponse, UserPortfolioResponse
 from app.schemas.transactions import PurchaseTransactionResponse, SaleTransactionResponse, PaginatedTransactionsResponse
+from app.schemas.transactions import BatchOrderRequest, BatchOrderResponse
 from app.schemas.assets import PaginatedAssetsResponse
 from app.crud.wallets import crud_create_wallet, crud_purchase_asset, crud_sell_asset
-from app.crud.wallets import crud_get_wallet_by_id, crud_get_all_transactions_for_wallet, crud_delete_wallet
-from app.crud.wallets import crud_get_all_wallets, crud_get_wallet_valuation
-from app.database import get_db
+from app.crud.wallets import crud_get_wallet_by_id, crud_delete_wallet, crud_get_wallet_valuation, crud_batch_order
+from app.crud.async_wallets import crud_get_all_wallets, crud_get_all_transactions_for_wallet
+from app.crud.wallets import crud_set_cost_basis_method, crud_get_wallet_valuations, crud_get_user_portfolio
+from app.database import get_db, get_async_db
+from app.jobs.purge import purge_in_background
+from app.utils.auth import authorize_wallet_access, get_current_user_id
 
-router = APIRouter()
+# Every wallet route needs a bearer token for the {user_id} in its path, and that user must own the {wallet_id}
+router = APIRouter(dependencies=[Depends(authorize_wallet_access)])
 
 
 # Route to create a wallet
 @router.post("/users/{user_id}/wallet/", response_model=WalletBase)
-def create_wallet(user_id: int, db: Session = Depends(get_db)):
-    return crud_create_wallet(db=db, user_id=user_id)
+def create_wallet(
+    user_id: int,
+    cost_basis_method: CostBasisMethodEnum = CostBasisMethodEnum.FIFO,
+    db: Session = Depends(get_db)
+):
+    return crud_create_wallet(db=db, user_id=user_id, cost_basis_method=cost_basis_method.value)
+
+
+# Route to choose how sales are matched against purchases (fifo, lifo or average)
+@router.put("/users/{user_id}/wallet/{wallet_id}/cost_basis_method", response_model=WalletBase)
+def set_cost_basis_method(
+    user_id: int,
+    wallet_id: int,
+    cost_basis_method: CostBasisMethodEnum,
+    db: Session = Depends(get_db)
+):
+    return crud_set_cost_basis_method(
+        db=db,
+        user_id=user_id,
+        wallet_id=wallet_id,
+        cost_basis_method=cost_basis_method.value
+    )
 
 
 # Route to get wallet details (including assets)
@@ -50,19 +77,29 @@ def fetch_wallet(
 
 
 @router.get("/wallets/", response_model=List[WalletResponse])
-def fetch_all_wallets(db: Session = Depends(get_db)):
-    return crud_get_all_wallets(db)
+async def fetch_all_wallets(
+        current_user_id: int = Depends(get_current_user_id),
+        db: AsyncSession = Depends(get_async_db)
+):
+    # Only the caller's own wallets, since the path names no user for the router dependency to check
+    return await crud_get_all_wallets(db, current_user_id)
+
+
+# Route to value everything a user holds, per coin and per wallet
+@router.get("/users/{user_id}/portfolio", response_model=UserPortfolioResponse)
+def fetch_user_portfolio(user_id: int, db: Session = Depends(get_db)):
+    return crud_get_user_portfolio(db, user_id)
 
 
 @router.get("/users/{user_id}/wallet/{wallet_id}/all-transactions", response_model=PaginatedTransactionsResponse)
-def get_all_transactions_for_wallet(
+async def get_all_transactions_for_wallet(
         user_id: int,
         wallet_id: int,
         limit: int = Query(10, ge=1),
         page: int = Query(1, ge=1),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ):
-    transactions, total_transactions, total_pages = crud_get_all_transactions_for_wallet(
+    transactions, total_transactions, total_pages = await crud_get_all_transactions_for_wallet(
         db=db,
         user_id=user_id,
         wallet_id=wallet_id,
@@ -89,12 +126,24 @@ def get_wallet_valuation(
     return crud_get_wallet_valuation(db, user_id, wallet_id, historical_date)
 
 
+# Route to value a wallet on several dates at once, e.g. ?historical_dates=2025-01-31&historical_dates=2025-02-28
+@router.get("/users/{user_id}/wallet/{wallet_id}/valuations-by-date", response_model=WalletValuationsResponse)
+def get_wallet_valuations(
+    user_id: int,
+    wallet_id: int,
+    historical_dates: List[str] = Query(...),
+    db: Session = Depends(get_db)
+):
+    return crud_get_wallet_valuations(db, user_id, wallet_id, historical_dates)
+
+
 @router.put("/users/{user_id}/wallet/{wallet_id}/purchase_asset", response_model=PurchaseTransactionResponse)
 def purchase_asset(
     user_id: int,
     wallet_id: int,
     coin_name: str,
     quantity: float,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: Session = Depends(get_db)
 ):
     return crud_purchase_asset(
@@ -103,6 +152,7 @@ def purchase_asset(
         wallet_id=wallet_id,
         coin_name=coin_name,
         quantity=quantity,
+        idempotency_key=idempotency_key,
     )
 
 
@@ -112,6 +162,7 @@ def sell_asset(
     wallet_id: int,
     coin_name: str,
     quantity: float,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: Session = Depends(get_db)
 ):
     return crud_sell_asset(
@@ -120,10 +171,34 @@ def sell_asset(
         wallet_id=wallet_id,
         coin_name=coin_name,
         quantity=quantity,
+        idempotency_key=idempotency_key,
+    )
+
+
+@router.post("/users/{user_id}/wallet/{wallet_id}/batch_order", response_model=BatchOrderResponse)
+def batch_order(
+    user_id: int,
+    wallet_id: int,
+    order: BatchOrderRequest,
+    db: Session = Depends(get_db)
+):
+    return crud_batch_order(
+        db=db,
+        user_id=user_id,
+        wallet_id=wallet_id,
+        legs=order.legs,
     )
 
 
 @router.delete("/users/{user_id}/wallet/{wallet_id}/", response_model=WalletDeleteResponse)
-def delete_wallet(user_id: int, wallet_id: int, db: Session = Depends(get_db)):
-    delete_message = crud_delete_wallet(db=db, wallet_id=wallet_id, user_id=user_id)
+def delete_wallet(
+    user_id: int,
+    wallet_id: int,
+    background_tasks: BackgroundTasks,
+    background: bool = False,
+    db: Session = Depends(get_db)
+):
+    delete_message = crud_delete_wallet(db=db, wallet_id=wallet_id, user_id=user_id, background=background)
+    if background:
+        background_tasks.add_task(purge_in_background)
     return {"message": delete_message}
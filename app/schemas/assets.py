@@ -24,6 +24,7 @@ class AssetResponse(AssetBase):
     current_price_usd: float
     current_value_usd: float
     net_gain_loss: float
+    realized_gain_loss_usd: Optional[float] = 0.0
     initial_purchase_date: datetime
     market_cap_usd: float
     supply: float
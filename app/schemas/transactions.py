@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
 from enum import Enum
@@ -41,6 +41,8 @@ class SaleTransactionBase(BaseModel):
 class SaleTransactionResponse(SaleTransactionBase):
     total_sale_price: float
     remaining_coin_quantity: float
+    cost_basis_usd: Optional[float] = None
+    realized_gain_loss_usd: Optional[float] = None
     id: int
     sale_date: datetime
 
@@ -85,3 +87,40 @@ class WalletValuationResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class TransactionImportRow(BaseModel):
+    type: TransactionTypeEnum
+    coin_name: str
+    quantity: float = Field(gt=0)
+    price: float = Field(gt=0)
+    timestamp: datetime
+
+
+class TransactionImportResponse(BaseModel):
+    wallet_id: int
+    rows_imported: int
+    purchases_imported: int
+    sales_imported: int
+    snapshots_created: int
+
+
+class OrderSideEnum(str, Enum):
+    BUY = "buy"
+    SELL = "sell"
+
+
+class BatchOrderLeg(BaseModel):
+    side: OrderSideEnum
+    coin_name: str
+    quantity: float = Field(gt=0)
+
+
+class BatchOrderRequest(BaseModel):
+    legs: List[BatchOrderLeg] = Field(min_length=1)
+
+
+class BatchOrderResponse(BaseModel):
+    wallet_id: int
+    purchases: List[PurchaseTransactionResponse]
+    sales: List[SaleTransactionResponse]
@@ -1,5 +1,6 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
+from enum import Enum
 
 
 class UserBase(BaseModel):
@@ -21,6 +22,29 @@ class UserResponse(UserBase):
         from_attributes = True
 
 
+class BulkUserResult(BaseModel):
+    index: int  # Position of the row in the request
+    username: str
+    id: Optional[int] = None  # Set when the user was created
+    error: Optional[str] = None
+
+
+class BulkUserCreateResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkUserResult]
+
+
+class UserSearchFieldEnum(str, Enum):
+    USERNAME = "username"
+    EMAIL = "email"
+
+
+class UserSearchResponse(BaseModel):
+    users: List[UserResponse]
+    next_cursor: Optional[str] = None  # Pass back as cursor for the next page; None on the last page
+
+
 class UserUpdate(BaseModel):
     username: Optional[str] = None
     email: Optional[str] = None
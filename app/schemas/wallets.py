@@ -1,12 +1,21 @@
 from pydantic import BaseModel
 from typing import Optional, List, Dict
+from datetime import date, datetime
+from enum import Enum
 
 from app.schemas.assets import AssetBase
 
 
+class CostBasisMethodEnum(str, Enum):
+    FIFO = "fifo"
+    LIFO = "lifo"
+    AVERAGE = "average"
+
+
 class WalletBase(BaseModel):
     id: int
     user_id: int
+    cost_basis_method: str = "fifo"
 
     class Config:
         from_attributes = True
@@ -19,6 +28,7 @@ class WalletCreate(WalletBase):
 class WalletResponse(WalletBase):
     amount_of_coins: float
     total_value_usd: float
+    realized_gain_loss_usd: float = 0.0
     assets: List[AssetBase]
 
     class Config:
@@ -40,5 +50,118 @@ class WalletValuationResponse(BaseModel):
     net_gain_loss: float
 
 
+class WalletDatedValuation(BaseModel):
+    historical_date: date
+    snap_shot_date: str
+    snap_shot_date_relative_to_historic_date: str
+    holdings: Dict
+    total_value_usd_on_snapshot_date: float
+    date_requested_total_value: float
+    net_gain_loss: float
+
+
+class WalletValuationsResponse(BaseModel):
+    wallet_id: int
+    missing_prices: List[str]  # Coins in past snapshots with no price history, valued at 0
+    valuations: List[WalletDatedValuation]
+
+
+class WalletValuePoint(BaseModel):
+    date: date
+    total_value_usd: float
+
+
+class WalletValueSeriesResponse(BaseModel):
+    wallet_id: int
+    start_date: date
+    end_date: date
+    coins: List[str]
+    missing_prices: List[str]  # Held coins with no price history, valued at 0
+    series: List[WalletValuePoint]
+
+
+class WalletHoldingsAsOfResponse(BaseModel):
+    wallet_id: int
+    as_of: datetime
+    holdings: Dict[str, float]  # coin_name -> quantity held at as_of
+
+
+class BenchmarkWeight(BaseModel):
+    coin_name: str
+    weight: float
+
+
+class BenchmarkPoint(BaseModel):
+    date: date
+    wallet_value_usd: float
+    benchmark_value_usd: float
+    net_cash_flow_usd: float  # Opening value on the first day, then purchases less sale proceeds
+
+
+class WalletBenchmarkResponse(BaseModel):
+    wallet_id: int
+    start_date: date
+    end_date: date
+    benchmark: List[BenchmarkWeight]
+    missing_prices: List[str]  # Held coins with no price history, valued at 0
+    series: List[BenchmarkPoint]
+
+
+class DailyReturnPoint(BaseModel):
+    date: date
+    daily_return: Optional[float]  # None on days nothing was held
+
+
+class RiskReport(BaseModel):
+    start_date: date
+    end_date: date
+    coins: List[str]
+    missing_prices: List[str]  # Held coins with no price history, left out of the returns
+    total_return: float
+    annualized_volatility: Optional[float]
+    max_drawdown: float
+    sharpe_ratio: Optional[float]
+    sortino_ratio: Optional[float]
+    contributions: Dict[str, float]  # coin_name -> summed share of the daily returns
+    daily_returns: List[DailyReturnPoint]
+
+
+class WalletRiskResponse(RiskReport):
+    wallet_id: int
+
+
+class UserRiskResponse(RiskReport):
+    user_id: int
+    wallet_ids: List[int]
+
+
+class PortfolioCoin(BaseModel):
+    coin_name: str
+    quantity: float
+    purchase_value_usd: float
+    current_price_usd: float
+    current_value_usd: float
+    net_gain_loss: float
+    wallet_count: int  # Wallets holding the coin
+
+
+class PortfolioWallet(BaseModel):
+    wallet_id: int
+    coin_count: int
+    purchase_value_usd: float
+    current_value_usd: float
+    net_gain_loss: float
+
+
+class UserPortfolioResponse(BaseModel):
+    user_id: int
+    total_value_usd: float
+    total_purchase_value_usd: float
+    net_gain_loss: float
+    missing_prices: List[str]  # Held coins without a current price, valued at 0
+    coins: List[PortfolioCoin]
+    wallets: List[PortfolioWallet]
+
+
 class WalletDeleteResponse(BaseModel):
     message: str
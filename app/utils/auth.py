@@ -0,0 +1,131 @@
+import os
+from typing import Optional
+import jwt
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from sqlalchemy.orm import Session
+
+from app.database import get_db
+from app.models import User, Wallet
+from app.utils.cache import TTLCache
+from app.utils.security import decode_access_token
+
+load_dotenv()
+
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 1024))
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", 60))
+# Users allowed on admin routes such as POST /users/bulk, e.g. ADMIN_USER_IDS=1,2
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+# token -> user_id, kept no longer than the token's own expiry
+_token_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL_SECONDS)
+# user_id -> True for users known to exist
+_user_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL_SECONDS)
+# wallet_id -> owning user_id
+_wallet_owner_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL_SECONDS)
+
+
+def _unauthorized(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"}
+    )
+
+
+def _token_user_id(token: str) -> int:
+    user_id = _token_cache.get(token)
+    if user_id is not None:
+        return user_id
+
+    try:
+        claims = decode_access_token(token)
+        user_id = int(claims["sub"])
+    except jwt.ExpiredSignatureError:
+        raise _unauthorized("Token has expired")
+    except (jwt.InvalidTokenError, ValueError):
+        raise _unauthorized("Invalid token")
+
+    _token_cache.set(token, user_id, expires_at=claims["exp"])
+    return user_id
+
+
+def get_current_user_id(
+        credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+        db: Session = Depends(get_db)
+) -> int:
+    """Id of the user the bearer token was issued to. Repeat requests with a token are answered from memory."""
+    if credentials is None:
+        raise _unauthorized("Not authenticated")
+
+    user_id = _token_user_id(credentials.credentials)
+
+    if _user_cache.get(user_id) is None:
+        if db.query(User.id).filter(User.id == user_id).first() is None:
+            raise _unauthorized("Invalid token")
+        _user_cache.set(user_id, True)
+
+    return user_id
+
+
+def _path_id(request: Request, name: str) -> Optional[int]:
+    # Malformed ids are left for the route's own validation to report
+    try:
+        return int(request.path_params[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def authorize_wallet_access(
+        request: Request,
+        current_user_id: int = Depends(get_current_user_id),
+        db: Session = Depends(get_db)
+):
+    """
+    Router dependency: the token's user must be the {user_id} in the path and own the {wallet_id} in it. Wallets
+    that don't exist are let through so the route reports them as usual.
+    """
+    user_id = _path_id(request, "user_id")
+    if user_id is not None and user_id != current_user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access this user")
+
+    wallet_id = _path_id(request, "wallet_id")
+    if wallet_id is None:
+        return
+
+    owner_id = _wallet_owner_cache.get(wallet_id)
+    if owner_id is None:
+        owner_id = db.query(Wallet.user_id).filter(Wallet.id == wallet_id).scalar()
+        if owner_id is None:
+            return
+        _wallet_owner_cache.set(wallet_id, owner_id)
+
+    if owner_id != current_user_id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="This wallet does not belong to the user")
+
+
+def require_admin(current_user_id: int = Depends(get_current_user_id)) -> int:
+    """Route dependency: the token's user must be one of ADMIN_USER_IDS."""
+    if current_user_id not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user_id
+
+
+def authorize_user_or_admin(request: Request, current_user_id: int = Depends(get_current_user_id)) -> int:
+    """Route dependency: the token's user must be the {user_id} in the path or one of ADMIN_USER_IDS."""
+    user_id = _path_id(request, "user_id")
+    if user_id is not None and user_id != current_user_id and current_user_id not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access this user")
+    return current_user_id
+
+
+def forget_user(user_id: int):
+    _user_cache.pop(user_id)
+
+
+def forget_wallet_owner(wallet_id: int):
+    """Drops a deleted wallet's owner, since SQLite may hand its id to the next wallet."""
+    _wallet_owner_cache.pop(wallet_id)
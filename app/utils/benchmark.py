@@ -0,0 +1,22 @@
+import numpy as np
+
+
+def basket_index(prices: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Daily level of a basket rebalanced to its weights every day, starting at 1, from a (days, coins) price matrix.
+    Each day's move is the weighted sum of the coins' price changes.
+    """
+    previous = prices[:-1]
+    changes = np.divide(prices[1:], previous, out=np.ones_like(previous), where=previous > 0) - 1
+    return np.concatenate(([1.0], np.cumprod(1 + changes @ weights)))
+
+
+def replay_cash_flows(flows: np.ndarray, index: np.ndarray) -> np.ndarray:
+    """
+    Value of an account that puts each day's net cash flow into the index at that day's level. Units are the running
+    sum of flow / level, floored at zero: a withdrawal larger than the account empties it rather than shorting.
+    The floored sum is the plain running sum less its lowest point so far, so no Python loop is needed.
+    """
+    units = np.cumsum(flows / index)
+    units -= np.minimum(np.minimum.accumulate(units), 0)
+    return units * index
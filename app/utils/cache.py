@@ -0,0 +1,49 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class TTLCache:
+    """
+    A least-recently-used mapping of at most maxsize entries, each of which also expires ttl seconds after it was
+    set, or earlier when set with its own expires_at. Times are on the clock passed in (wall-clock seconds by default,
+    to match JWT expiry claims). Safe to share between request threads.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, value), most recently used last
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= self.clock():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: Hashable, value, expires_at: Optional[float] = None):
+        expires_at = min(self.clock() + self.ttl, expires_at if expires_at is not None else float("inf"))
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,66 @@
+from datetime import datetime
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+CHECKPOINT_INTERVAL = 64
+
+
+class HoldingsIndex:
+    """
+    Answers "what did the wallet hold at time t" from its trade history without snapshots.
+
+    Trades are kept in time order. For a single coin, a prefix sum of its signed quantities means the position at t
+    is one binary search. For the whole wallet, the holdings of every coin are checkpointed every
+    CHECKPOINT_INTERVAL trades, so an as-of query is a binary search, a checkpoint copy and a replay of at most
+    CHECKPOINT_INTERVAL trades.
+    """
+
+    def __init__(self, trades: Iterable[Tuple[datetime, str, float]], checkpoint_interval: int = CHECKPOINT_INTERVAL):
+        """trades are (timestamp, coin_name, signed quantity) tuples, already in time order."""
+        trades = list(trades)
+        self.checkpoint_interval = checkpoint_interval
+        self.coins = sorted({coin for _, coin, _ in trades})
+        coin_index = {coin: j for j, coin in enumerate(self.coins)}
+
+        self.times = np.array([timestamp for timestamp, _, _ in trades], dtype="datetime64[us]")
+        self.coin_ids = np.array([coin_index[coin] for _, coin, _ in trades], dtype=np.int64)
+        self.quantities = np.array([quantity for _, _, quantity in trades], dtype=np.float64)
+
+        # Per-coin timelines and running positions
+        self.coin_times = {}
+        self.coin_positions = {}
+        boundaries = np.arange(0, len(trades) + 1, checkpoint_interval)
+        # checkpoints[k] holds every coin's position after the first k * checkpoint_interval trades
+        self.checkpoints = np.zeros((len(boundaries), len(self.coins)))
+
+        for coin, j in coin_index.items():
+            trade_numbers = np.flatnonzero(self.coin_ids == j)
+            self.coin_times[coin] = self.times[trade_numbers]
+            self.coin_positions[coin] = np.cumsum(self.quantities[trade_numbers])
+
+            trades_before = np.searchsorted(trade_numbers, boundaries)
+            reached = trades_before > 0
+            self.checkpoints[reached, j] = self.coin_positions[coin][trades_before[reached] - 1]
+
+    def __len__(self):
+        return len(self.times)
+
+    def _trades_through(self, timestamps, as_of: datetime) -> int:
+        return int(np.searchsorted(timestamps, np.datetime64(as_of, "us"), side="right"))
+
+    def quantity_as_of(self, coin_name: str, as_of: datetime) -> float:
+        if coin_name not in self.coin_times:
+            return 0.0
+        count = self._trades_through(self.coin_times[coin_name], as_of)
+        return float(self.coin_positions[coin_name][count - 1]) if count else 0.0
+
+    def holdings_as_of(self, as_of: datetime, epsilon: float = 0.0) -> Dict[str, float]:
+        count = self._trades_through(self.times, as_of)
+        checkpoint = count // self.checkpoint_interval
+
+        positions = self.checkpoints[checkpoint].copy()
+        replay = slice(checkpoint * self.checkpoint_interval, count)
+        np.add.at(positions, self.coin_ids[replay], self.quantities[replay])
+
+        return {coin: float(quantity) for coin, quantity in zip(self.coins, positions) if quantity > epsilon}
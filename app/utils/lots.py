@@ -0,0 +1,63 @@
+from collections import deque
+from datetime import datetime
+
+COST_BASIS_METHODS = ("fifo", "lifo", "average")
+
+# Anything smaller than this left in a lot after a sale is float noise, not a position
+LOT_EPSILON = 1e-12
+
+
+class LotBook:
+    """
+    Open lots for one (wallet, coin) kept oldest first. FIFO sales consume from the left and LIFO sales from the
+    right, so a sale only ever touches the lots it uses up plus one partial lot. Average cost pools everything
+    into a single lot.
+    """
+
+    def __init__(self, method: str, lots=()):
+        if method not in COST_BASIS_METHODS:
+            raise ValueError(f"Unknown cost basis method: {method}")
+
+        self.method = method
+        self.lots = deque([quantity, cost_per_unit, acquired_at] for quantity, cost_per_unit, acquired_at in lots)
+
+    @property
+    def quantity(self) -> float:
+        return sum(lot[0] for lot in self.lots)
+
+    @property
+    def cost_basis(self) -> float:
+        return sum(lot[0] * lot[1] for lot in self.lots)
+
+    def add(self, quantity: float, cost_per_unit: float, acquired_at: datetime):
+        if self.method == "average" and self.lots:
+            pooled = self.lots[0]
+            total_quantity = pooled[0] + quantity
+            pooled[1] = (pooled[0] * pooled[1] + quantity * cost_per_unit) / total_quantity
+            pooled[0] = total_quantity
+        else:
+            self.lots.append([quantity, cost_per_unit, acquired_at])
+
+    def consume(self, quantity: float) -> float:
+        """Removes quantity from the book and returns its cost basis. Raises ValueError if the book holds less."""
+        cost = 0.0
+        remaining = quantity
+        take_newest = self.method == "lifo"
+
+        while remaining > LOT_EPSILON:
+            if not self.lots:
+                raise ValueError("Insufficient quantity in lots")
+
+            lot = self.lots[-1] if take_newest else self.lots[0]
+            taken = min(lot[0], remaining)
+            cost += taken * lot[1]
+            lot[0] -= taken
+            remaining -= taken
+
+            if lot[0] <= LOT_EPSILON:
+                if take_newest:
+                    self.lots.pop()
+                else:
+                    self.lots.popleft()
+
+        return cost
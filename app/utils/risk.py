@@ -0,0 +1,71 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# Crypto trades every day of the year
+PERIODS_PER_YEAR = 365
+
+
+def daily_returns(holdings: np.ndarray, prices: np.ndarray):
+    """
+    Time-weighted daily returns from (days, coins) holdings and price matrices. Each day's return is the price move
+    of the previous day's holdings over their previous value, so buys and sells are not counted as gains or losses.
+    Returns (returns, contributions): returns has one entry per day after the first (NaN where nothing was held),
+    contributions is (days - 1, coins) with each coin's share of that day's return.
+    """
+    held_value = holdings[:-1] * prices[:-1]
+    price_moves = holdings[:-1] * (prices[1:] - prices[:-1])
+    opening_value = held_value.sum(axis=1, keepdims=True)
+
+    contributions = np.divide(
+        price_moves, opening_value, out=np.full(price_moves.shape, np.nan), where=opening_value > 0
+    )
+    returns = np.where(opening_value[:, 0] > 0, contributions.sum(axis=1), np.nan)
+    return returns, contributions
+
+
+def _ratio(numerator: float, denominator: float) -> Optional[float]:
+    return float(numerator / denominator) if denominator > 0 else None
+
+
+def risk_metrics(
+        returns: np.ndarray,
+        contributions: np.ndarray,
+        coins: List[str],
+        risk_free_rate: float = 0.0
+) -> Dict:
+    """
+    Summary statistics of daily returns: compounded total return, annualized volatility, maximum drawdown of the
+    compounded value, annualized Sharpe and Sortino ratios against an annual risk-free rate, and each coin's summed
+    contribution to the daily returns. Days with nothing held are left out.
+    """
+    active = ~np.isnan(returns)
+    returns = returns[active]
+    contributions = np.nan_to_num(contributions[active])
+
+    if returns.size == 0:
+        return {
+            "total_return": 0.0,
+            "annualized_volatility": None,
+            "max_drawdown": 0.0,
+            "sharpe_ratio": None,
+            "sortino_ratio": None,
+            "contributions": {coin: 0.0 for coin in coins}
+        }
+
+    growth = np.cumprod(1 + returns)
+    drawdowns = growth / np.maximum.accumulate(np.maximum(growth, 1.0)) - 1
+
+    excess = returns - risk_free_rate / PERIODS_PER_YEAR
+    volatility = returns.std(ddof=1) if returns.size > 1 else 0.0
+    downside = np.sqrt(np.mean(np.minimum(excess, 0) ** 2))
+    annualize = np.sqrt(PERIODS_PER_YEAR)
+
+    return {
+        "total_return": float(growth[-1] - 1),
+        "annualized_volatility": float(volatility * annualize) if returns.size > 1 else None,
+        "max_drawdown": float(min(drawdowns.min(), 0.0)),
+        "sharpe_ratio": _ratio(excess.mean() * annualize, volatility),
+        "sortino_ratio": _ratio(excess.mean() * annualize, downside),
+        "contributions": dict(zip(coins, contributions.sum(axis=0).tolist()))
+    }
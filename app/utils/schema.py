@@ -0,0 +1,110 @@
+"""
+Brings a database created by an earlier version of the app up to the current models. create_all only creates
+missing tables, so columns, indexes and unique constraints added to existing tables since are added here, and
+columns that became nullable lose their NOT NULL. Every step checks the live schema first, so it is safe to run on
+each startup.
+"""
+from sqlalchemy import MetaData, inspect, literal
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import Column, CreateTable, Table, UniqueConstraint
+
+
+def _default_literal(connection: Connection, column: Column):
+    """The column's scalar default as SQL, so rows that predate the column get it, or None when it has none."""
+    default = column.default
+    if default is None or not default.is_scalar:
+        return None
+    return str(literal(default.arg, column.type).compile(
+        dialect=connection.dialect, compile_kwargs={"literal_binds": True}
+    ))
+
+
+def _add_column(connection: Connection, table: Table, column: Column):
+    preparer = connection.dialect.identifier_preparer
+    ddl = f"{preparer.quote(column.name)} {column.type.compile(dialect=connection.dialect)}"
+
+    default = _default_literal(connection, column)
+    if default is not None:
+        ddl += f" DEFAULT {default}"
+        # Without a default, existing rows can only be NULL, so the column is added nullable
+        if not column.nullable:
+            ddl += " NOT NULL"
+
+    connection.exec_driver_sql(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}")
+    print(f"Schema: added {table.name}.{column.name}")
+
+
+def _rebuild_sqlite_table(connection: Connection, table: Table, index_names):
+    """
+    SQLite can't drop NOT NULL from a column, so the table is recreated from the model under a temporary name, its
+    rows copied over, and the copy renamed into place. The old indexes are dropped and recreated from the model.
+    """
+    preparer = connection.dialect.identifier_preparer
+    name, temporary_name = preparer.quote(table.name), preparer.quote(f"_rebuild_{table.name}")
+    existing = [column["name"] for column in inspect(connection).get_columns(table.name)]
+    columns = ", ".join(preparer.quote(column) for column in existing if column in table.c)
+
+    for index_name in index_names:
+        connection.exec_driver_sql(f"DROP INDEX {preparer.quote(index_name)}")
+
+    create_table = str(CreateTable(table).compile(dialect=connection.dialect)).strip()
+    connection.exec_driver_sql(create_table.replace(f"CREATE TABLE {name}", f"CREATE TABLE {temporary_name}", 1))
+    connection.exec_driver_sql(f"INSERT INTO {temporary_name} ({columns}) SELECT {columns} FROM {name}")
+    connection.exec_driver_sql(f"DROP TABLE {name}")
+    connection.exec_driver_sql(f"ALTER TABLE {temporary_name} RENAME TO {name}")
+    for index in table.indexes:
+        index.create(connection)
+    print(f"Schema: rebuilt {table.name} to allow NULLs")
+
+
+def _upgrade_table(connection: Connection, table: Table):
+    inspector = inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+    existing_columns = {column["name"]: column for column in inspector.get_columns(table.name)}
+
+    for column in table.columns:
+        if column.name not in existing_columns:
+            _add_column(connection, table, column)
+
+    now_nullable = [
+        column.name for column in table.columns
+        if column.name in existing_columns and column.nullable and not existing_columns[column.name]["nullable"]
+        and not column.primary_key
+    ]
+    if now_nullable:
+        if connection.dialect.name == "sqlite":
+            index_names = [index["name"] for index in inspector.get_indexes(table.name)]
+            _rebuild_sqlite_table(connection, table, index_names)
+            return
+        for name in now_nullable:
+            connection.exec_driver_sql(
+                f"ALTER TABLE {preparer.format_table(table)} ALTER COLUMN {preparer.quote(name)} DROP NOT NULL"
+            )
+            print(f"Schema: {table.name}.{name} now allows NULLs")
+
+    existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+    existing_indexes |= {constraint["name"] for constraint in inspector.get_unique_constraints(table.name)}
+
+    for index in table.indexes:
+        if index.name not in existing_indexes:
+            index.create(connection)
+            print(f"Schema: created index {index.name}")
+
+    # Added as unique indexes, which serve ON CONFLICT the same way and need no table rebuild
+    for constraint in table.constraints:
+        if isinstance(constraint, UniqueConstraint) and constraint.name and constraint.name not in existing_indexes:
+            columns = ", ".join(preparer.quote(column.name) for column in constraint.columns)
+            connection.exec_driver_sql(
+                f"CREATE UNIQUE INDEX {preparer.quote(constraint.name)} ON {preparer.format_table(table)} ({columns})"
+            )
+            print(f"Schema: created unique index {constraint.name}")
+
+
+def upgrade_schema(engine: Engine, metadata: MetaData):
+    """Creates missing tables, then upgrades the existing ones, all in one transaction."""
+    with engine.begin() as connection:
+        existing_tables = set(inspect(connection).get_table_names())
+        metadata.create_all(bind=connection)
+        for table in metadata.sorted_tables:
+            if table.name in existing_tables:
+                _upgrade_table(connection, table)
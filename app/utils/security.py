@@ -1,26 +1,157 @@
 import os
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
 from passlib.context import CryptContext
 from dotenv import load_dotenv
+from fastapi import HTTPException, status
 import jwt
 from datetime import datetime, timedelta
 
 load_dotenv()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 16))
+PASSWORD_HASH_NICE = int(os.getenv("PASSWORD_HASH_NICE", 10))
+
+# Hashes made with any other cost factor still verify, but are flagged so a successful login replaces them
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
 
 
-def hash_password(password: str) -> str:
+# Run inside the worker processes, so they must be importable module functions
+def _lower_priority():
+    # Request threads get the CPU first when the hashing workers share cores with them
+    if hasattr(os, "nice"):
+        os.nice(PASSWORD_HASH_NICE)
+
+
+def _hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+def _verify(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def _verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a pool of worker processes, so a burst of logins or signups cannot tie up the threads serving
+    every other request. At most max_pending operations may be running or waiting for a worker; past that, callers
+    get a 503 straight away instead of queueing behind them. Until the pool is started, work runs in the caller.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def running(self) -> bool:
+        return self._executor is not None
+
+    def start(self):
+        with self._lock:
+            if self._executor is not None:
+                return
+            # Spawned rather than forked, since forking a process with running threads can copy held locks
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=_lower_priority
+            )
+        print("Password hasher started")
+
+    def stop(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+            print("Password hasher stopped")
+
+    def _admit(self, count: int = 1):
+        admitted = 0
+        while admitted < count and self._slots.acquire(blocking=False):
+            admitted += 1
+        if admitted < count:
+            self._release(admitted)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many password checks in progress, please try again shortly",
+                headers={"Retry-After": "1"}
+            )
+
+    def _release(self, count: int = 1):
+        for _ in range(count):
+            self._slots.release()
+
+    def run(self, function, *args):
+        self._admit()
+        try:
+            executor = self._executor
+            if executor is None:
+                return function(*args)
+            return executor.submit(function, *args).result()
+        finally:
+            self._release()
+
+    def map(self, function, values: List) -> List:
+        """
+        function applied to every value, spread over all the workers. Values go one per worker at a time, each
+        holding a pending slot, so a large batch takes turns with logins instead of queueing ahead of them, and is
+        rejected like any other check once the slots run out.
+        """
+        step = max(1, min(self.workers, self.max_pending))
+        results = []
+        for offset in range(0, len(values), step):
+            chunk = values[offset:offset + step]
+            self._admit(len(chunk))
+            try:
+                executor = self._executor
+                if executor is None:
+                    results.extend(function(value) for value in chunk)
+                else:
+                    results.extend(executor.map(function, chunk))
+            finally:
+                self._release(len(chunk))
+        return results
+
+
+password_hasher = PasswordHasher()
+
+
+def hash_password(password: str) -> str:
+    return password_hasher.run(_hash, password)
+
+
+def hash_passwords(passwords: List[str]) -> List[str]:
+    return password_hasher.map(_hash, passwords)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return password_hasher.run(_verify, plain_password, hashed_password)
+
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verifies the password and, when the hash uses an outdated cost factor, returns a new hash to store."""
+    return password_hasher.run(_verify_and_update, plain_password, hashed_password)
+
+
 def create_access_token(user_id: int):
     to_encode = {"sub": str(user_id)}
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -30,6 +161,11 @@ def create_access_token(user_id: int):
     return encoded_jwt
 
 
+def decode_access_token(token: str) -> dict:
+    """The token's claims. Raises jwt.ExpiredSignatureError or jwt.InvalidTokenError when it doesn't verify."""
+    return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"require": ["sub", "exp"]})
+
+
 if __name__ == '__main__':
     password = "mysecretpassword"
     hashed_password = pwd_context.hash(password)
@@ -0,0 +1,72 @@
+from collections.abc import Mapping
+from typing import Dict
+
+import numpy as np
+
+# Bumped if the record layout changes, so old blobs can still be told apart
+CODEC_VERSION = 1
+
+# One fixed-size record per coin; the coin is an id from the coin dictionary instead of its name
+HOLDING_DTYPE = np.dtype([
+    ("coin_id", "<u4"),
+    ("quantity", "<f8"),
+    ("purchase_value_usd", "<f8"),
+    ("value_on_date_usd", "<f8"),
+])
+
+
+def encode_holdings(holdings: dict, coin_ids: Dict[str, int]) -> bytes:
+    """Packs snapshot holdings ({coin: {quantity, purchase_value_usd, value_on_date_usd}}) into a version byte
+    followed by one HOLDING_DTYPE record per coin."""
+    records = np.empty(len(holdings), dtype=HOLDING_DTYPE)
+    for i, (coin, holding) in enumerate(holdings.items()):
+        records[i] = (
+            coin_ids[coin], holding["quantity"], holding["purchase_value_usd"], holding["value_on_date_usd"]
+        )
+    return bytes([CODEC_VERSION]) + records.tobytes()
+
+
+def decode_records(blob: bytes) -> np.ndarray:
+    """Returns the blob's records as a read-only view over its bytes, without copying or building any dicts."""
+    if not blob or blob[0] != CODEC_VERSION:
+        raise ValueError(f"Unsupported snapshot holdings encoding: {blob[:1]!r}")
+    return np.frombuffer(blob, dtype=HOLDING_DTYPE, offset=1)
+
+
+class HoldingsView(Mapping):
+    """
+    Read-only {coin: holding} mapping over decoded records. Nothing is decoded up front: the coin lookup is built on
+    first access and each holding dict only when that coin is read, so callers that need one coin, or the sum of a
+    column via records, skip the rest.
+    """
+
+    def __init__(self, records: np.ndarray, coin_names: Dict[int, str]):
+        self.records = records
+        self._coin_names = coin_names
+        self._rows = None
+        self._positions = None
+
+    def _index(self) -> dict:
+        if self._positions is None:
+            # One conversion of the whole buffer is much cheaper than converting record by record
+            self._rows = self.records.tolist()
+            self._positions = {self._coin_names[row[0]]: i for i, row in enumerate(self._rows)}
+        return self._positions
+
+    def __getitem__(self, coin: str) -> dict:
+        position = self._index()[coin]
+        coin_id, quantity, purchase_value_usd, value_on_date_usd = self._rows[position]
+        return {
+            "quantity": quantity,
+            "purchase_value_usd": purchase_value_usd,
+            "value_on_date_usd": value_on_date_usd
+        }
+
+    def __iter__(self):
+        return iter(self._index())
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def to_dict(self) -> dict:
+        return {coin: self[coin] for coin in self}
@@ -0,0 +1,70 @@
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+def day_range(start: date, end: date) -> List[date]:
+    return [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+
+def holdings_matrix(
+        days: List[date],
+        coins: List[str],
+        opening: Dict[str, float],
+        deltas: Iterable[Tuple[str, date, float]]
+) -> np.ndarray:
+    """
+    Quantity held of each coin at the end of each day, shaped (days, coins). Starts from the opening quantities and
+    adds each day's net traded quantity, so a running sum down the day axis gives the holdings.
+    """
+    day_index = {day: i for i, day in enumerate(days)}
+    coin_index = {coin: j for j, coin in enumerate(coins)}
+
+    changes = np.zeros((len(days), len(coins)))
+    for coin, day, quantity in deltas:
+        changes[day_index[day], coin_index[coin]] += quantity
+
+    changes[0] += np.array([opening.get(coin, 0.0) for coin in coins])
+
+    return np.cumsum(changes, axis=0)
+
+
+def candle_day(candle: dict) -> date:
+    return datetime.fromtimestamp(candle["time"] / 1000, tz=timezone.utc).date()
+
+
+def price_column(days: List[date], candles: Optional[List[dict]]) -> Optional[np.ndarray]:
+    """
+    Daily prices for one coin from its d1 candles. Each day takes the latest candle on or before it, and days before
+    the first candle take the first one. Returns None when there are no candles.
+    """
+    if not candles:
+        return None
+
+    candles = sorted(candles, key=lambda candle: candle["time"])
+    candle_days = np.array([candle_day(candle).toordinal() for candle in candles])
+    candle_prices = np.array([float(candle["priceUsd"]) for candle in candles])
+
+    positions = np.searchsorted(candle_days, [day.toordinal() for day in days], side="right") - 1
+    return candle_prices[np.clip(positions, 0, None)]
+
+
+def price_matrix(days: List[date], coins: List[str], candles_by_coin: Dict[str, Optional[List[dict]]]):
+    """Prices shaped (days, coins). Coins without any candles are priced at 0 and returned in missing."""
+    prices = np.zeros((len(days), len(coins)))
+    missing = []
+
+    for j, coin in enumerate(coins):
+        column = price_column(days, candles_by_coin.get(coin))
+        if column is None:
+            missing.append(coin)
+        else:
+            prices[:, j] = column
+
+    return prices, missing
+
+
+def value_series(holdings: np.ndarray, prices: np.ndarray) -> np.ndarray:
+    """Total value per day: the row-wise dot product of the holdings and price matrices."""
+    return np.einsum("dc,dc->d", holdings, prices)
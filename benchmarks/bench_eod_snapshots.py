@@ -0,0 +1,63 @@
+"""
+Measures how long the end-of-day snapshot job takes over many wallets, against a file SQLite database.
+
+    python -m benchmarks.bench_eod_snapshots --wallets 100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import date
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import User, Wallet, Asset
+from app.jobs.eod_snapshots import run_eod_snapshots
+
+COINS = ["bitcoin", "ethereum", "xrp", "solana", "cardano"]
+FAKE_ASSETS = {"assets": {coin: {"id": coin, "priceUsd": str(10 + i)} for i, coin in enumerate(COINS)}}
+
+
+def seed(db, wallets: int):
+    db.add(User(id=1, username="bench", email="bench@example.com"))
+    db.commit()
+    db.execute(insert(Wallet), [{"id": wallet_id, "user_id": 1} for wallet_id in range(1, wallets + 1)])
+    db.execute(insert(Asset), [
+        {"wallet_id": wallet_id, "coin_name": coin, "quantity": random.random(), "purchase_value_usd": 100.0}
+        for wallet_id in range(1, wallets + 1)
+        for coin in random.sample(COINS, 3)
+    ])
+    db.commit()
+
+
+def run(wallets: int, chunk_size: int):
+    random.seed(7)
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        seed(db, wallets)
+
+        with patch("app.jobs.eod_snapshots.fetch_all_assets", return_value=FAKE_ASSETS):
+            start = time.perf_counter()
+            report = run_eod_snapshots(db, date(2025, 3, 15), chunk_size=chunk_size)
+            elapsed = time.perf_counter() - start
+
+        db.close()
+        engine.dispose()
+
+    print(f"snapshots written: {report['snapshots_written']:,}")
+    print(f"elapsed:           {elapsed:.2f}s")
+    print(f"throughput:        {report['snapshots_written'] / elapsed:,.0f} wallets/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wallets", type=int, default=100000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+    run(args.wallets, args.chunk_size)
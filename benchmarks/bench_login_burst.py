@@ -0,0 +1,163 @@
+"""
+Fires a burst of concurrent logins at a running server while other clients keep reading wallets, and reports the
+wallet-read latency with bcrypt run in the request threads and with it run in the password hasher's process pool.
+The pool takes PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING and PASSWORD_HASH_NICE from the environment unless
+--workers or --max-pending are given, so settings can be compared before changing them.
+
+    python -m benchmarks.bench_login_burst --logins 100 --login-clients 32 --readers 4 [--workers 2 --max-pending 16]
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import requests
+import uvicorn
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.main import app
+from app.database import Base, get_db, get_async_db
+from app.models import User, Wallet
+from app.utils import security
+
+PORT = 8765
+URL = f"http://127.0.0.1:{PORT}"
+
+
+def seed(db):
+    db.add(User(id=1, username="bench", email="bench@example.com", password_hash=security._hash("password123")))
+    db.add_all([Wallet(id=wallet_id, user_id=1) for wallet_id in range(1, 21)])
+    db.commit()
+
+
+def read_wallet_until(stop: threading.Event, latencies: list):
+    session = requests.Session()
+    session.headers["Authorization"] = f"Bearer {security.create_access_token(1)}"
+    while not stop.is_set():
+        start = time.perf_counter()
+        session.get(f"{URL}/wallets/").raise_for_status()
+        latencies.append(time.perf_counter() - start)
+
+
+def login(session_holder: threading.local) -> int:
+    if not hasattr(session_holder, "session"):
+        session_holder.session = requests.Session()
+    response = session_holder.session.post(f"{URL}/login", json={"username": "bench", "password": "password123"})
+    return response.status_code
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+
+def measure(readers: int, logins: int, login_clients: int, seconds: float) -> dict:
+    stop = threading.Event()
+    latencies = []
+    reader_threads = [
+        threading.Thread(target=read_wallet_until, args=(stop, latencies)) for _ in range(readers)
+    ]
+    for thread in reader_threads:
+        thread.start()
+
+    start = time.perf_counter()
+    if logins:
+        session_holder = threading.local()
+        with ThreadPoolExecutor(max_workers=login_clients) as clients:
+            statuses = list(clients.map(lambda _: login(session_holder), range(logins)))
+    else:
+        time.sleep(seconds)
+        statuses = []
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    for thread in reader_threads:
+        thread.join()
+
+    return {
+        "wallet reads": len(latencies),
+        "read p50 (ms)": percentile(latencies, 0.50),
+        "read p99 (ms)": percentile(latencies, 0.99),
+        "logins ok": statuses.count(200),
+        "logins shed (503)": statuses.count(503),
+        "elapsed (s)": elapsed,
+    }
+
+
+def run(logins: int, login_clients: int, readers: int, workers: int, max_pending: int):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        async_session_factory = async_sessionmaker(create_async_engine(f"sqlite+aiosqlite:///{path}"))
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+        db = session_factory()
+        seed(db)
+        db.close()
+
+        def override_get_db():
+            session = session_factory()
+            try:
+                yield session
+            finally:
+                session.close()
+
+        async def override_get_async_db():
+            async with async_session_factory() as session:
+                yield session
+
+        app.dependency_overrides[get_db] = override_get_db
+        app.dependency_overrides[get_async_db] = override_get_async_db
+        server = uvicorn.Server(uvicorn.Config(app, port=PORT, log_level="warning", lifespan="off"))
+        server_thread = threading.Thread(target=server.run, daemon=True)
+
+        results = {}
+        with patch("app.utils.security.SECRET_KEY", "bench"), \
+                contextlib.redirect_stdout(io.StringIO()):
+            server_thread.start()
+            while not server.started:
+                time.sleep(0.05)
+
+            results["no logins"] = measure(readers, 0, login_clients, 3.0)
+
+            # Unbounded and in the request threads, as before the pool
+            inline = security.PasswordHasher(max_pending=logins)
+            with patch("app.utils.security.password_hasher", inline):
+                results["inline bcrypt"] = measure(readers, logins, login_clients, 0)
+
+            pooled = security.PasswordHasher(workers=workers, max_pending=max_pending)
+            pooled.start()
+            pooled.run(security._hash, "warm up the workers")
+            with patch("app.utils.security.password_hasher", pooled):
+                results["process pool"] = measure(readers, logins, login_clients, 0)
+            pooled.stop()
+
+            server.should_exit = True
+            server_thread.join()
+
+        app.dependency_overrides.clear()
+        engine.dispose()
+
+    print(f"{logins} logins from {login_clients} clients, {readers} wallet readers, bcrypt cost {security.BCRYPT_ROUNDS}")
+    print(f"Pool of {workers} workers at nice {security.PASSWORD_HASH_NICE}, {max_pending} pending at most")
+    print(f"{'':20}" + "".join(f"{name:>16}" for name in results))
+    for metric in results["no logins"]:
+        print(f"{metric:20}" + "".join(f"{result[metric]:>16,.1f}" for result in results.values()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--login-clients", type=int, default=32)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=security.PASSWORD_HASH_WORKERS)
+    parser.add_argument("--max-pending", type=int, default=security.PASSWORD_HASH_MAX_PENDING)
+    args = parser.parse_args()
+    run(args.logins, args.login_clients, args.readers, args.workers, args.max_pending)
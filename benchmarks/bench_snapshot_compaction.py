@@ -0,0 +1,98 @@
+"""
+Reports wallet_activity_data size and valuation-by-date latency before and after snapshot compaction.
+
+    python -m benchmarks.bench_snapshot_compaction --wallets 20 --days 90 --per-day 200
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import User, Wallet, WalletActivityData
+from app.crud.wallets import crud_get_wallet_valuation
+from app.jobs.compaction import run_snapshot_compaction
+
+COINS = ["bitcoin", "ethereum", "xrp", "solana", "cardano"]
+NOW = datetime(2025, 6, 1)
+
+
+def seed(db, wallets: int, days: int, per_day: int):
+    db.add(User(id=1, username="bench", email="bench@example.com"))
+    db.add_all([Wallet(id=wallet_id, user_id=1) for wallet_id in range(1, wallets + 1)])
+    db.commit()
+
+    start = NOW - timedelta(days=days)
+    for wallet_id in range(1, wallets + 1):
+        rows = []
+        for i in range(days * per_day):
+            holdings = {
+                coin: {"quantity": random.random(), "purchase_value_usd": 100.0, "value_on_date_usd": 120.0}
+                for coin in COINS
+            }
+            rows.append({
+                "wallet_id": wallet_id,
+                "date": start + timedelta(seconds=i * 86400 / per_day),
+                "holdings": holdings,
+                "total_value_usd": 600.0
+            })
+        db.execute(insert(WalletActivityData), rows)
+        db.commit()
+
+
+def measure(db, engine, path: str, wallets: int, days: int, queries: int) -> dict:
+    with engine.connect() as connection:
+        connection.execute(text("VACUUM"))
+
+    dates = [(NOW - timedelta(days=random.randint(1, days - 1))).strftime("%Y-%m-%d") for _ in range(queries)]
+    start = time.perf_counter()
+    for date in dates:
+        crud_get_wallet_valuation(db, user_id=1, wallet_id=random.randint(1, wallets), historical_date=date)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "rows": db.query(WalletActivityData).count(),
+        "size_mb": os.path.getsize(path) / 1_000_000,
+        "latency_ms": elapsed / queries * 1000
+    }
+
+
+def run(wallets: int, days: int, per_day: int, queries: int):
+    random.seed(7)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+
+        seed(db, wallets, days, per_day)
+        before = measure(db, engine, path, wallets, days, queries)
+
+        start = time.perf_counter()
+        report = run_snapshot_compaction(db, now=NOW)
+        compaction_elapsed = time.perf_counter() - start
+
+        after = measure(db, engine, path, wallets, days, queries)
+        db.close()
+        engine.dispose()
+
+    print(f"{'':18}{'before':>12}{'after':>12}")
+    print(f"{'snapshot rows':18}{before['rows']:>12,}{after['rows']:>12,}")
+    print(f"{'database size MB':18}{before['size_mb']:>12.1f}{after['size_mb']:>12.1f}")
+    print(f"{'valuation ms':18}{before['latency_ms']:>12.2f}{after['latency_ms']:>12.2f}")
+    print(f"compaction took {compaction_elapsed:.2f}s, deleted {report['deleted_hourly'] + report['deleted_daily']:,}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wallets", type=int, default=20)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--per-day", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    run(args.wallets, args.days, args.per_day, args.queries)
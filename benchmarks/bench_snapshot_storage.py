@@ -0,0 +1,126 @@
+"""
+Compares JSON and binary snapshot holdings: bytes stored per snapshot, time to decode every snapshot, and time to
+read only the totals, against a file SQLite database.
+
+    python -m benchmarks.bench_snapshot_storage --snapshots 100000 --coins 10
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.orm import sessionmaker, undefer_group
+
+from app.database import Base
+from app.models import User, Wallet, WalletActivityData
+from app.crud import snapshots
+from app.utils.snapshot_codec import HoldingsView, decode_records
+
+COINS = [f"coin-{i}" for i in range(100)]
+
+
+def seed(db, count: int, coins: int):
+    db.add(User(id=1, username="bench", email="bench@example.com"))
+    db.add(Wallet(id=1, user_id=1))
+    db.commit()
+
+    start = datetime(2025, 1, 1)
+    for offset in range(0, count, 1000):
+        rows = []
+        for i in range(offset, min(offset + 1000, count)):
+            holdings = {
+                coin: {
+                    "quantity": random.random() * 10,
+                    "purchase_value_usd": random.random() * 1000,
+                    "value_on_date_usd": random.random() * 1000
+                }
+                for coin in sorted(random.sample(COINS, coins))
+            }
+            rows.append({
+                "wallet_id": 1,
+                "date": start + timedelta(minutes=i),
+                **snapshots.holdings_columns(db, holdings),
+                "total_value_usd": sum(holding["value_on_date_usd"] for holding in holdings.values())
+            })
+        db.execute(insert(WalletActivityData), rows)
+        db.commit()
+
+
+def measure(storage_format: str, count: int, coins: int) -> dict:
+    random.seed(7)
+    snapshots.forget_coin_dictionary()
+
+    with tempfile.TemporaryDirectory() as directory, \
+            patch("app.crud.snapshots.SNAPSHOT_HOLDINGS_FORMAT", storage_format):
+        path = os.path.join(directory, "bench.db")
+        engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        seed(db, count, coins)
+
+        column = WalletActivityData.holdings_blob if storage_format == "binary" else WalletActivityData.holdings
+        payload_bytes = db.query(func.sum(func.length(column))).scalar()
+
+        db.expunge_all()
+        start = time.perf_counter()
+        total = sum(snapshot.total_value_usd for snapshot in db.query(WalletActivityData))
+        totals_seconds = time.perf_counter() - start
+
+        db.expunge_all()
+        start = time.perf_counter()
+        rows = db.query(WalletActivityData).options(undefer_group("holdings")).all()
+        rows_seconds = time.perf_counter() - start
+
+        # Decode the stored payloads directly, so ORM overhead does not hide the difference
+        payloads = [
+            payload for (payload,) in db.connection().exec_driver_sql(f"SELECT {column.key} FROM wallet_activity_data")
+        ]
+        coin_names = snapshots.get_coin_names(db, range(1, len(COINS) + 1))
+        decode = json.loads if storage_format == "json" else lambda payload: HoldingsView(
+            decode_records(payload), coin_names
+        )
+
+        start = time.perf_counter()
+        decoded = sum(len(dict(decode(payload))) for payload in payloads)
+        decode_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for payload in payloads:
+            decode(payload).get("coin-0")
+        one_coin_seconds = time.perf_counter() - start
+
+        db.close()
+        engine.dispose()
+        file_bytes = os.path.getsize(path)
+
+    assert decoded == count * coins and len(rows) == count and total > 0
+    return {
+        "payload bytes/snapshot": payload_bytes / count,
+        "file bytes/snapshot": file_bytes / count,
+        "read totals only (ms)": totals_seconds * 1000,
+        "read rows with holdings (ms)": rows_seconds * 1000,
+        "decode all holdings (ms)": decode_seconds * 1000,
+        "read one coin (ms)": one_coin_seconds * 1000,
+    }
+
+
+def run(count: int, coins: int):
+    results = {storage_format: measure(storage_format, count, coins) for storage_format in ("json", "binary")}
+
+    print(f"{count:,} snapshots with {coins} coins each")
+    print(f"{'':28}{'json':>12}{'binary':>12}")
+    for metric in results["json"]:
+        print(f"{metric:28}{results['json'][metric]:>12,.1f}{results['binary'][metric]:>12,.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--snapshots", type=int, default=100000)
+    parser.add_argument("--coins", type=int, default=10)
+    args = parser.parse_args()
+    run(args.snapshots, args.coins)
@@ -0,0 +1,58 @@
+"""
+Measures bulk transaction import throughput (rows/second) against an in-memory SQLite database.
+
+    python -m benchmarks.bench_transaction_import --rows 20000
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import User, Wallet
+from app.crud.transactions import crud_import_transactions, parse_import_rows
+
+COINS = ["bitcoin", "ethereum", "xrp", "solana", "cardano"]
+FAKE_ASSETS = {"assets": {coin: {"id": coin, "priceUsd": "1.0"} for coin in COINS}}
+
+
+def build_csv(rows: int) -> str:
+    start = datetime(2020, 1, 1)
+    lines = ["type,coin_name,quantity,price,timestamp"]
+    for i in range(rows):
+        # Each coin gets two buys then a sell, so no position ever goes negative
+        trade_type = "sale" if i % 3 == 2 else "purchase"
+        timestamp = start + timedelta(minutes=30 * i)
+        lines.append(f"{trade_type},{COINS[(i // 3) % len(COINS)]},1,{100 + i % 50},{timestamp.isoformat()}")
+    return "\n".join(lines)
+
+
+def run(rows: int):
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+
+    db.add(User(id=1, username="bench", email="bench@example.com"))
+    db.add(Wallet(id=1, user_id=1))
+    db.commit()
+
+    content = build_csv(rows)
+
+    with patch("app.crud.transactions.fetch_all_assets", return_value=FAKE_ASSETS):
+        start = time.perf_counter()
+        result = crud_import_transactions(db, user_id=1, wallet_id=1, rows=parse_import_rows(content, "csv"))
+        elapsed = time.perf_counter() - start
+
+    print(f"rows imported:     {result['rows_imported']}")
+    print(f"snapshots written: {result['snapshots_created']}")
+    print(f"elapsed:           {elapsed:.2f}s")
+    print(f"throughput:        {result['rows_imported'] / elapsed:,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    run(parser.parse_args().rows)
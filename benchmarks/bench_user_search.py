@@ -0,0 +1,87 @@
+"""
+Times prefix search and keyset paging over a large users table, against a file SQLite database.
+
+    python -m benchmarks.bench_user_search --users 1000000
+"""
+import argparse
+import os
+import random
+import string
+import tempfile
+import time
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.models import User
+from app.crud.users import crud_search_users
+
+
+def seed(db, count: int):
+    for offset in range(0, count, 10000):
+        db.execute(insert(User), [
+            {
+                "username": "".join(random.choices(string.ascii_lowercase, k=8)) + str(i),
+                "email": f"user{i}@example.com",
+                "password_hash": "hash"
+            }
+            for i in range(offset, min(offset + 10000, count))
+        ])
+    db.commit()
+
+
+def timed(function, repeats: int) -> list:
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - start) * 1000)
+    return sorted(durations)
+
+
+def run(count: int, repeats: int):
+    random.seed(7)
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+
+        start = time.perf_counter()
+        seed(db, count)
+        print(f"seeded {count:,} users in {time.perf_counter() - start:.1f}s")
+
+        prefixes = ["".join(random.choices(string.ascii_lowercase, k=length)) for length in (1, 2, 3) * repeats]
+        searches = iter(prefixes)
+        results = {
+            "prefix search, 50 rows": timed(lambda: crud_search_users(db, prefix=next(searches)), len(prefixes)),
+            "email prefix search": timed(lambda: crud_search_users(db, field="email", prefix="user99"), repeats),
+        }
+
+        cursor = crud_search_users(db, limit=500)["next_cursor"]
+
+        def next_page():
+            nonlocal cursor
+            cursor = crud_search_users(db, limit=500, cursor=cursor)["next_cursor"]
+
+        results["next page of 500"] = timed(next_page, repeats)
+
+        start = time.perf_counter()
+        everyone = db.query(User).all()
+        full_table_ms = (time.perf_counter() - start) * 1000
+
+        db.close()
+        engine.dispose()
+
+    print(f"{'':26}{'p50 (ms)':>12}{'p99 (ms)':>12}")
+    for name, durations in results.items():
+        print(f"{name:26}{durations[len(durations) // 2]:>12.2f}{durations[int(len(durations) * 0.99)]:>12.2f}")
+    print(f"{'load full table (before)':26}{full_table_ms:>12.0f}   ({len(everyone):,} rows)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+    run(args.users, args.repeats)
@@ -0,0 +1,119 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import async_database_url, pool_args
+from app.models import Base, User, Wallet, Asset, PurchaseTransaction, SaleTransaction
+from app.crud import async_users, async_wallets, users, wallets
+
+
+# Both engines on one file database, so each async function can be checked against its sync counterpart
+@pytest.fixture(scope="function")
+def databases(tmp_path):
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+
+    db = sessionmaker(bind=engine)()
+    db.add_all([User(id=i, username=name, email=f"{name}@example.com") for i, name in enumerate(
+        ["alice", "bob", "bobby", "carol"], start=1
+    )])
+    db.add(Wallet(id=1, user_id=1))
+    db.add(Asset(wallet_id=1, coin_name="bitcoin", quantity=1.5, purchase_value_usd=150))
+    db.add(PurchaseTransaction(
+        user_id=1, wallet_id=1, coin_name="bitcoin", quantity_purchased=2, purchase_price=100,
+        total_purchase_price=200, purchase_date=datetime(2025, 3, 1, 9)
+    ))
+    db.add(SaleTransaction(
+        user_id=1, wallet_id=1, coin_name="bitcoin", quantity_sold=0.5, sale_price=110,
+        sale_date=datetime(2025, 3, 2, 9)
+    ))
+    db.commit()
+
+    async_engine = create_async_engine(async_database_url(url))
+    yield db, async_sessionmaker(async_engine, expire_on_commit=False)
+
+    db.close()
+    engine.dispose()
+    asyncio.run(async_engine.dispose())
+
+
+def run_async(session_factory, crud_function, *args, **kwargs):
+    async def call():
+        async with session_factory() as session:
+            return await crud_function(session, *args, **kwargs)
+
+    return asyncio.run(call())
+
+
+def test_async_database_url():
+    assert async_database_url("sqlite:///./test.db") == "sqlite+aiosqlite:///./test.db"
+    assert async_database_url("postgresql://user:pw@localhost/db") == "postgresql+asyncpg://user:pw@localhost/db"
+    assert async_database_url("postgresql+asyncpg://localhost/db") == "postgresql+asyncpg://localhost/db"
+
+
+def test_pool_args_only_for_queue_pools():
+    assert pool_args("sqlite:///./test.db")["pool_size"] > 0
+    assert pool_args("postgresql://user:pw@localhost/db")["max_overflow"] >= 0
+
+    # In-memory SQLite engines don't take pool sizes, so they still start with DB_POOL_SIZE set
+    for url in ("sqlite://", "sqlite:///:memory:", "sqlite:///file:test?mode=memory&uri=true"):
+        assert pool_args(url) == {}
+        create_engine(url, **pool_args(url)).dispose()
+    asyncio.run(create_async_engine("sqlite+aiosqlite://", **pool_args("sqlite+aiosqlite://")).dispose())
+
+
+def test_async_user_queries_match_sync(databases):
+    db, session_factory = databases
+
+    user = run_async(session_factory, async_users.crud_get_user_by_username, "bob")
+    assert (user.id, user.email) == (2, "bob@example.com")
+    assert run_async(session_factory, async_users.crud_get_user_by_id, 3).username == "bobby"
+
+    all_users = run_async(session_factory, async_users.crud_get_all_users)
+    assert [user.username for user in all_users] == [user.username for user in users.crud_get_all_users(db)]
+    page = run_async(session_factory, async_users.crud_get_all_users, limit=2, after_id=1)
+    assert [user.username for user in page] == [user.username for user in users.crud_get_all_users(db, 2, 1)]
+
+    for kwargs in ({"prefix": "bob"}, {"field": "email", "limit": 2}, {"limit": 1, "prefix": "b"}):
+        assert run_async(session_factory, async_users.crud_search_users, **kwargs) == users.crud_search_users(
+            db, **kwargs
+        )
+
+
+def test_async_user_errors_match_sync(databases):
+    _, session_factory = databases
+
+    with pytest.raises(HTTPException) as exc_info:
+        run_async(session_factory, async_users.crud_get_user_by_username, "nobody")
+    assert (exc_info.value.status_code, exc_info.value.detail) == (404, "nobody not found")
+
+    with pytest.raises(HTTPException) as exc_info:
+        run_async(session_factory, async_users.crud_get_user_by_id, 99)
+    assert exc_info.value.status_code == 404
+
+    with pytest.raises(HTTPException) as exc_info:
+        run_async(session_factory, async_users.crud_search_users, cursor="not-a-cursor")
+    assert (exc_info.value.status_code, exc_info.value.detail) == (400, "Invalid cursor")
+
+
+def test_async_wallet_queries_match_sync(databases):
+    db, session_factory = databases
+
+    # Assets are loaded with the wallets, since they can't be lazy loaded after the session is gone
+    [wallet] = run_async(session_factory, async_wallets.crud_get_all_wallets, 1)
+    assert [asset.coin_name for asset in wallet.assets] == ["bitcoin"]
+    assert (wallet.amount_of_coins, wallet.total_value_usd) == (1.5, 150)
+
+    assert run_async(
+        session_factory, async_wallets.crud_get_all_transactions_for_wallet, user_id=1, wallet_id=1, limit=10, page=1
+    ) == wallets.crud_get_all_transactions_for_wallet(db, user_id=1, wallet_id=1, limit=10, page=1)
+
+    with pytest.raises(HTTPException) as exc_info:
+        run_async(session_factory, async_wallets.crud_get_all_transactions_for_wallet, 2, 1, limit=10, page=1)
+    assert (exc_info.value.status_code, exc_info.value.detail) == (404, "Wallet not found")
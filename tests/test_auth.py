@@ -0,0 +1,283 @@
+import asyncio
+import json
+from contextlib import contextmanager
+
+import jwt
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.requests import Request
+from unittest.mock import patch
+from datetime import datetime, timedelta
+
+from app.database import Base, get_db, get_async_db, async_database_url
+from app.crud import users, wallets
+from app.main import app
+from app.models import User, Wallet
+from app.routes import analytics, transactions
+from app.routes.wallets import router
+from app.utils import auth, security
+from app.utils.cache import TTLCache
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture(scope="function")
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    session.add(User(id=1, username="alice", email="alice@example.com"))
+    session.add(User(id=2, username="bob", email="bob@example.com"))
+    session.add(Wallet(id=1, user_id=1))
+    session.add(Wallet(id=2, user_id=2))
+    session.commit()
+    with patch("app.utils.security.SECRET_KEY", "test-secret"):
+        yield session
+    session.close()
+    for cache in (auth._token_cache, auth._user_cache, auth._wallet_owner_cache):
+        cache.clear()
+    Base.metadata.drop_all(bind=engine)
+
+
+def bearer(token: str) -> HTTPAuthorizationCredentials:
+    return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+
+def request(**path_params) -> Request:
+    return Request({"type": "http", "path_params": {name: str(value) for name, value in path_params.items()}})
+
+
+@contextmanager
+def recorded_queries():
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def test_ttl_cache_expires_and_evicts():
+    now = [1000.0]
+    cache = TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+
+    cache.set("a", 1)
+    cache.set("b", 2, expires_at=1005)
+    cache.get("a")
+    cache.set("c", 3)  # Evicts b, the least recently used
+
+    assert cache.get("b") is None
+    now[0] = 1009
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    now[0] = 1010
+    assert cache.get("a") is None
+    assert len(cache) == 1
+
+
+def test_token_and_user_are_cached(db):
+    token = security.create_access_token(user_id=1)
+
+    assert auth.get_current_user_id(bearer(token), db) == 1
+
+    with recorded_queries() as statements, patch("app.utils.auth.decode_access_token") as decode:
+        assert auth.get_current_user_id(bearer(token), db) == 1
+
+    decode.assert_not_called()
+    assert statements == []
+
+
+def test_invalid_expired_and_missing_tokens_are_rejected(db):
+    expired = jwt.encode(
+        {"sub": "1", "exp": datetime.utcnow() - timedelta(minutes=1)}, "test-secret", algorithm=security.ALGORITHM
+    )
+    forged = jwt.encode(
+        {"sub": "1", "exp": datetime.utcnow() + timedelta(minutes=1)}, "other-secret", algorithm=security.ALGORITHM
+    )
+
+    for credentials, detail in ((None, "Not authenticated"), (bearer(expired), "Token has expired"),
+                                (bearer(forged), "Invalid token"), (bearer("not-a-jwt"), "Invalid token")):
+        with pytest.raises(HTTPException) as exc_info:
+            auth.get_current_user_id(credentials, db)
+        assert exc_info.value.status_code == 401
+        assert exc_info.value.detail == detail
+
+
+def test_deleted_user_token_is_rejected(db):
+    token = security.create_access_token(user_id=2)
+    auth.get_current_user_id(bearer(token), db)
+
+    db.query(Wallet).filter(Wallet.user_id == 2).delete()
+    users.crud_delete_user(db, 2)
+
+    with pytest.raises(HTTPException) as exc_info:
+        auth.get_current_user_id(bearer(token), db)
+    assert exc_info.value.status_code == 401
+
+
+def test_wallet_access_requires_owner(db):
+    auth.authorize_wallet_access(request(user_id=1, wallet_id=1), 1, db)
+    auth.authorize_wallet_access(request(), 1, db)
+    # Unknown wallets are left for the route to report
+    auth.authorize_wallet_access(request(user_id=1, wallet_id=99), 1, db)
+
+    with pytest.raises(HTTPException) as exc_info:
+        auth.authorize_wallet_access(request(user_id=2, wallet_id=2), 1, db)
+    assert exc_info.value.detail == "Not authorized to access this user"
+
+    with pytest.raises(HTTPException) as exc_info:
+        auth.authorize_wallet_access(request(user_id=1, wallet_id=2), 1, db)
+    assert exc_info.value.status_code == 403
+    assert exc_info.value.detail == "This wallet does not belong to the user"
+
+
+def test_deleted_wallet_owner_is_forgotten(db):
+    auth.authorize_wallet_access(request(user_id=1, wallet_id=1), 1, db)
+    assert auth._wallet_owner_cache.get(1) == 1
+
+    wallets.crud_delete_wallet(db, 1, 1)
+
+    assert auth._wallet_owner_cache.get(1) is None
+
+
+def test_wallet_routes_require_authorization():
+    assert [dependency.dependency for dependency in router.dependencies] == [auth.authorize_wallet_access]
+
+
+# Served through the whole app, on a file database so the threadpool and the asyncio session both see the rows
+@pytest.fixture(scope="function")
+def served(tmp_path):
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    file_engine = create_engine(url, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=file_engine)
+    session_factory = sessionmaker(bind=file_engine)
+    async_engine = create_async_engine(async_database_url(url))
+    async_session_factory = async_sessionmaker(async_engine, expire_on_commit=False)
+
+    session = session_factory()
+    session.add_all([User(id=1, username="alice", email="alice@example.com"),
+                     User(id=2, username="bob", email="bob@example.com")])
+    session.add_all([Wallet(id=1, user_id=1), Wallet(id=2, user_id=2)])
+    session.commit()
+    session.close()
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def override_get_async_db():
+        async with async_session_factory() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    with patch("app.utils.security.SECRET_KEY", "test-secret"):
+        yield
+    app.dependency_overrides.clear()
+    for cache in (auth._token_cache, auth._user_cache, auth._wallet_owner_cache):
+        cache.clear()
+    asyncio.run(async_engine.dispose())
+    file_engine.dispose()
+
+
+def call(method: str, path: str, user_id: int = None, body=None) -> tuple:
+    """(status, body) of one request sent straight to the ASGI app, with a token for user_id if given."""
+    path, _, query = path.partition("?")
+    headers = [(b"host", b"test"), (b"content-type", b"application/json")]
+    if user_id is not None:
+        headers.append((b"authorization", f"Bearer {security.create_access_token(user_id)}".encode()))
+    scope = {
+        "type": "http", "http_version": "1.1", "method": method, "scheme": "http", "path": path,
+        "raw_path": path.encode(), "root_path": "", "query_string": query.encode(), "headers": headers,
+        "server": ("test", 80), "client": ("test", 50000)
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": json.dumps(body).encode() if body is not None else b"",
+                "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    content = b"".join(message.get("body", b"") for message in messages if message["type"] == "http.response.body")
+    return messages[0]["status"], json.loads(content) if content else None
+
+
+def test_transaction_and_analytics_routes_require_authorization():
+    for route_module in (analytics, transactions):
+        assert [dependency.dependency for dependency in route_module.router.dependencies] == [
+            auth.authorize_wallet_access
+        ]
+
+
+@pytest.mark.parametrize("method, path", [
+    ("POST", "/users/1/wallet/1/import-transactions"),
+    ("GET", "/users/1/wallet/1/export-transactions"),
+    ("GET", "/users/1/wallet/1/export-snapshots"),
+    ("GET", "/users/1/wallet/1/value-series?start_date=2025-03-01&end_date=2025-03-02"),
+    ("GET", "/users/1/wallet/1/holdings-as-of?as_of=2025-03-01"),
+    ("GET", "/users/1/wallet/1/risk?start_date=2025-03-01&end_date=2025-03-02"),
+    ("GET", "/users/1/risk?start_date=2025-03-01&end_date=2025-03-02"),
+    ("GET", "/users/1/wallet/1/benchmark?start_date=2025-03-01&end_date=2025-03-02&benchmark=bitcoin"),
+])
+def test_transaction_and_analytics_routes_reject_other_users(served, method, path):
+    assert call(method, path) == (401, {"detail": "Not authenticated"})
+    assert call(method, path, user_id=2) == (403, {"detail": "Not authorized to access this user"})
+
+    # Bob's own id in the path doesn't open Alice's wallet
+    if "/wallet/" in path:
+        assert call(method, path.replace("/users/1/", "/users/2/"), user_id=2) == (
+            403, {"detail": "This wallet does not belong to the user"}
+        )
+
+
+def test_all_wallets_lists_only_the_callers_wallets(served):
+    assert call("GET", "/wallets/") == (401, {"detail": "Not authenticated"})
+
+    status_code, body = call("GET", "/wallets/", user_id=2)
+
+    assert status_code == 200
+    assert [(wallet["id"], wallet["user_id"]) for wallet in body] == [(2, 2)]
+
+
+def test_bulk_user_creation_requires_an_admin(served):
+    new_users = [{"username": "carol", "email": "carol@example.com", "password": "password123"}]
+
+    assert call("POST", "/users/bulk", body=new_users) == (401, {"detail": "Not authenticated"})
+    with patch("app.utils.auth.ADMIN_USER_IDS", {1}):
+        assert call("POST", "/users/bulk", user_id=2, body=new_users) == (403, {"detail": "Admin access required"})
+
+        status_code, body = call("POST", "/users/bulk", user_id=1, body=new_users)
+
+    assert status_code == 200
+    assert (body["created"], body["failed"]) == (1, 0)
+
+
+def test_user_changes_require_the_user_or_an_admin(served):
+    assert call("PUT", "/users/1", body={"email": "alice@example.org"}) == (401, {"detail": "Not authenticated"})
+    assert call("DELETE", "/users/1") == (401, {"detail": "Not authenticated"})
+    assert call("PUT", "/users/1", user_id=2, body={"email": "alice@example.org"}) == (
+        403, {"detail": "Not authorized to access this user"}
+    )
+    assert call("DELETE", "/users/1", user_id=2) == (403, {"detail": "Not authorized to access this user"})
+
+    status_code, body = call("PUT", "/users/1", user_id=1, body={"email": "alice@example.org"})
+    assert (status_code, body["new_data"]["email"]) == (200, "alice@example.org")
+
+    with patch("app.utils.auth.ADMIN_USER_IDS", {2}):
+        status_code, _ = call("DELETE", "/users/1", user_id=2)
+    assert status_code == 200
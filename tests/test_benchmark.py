@@ -0,0 +1,103 @@
+import calendar
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from unittest.mock import patch
+from datetime import date, datetime
+
+from app.database import Base
+from app.crud import analytics
+from app.models import User, Wallet, PurchaseTransaction, SaleTransaction
+from app.utils.benchmark import basket_index, replay_cash_flows
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+PRICES = {
+    "bitcoin": {date(2025, 3, 1): 100, date(2025, 3, 2): 110, date(2025, 3, 3): 99},
+    "xrp": {date(2025, 3, 1): 10, date(2025, 3, 2): 10, date(2025, 3, 3): 12},
+    "ethereum": {date(2025, 3, 1): 50, date(2025, 3, 2): 60, date(2025, 3, 3): 60},
+}
+
+
+@pytest.fixture(scope="function")
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    session.add(User(id=1, username="testuser", email="test@example.com"))
+    session.add(Wallet(id=1, user_id=1))
+    session.add(PurchaseTransaction(
+        user_id=1, wallet_id=1, coin_name="bitcoin", quantity_purchased=1, total_purchase_price=100,
+        purchase_date=datetime(2025, 3, 1, 9)
+    ))
+    session.commit()
+    yield session
+    session.close()
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope="function")
+def market():
+    def fake_prices(coin_name, start_timestamp, end_timestamp):
+        return [
+            {"time": calendar.timegm(day.timetuple()) * 1000, "priceUsd": str(price)}
+            for day, price in PRICES[coin_name].items()
+        ]
+
+    with patch("app.crud.analytics.valid_coin_names", return_value=["bitcoin", "ethereum", "xrp", "dogecoin"]), \
+            patch("app.crud.analytics.fetch_dated_coin_price", side_effect=fake_prices) as fetch_prices:
+        yield fetch_prices
+
+
+def test_basket_index_rebalances_daily():
+    prices = np.array([[100.0, 10.0], [110.0, 10.0], [99.0, 12.0]])
+
+    index = basket_index(prices, np.array([0.5, 0.5]))
+
+    np.testing.assert_allclose(index, [1.0, 1.05, 1.05 * (1 + 0.5 * -0.1 + 0.5 * 0.2)])
+
+
+def test_withdrawals_cannot_take_the_account_below_zero():
+    values = replay_cash_flows(np.array([10.0, -30.0, 5.0]), np.ones(3))
+
+    np.testing.assert_allclose(values, [10.0, 0.0, 5.0])
+
+
+def test_wallet_cash_flows_are_replayed_into_benchmark(db, market):
+    db.add(SaleTransaction(
+        user_id=1, wallet_id=1, coin_name="bitcoin", quantity_sold=0.5, total_sale_price=50,
+        sale_date=datetime(2025, 3, 3, 9)
+    ))
+    db.commit()
+
+    report = analytics.crud_get_wallet_benchmark(db, 1, 1, "2025-03-01", "2025-03-03", ["xrp"])
+
+    assert report["benchmark"] == [{"coin_name": "xrp", "weight": 1.0}]
+    assert [point["wallet_value_usd"] for point in report["series"]] == [100, 110, 49.5]
+    assert [point["net_cash_flow_usd"] for point in report["series"]] == [100, 0, -50]
+    # 100 in xrp at 10, flat, then +20% before the 50 of proceeds are taken out
+    assert [point["benchmark_value_usd"] for point in report["series"]] == [100, 100, 70]
+
+
+def test_weighted_basket_shares_candles_with_wallet(db, market):
+    report = analytics.crud_get_wallet_benchmark(
+        db, 1, 1, "2025-03-01", "2025-03-03", ["bitcoin:3", "ethereum:1"]
+    )
+
+    assert report["benchmark"] == [{"coin_name": "bitcoin", "weight": 0.75}, {"coin_name": "ethereum", "weight": 0.25}]
+    assert market.call_count == 2
+    assert report["series"][1]["benchmark_value_usd"] == pytest.approx(100 * (1 + 0.75 * 0.1 + 0.25 * 0.2))
+
+
+def test_top_n_basket_and_invalid_benchmarks(db, market):
+    report = analytics.crud_get_wallet_benchmark(db, 1, 1, "2025-03-01", "2025-03-01", ["top-2"])
+    assert [weight["coin_name"] for weight in report["benchmark"]] == ["bitcoin", "ethereum"]
+
+    for benchmark in (["litecoin"], ["bitcoin:-1"], ["bitcoin:abc"]):
+        with pytest.raises(HTTPException) as exc_info:
+            analytics.crud_get_wallet_benchmark(db, 1, 1, "2025-03-01", "2025-03-03", benchmark)
+        assert exc_info.value.status_code == 400
@@ -0,0 +1,126 @@
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from datetime import datetime, timedelta
+
+from app.database import Base
+from app.jobs.compaction import run_snapshot_compaction
+from app.models import User, Wallet, WalletActivityData, JobCheckpoint
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+NOW = datetime(2025, 3, 31, 12, 0)
+
+
+@pytest.fixture(scope="function")
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    session.add(User(id=1, username="testuser", email="test@example.com"))
+    session.add(Wallet(id=1, user_id=1))
+    session.add(Wallet(id=2, user_id=1))
+    session.commit()
+    yield session
+    session.close()
+    Base.metadata.drop_all(bind=engine)
+
+
+def add_snapshots(db, wallet_id, dates):
+    for date in dates:
+        db.add(WalletActivityData(wallet_id=wallet_id, date=date, holdings={}, total_value_usd=date.minute))
+    db.commit()
+
+
+def snapshot_dates(db, wallet_id):
+    return [
+        date for (date,) in db.query(WalletActivityData.date)
+        .filter(WalletActivityData.wallet_id == wallet_id)
+        .order_by(WalletActivityData.date)
+    ]
+
+
+def test_compaction_applies_retention_tiers(db):
+    recent = [NOW - timedelta(days=1, minutes=m) for m in (30, 20, 10)]
+    hourly = [datetime(2025, 3, 15, 9, m) for m in (5, 25, 45)] + [datetime(2025, 3, 15, 10, 15)]
+    daily = [datetime(2025, 2, 10, 9, m) for m in (5, 25)] + [datetime(2025, 2, 10, 17, 50)]
+    add_snapshots(db, 1, daily + hourly + recent)
+    add_snapshots(db, 2, [datetime(2025, 3, 15, 9, 10), datetime(2025, 3, 15, 9, 50)] + [NOW - timedelta(hours=1)])
+
+    report = run_snapshot_compaction(db, now=NOW, keep_all_days=7, keep_hourly_days=30, batch_size=2)
+
+    assert report == {"snapshots_before": 13, "snapshots_after": 8, "deleted_hourly": 4, "deleted_daily": 1}
+    assert snapshot_dates(db, 1) == [
+        datetime(2025, 2, 10, 17, 50),
+        datetime(2025, 3, 15, 9, 45),
+        datetime(2025, 3, 15, 10, 15),
+    ] + sorted(recent)
+    assert snapshot_dates(db, 2) == [datetime(2025, 3, 15, 9, 50), NOW - timedelta(hours=1)]
+
+
+def test_compaction_resumes_from_checkpoint(db):
+    add_snapshots(db, 1, [datetime(2025, 3, 15, 9, m) for m in (5, 25)] + [NOW])
+    run_snapshot_compaction(db, now=NOW, keep_all_days=7, keep_hourly_days=30)
+
+    checkpoint = db.query(JobCheckpoint).filter(JobCheckpoint.job_name == "snapshot_compaction:hourly").one()
+    assert checkpoint.checkpoint_at == datetime(2025, 3, 24, 12, 0)
+
+    # Nothing new has aged, so a second run removes nothing
+    assert run_snapshot_compaction(db, now=NOW, keep_all_days=7, keep_hourly_days=30)["deleted_hourly"] == 0
+
+    add_snapshots(db, 1, [NOW + timedelta(minutes=m) for m in (10, 20)])
+    report = run_snapshot_compaction(db, now=NOW + timedelta(days=8), keep_all_days=7, keep_hourly_days=30)
+
+    assert report["deleted_hourly"] == 2
+    assert snapshot_dates(db, 1) == [datetime(2025, 3, 15, 9, 25), NOW + timedelta(minutes=20)]
+
+
+def test_compaction_covers_backdated_snapshots_added_after_a_run(db):
+    add_snapshots(db, 1, [datetime(2025, 3, 15, 9, 5), NOW])
+    run_snapshot_compaction(db, now=NOW, keep_all_days=7, keep_hourly_days=30)
+
+    # Written after the checkpoint passed their hour, e.g. by an import; the newer live snapshot stays protected
+    add_snapshots(db, 1, [datetime(2025, 3, 15, 9, m) for m in (25, 45)])
+    add_snapshots(db, 1, [NOW + timedelta(minutes=5)])
+    report = run_snapshot_compaction(db, now=NOW, keep_all_days=7, keep_hourly_days=30)
+
+    assert report["deleted_hourly"] == 2
+    assert snapshot_dates(db, 1) == [datetime(2025, 3, 15, 9, 45), NOW, NOW + timedelta(minutes=5)]
+
+    # Covered now, so the next run has nothing to rescan
+    assert run_snapshot_compaction(db, now=NOW, keep_all_days=7, keep_hourly_days=30)["deleted_hourly"] == 0
+
+
+def test_compaction_keeps_newest_written_snapshot(db):
+    # An import can write an older-dated snapshot after live ones; it is the base for the next trade snapshot
+    add_snapshots(db, 1, [datetime(2025, 3, 15, 9, 30), datetime(2025, 3, 15, 9, 10)])
+
+    run_snapshot_compaction(db, now=NOW, keep_all_days=7, keep_hourly_days=30)
+
+    assert snapshot_dates(db, 1) == [datetime(2025, 3, 15, 9, 10), datetime(2025, 3, 15, 9, 30)]
+
+
+def test_compaction_looks_up_newest_snapshots_only_for_thinned_wallets(db):
+    add_snapshots(db, 1, [datetime(2025, 3, 15, 9, 10), datetime(2025, 3, 15, 9, 30), datetime(2025, 3, 30, 9, 0)])
+    add_snapshots(db, 2, [datetime(2025, 3, 15, 10, 10), datetime(2025, 3, 30, 9, 0)])
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        run_snapshot_compaction(db, now=NOW, keep_all_days=7, keep_hourly_days=30)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    assert snapshot_dates(db, 1) == [datetime(2025, 3, 15, 9, 30), datetime(2025, 3, 30, 9, 0)]
+    # Only wallet 1 had a snapshot to thin out, so only its newest written snapshot was looked up
+    lookups = [parameters for statement, parameters in statements if "GROUP BY" in statement]
+    assert lookups == [(1,)]
+
+
+def test_compaction_rejects_inverted_tiers(db):
+    with pytest.raises(ValueError):
+        run_snapshot_compaction(db, now=NOW, keep_all_days=30, keep_hourly_days=7)
@@ -0,0 +1,170 @@
+import calendar
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from unittest.mock import patch
+from fastapi import HTTPException
+from datetime import date, datetime, timedelta
+
+from app.database import Base
+from app.crud import analytics
+from app.models import User, Wallet, PurchaseTransaction, SaleTransaction
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture(scope="function")
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    session.add(User(id=1, username="testuser", email="test@example.com"))
+    session.add(Wallet(id=1, user_id=1))
+    session.commit()
+    yield session
+    session.close()
+    Base.metadata.drop_all(bind=engine)
+
+
+def candles(prices_by_day):
+    return [
+        {"time": calendar.timegm(day.timetuple()) * 1000, "priceUsd": str(price)}
+        for day, price in prices_by_day.items()
+    ]
+
+
+def buy(db, coin, quantity, when):
+    db.add(PurchaseTransaction(user_id=1, wallet_id=1, coin_name=coin, quantity_purchased=quantity, purchase_date=when))
+
+
+def sell(db, coin, quantity, when):
+    db.add(SaleTransaction(user_id=1, wallet_id=1, coin_name=coin, quantity_sold=quantity, sale_date=when))
+
+
+PRICES = {
+    "bitcoin": candles({date(2025, 2, 27): 100, date(2025, 3, 1): 110, date(2025, 3, 3): 130}),
+    "xrp": candles({date(2025, 2, 27): 2, date(2025, 3, 2): 3}),
+}
+
+
+def test_value_series_rebuilds_daily_holdings(db):
+    buy(db, "bitcoin", 1, datetime(2025, 2, 20, 10))
+    buy(db, "dogecoin", 5, datetime(2025, 2, 20, 10))
+    sell(db, "dogecoin", 5, datetime(2025, 2, 21, 10))
+    buy(db, "xrp", 10, datetime(2025, 3, 2, 9))
+    sell(db, "bitcoin", 0.5, datetime(2025, 3, 3, 23, 59))
+    buy(db, "bitcoin", 7, datetime(2025, 3, 5))
+    db.commit()
+
+    with patch("app.crud.analytics.fetch_dated_coin_price", side_effect=lambda coin_name, **_: PRICES[coin_name]) \
+            as fetch_prices:
+        series = analytics.crud_get_wallet_value_series(db, 1, 1, "2025-03-01", "2025-03-04")
+
+    # One history request per held coin; dogecoin was sold out before the range
+    assert sorted(call.kwargs["coin_name"] for call in fetch_prices.call_args_list) == ["bitcoin", "xrp"]
+    assert series["coins"] == ["bitcoin", "xrp"]
+    assert series["missing_prices"] == []
+    assert [point["date"] for point in series["series"]] == [date(2025, 3, 1) + timedelta(days=i) for i in range(4)]
+    assert [point["total_value_usd"] for point in series["series"]] == pytest.approx([
+        1 * 110,
+        1 * 110 + 10 * 3,
+        0.5 * 130 + 10 * 3,
+        0.5 * 130 + 10 * 3,
+    ])
+
+
+def test_value_series_reports_coins_without_prices(db):
+    buy(db, "bitcoin", 1, datetime(2025, 3, 1))
+    buy(db, "xrp", 10, datetime(2025, 3, 1))
+    db.commit()
+
+    with patch("app.crud.analytics.fetch_dated_coin_price", side_effect=[PRICES["bitcoin"], None]):
+        series = analytics.crud_get_wallet_value_series(db, 1, 1, "2025-03-01", "2025-03-01")
+
+    assert series["missing_prices"] == ["xrp"]
+    assert series["series"][0]["total_value_usd"] == pytest.approx(110)
+
+
+def test_value_series_empty_wallet(db):
+    with patch("app.crud.analytics.fetch_dated_coin_price") as fetch_prices:
+        series = analytics.crud_get_wallet_value_series(db, 1, 1, "2025-03-01", "2025-03-02")
+
+    fetch_prices.assert_not_called()
+    assert [point["total_value_usd"] for point in series["series"]] == [0, 0]
+
+
+@pytest.mark.parametrize("start_date, end_date, detail", [
+    ("2025/03/01", "2025-03-02", "Invalid date format. Expected format: YYYY-MM-DD"),
+    ("2025-03-02", "2025-03-01", "start_date must not be after end_date"),
+    ("2000-01-01", "2025-03-01", f"Date range is limited to {analytics.MAX_SERIES_DAYS} days"),
+])
+def test_value_series_invalid_range(db, start_date, end_date, detail):
+    with pytest.raises(HTTPException) as exc_info:
+        analytics.crud_get_wallet_value_series(db, 1, 1, start_date, end_date)
+
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail == detail
+
+
+def test_value_series_wallet_does_not_belong_to_user(db):
+    db.add(User(id=2, username="otheruser", email="other@example.com"))
+    db.commit()
+
+    with pytest.raises(HTTPException) as exc_info:
+        analytics.crud_get_wallet_value_series(db, 2, 1, "2025-03-01", "2025-03-02")
+
+    assert exc_info.value.status_code == 403
+    assert exc_info.value.detail == "This wallet does not belong to the user"
+
+
+@pytest.fixture(scope="function")
+def empty_index_cache():
+    analytics._holdings_index_cache.clear()
+    yield
+    analytics._holdings_index_cache.clear()
+
+
+def test_holdings_as_of_replays_trade_history(db, empty_index_cache):
+    buy(db, "bitcoin", 1, datetime(2025, 3, 1, 10))
+    buy(db, "xrp", 10, datetime(2025, 3, 1, 12))
+    sell(db, "xrp", 10, datetime(2025, 3, 2, 9))
+    sell(db, "bitcoin", 0.25, datetime(2025, 3, 2, 9))
+    db.commit()
+
+    assert analytics.crud_get_holdings_as_of(db, 1, 1, "2025-02-28")["holdings"] == {}
+    assert analytics.crud_get_holdings_as_of(db, 1, 1, "2025-03-01T11:00:00")["holdings"] == {"bitcoin": 1}
+    assert analytics.crud_get_holdings_as_of(db, 1, 1, "2025-03-01")["holdings"] == {"bitcoin": 1, "xrp": 10}
+    # Timezone-aware input is converted to UTC
+    assert analytics.crud_get_holdings_as_of(db, 1, 1, "2025-03-02T10:00:00+02:00")["holdings"] == {
+        "bitcoin": 1, "xrp": 10
+    }
+    assert analytics.crud_get_holdings_as_of(db, 1, 1, "2025-03-02T09:00:00")["holdings"] == {"bitcoin": 0.75}
+
+
+def test_holdings_index_is_rebuilt_when_wallet_version_changes(db, empty_index_cache):
+    buy(db, "bitcoin", 1, datetime(2025, 3, 1))
+    db.commit()
+
+    with patch("app.crud.analytics.HoldingsIndex", wraps=analytics.HoldingsIndex) as build_index:
+        analytics.crud_get_holdings_as_of(db, 1, 1, "2025-03-05")
+        analytics.crud_get_holdings_as_of(db, 1, 1, "2025-03-06")
+        assert build_index.call_count == 1
+
+        buy(db, "bitcoin", 2, datetime(2025, 3, 3))
+        db.query(Wallet).filter(Wallet.id == 1).update({Wallet.version: Wallet.version + 1})
+        db.commit()
+
+        holdings = analytics.crud_get_holdings_as_of(db, 1, 1, "2025-03-05")["holdings"]
+        assert build_index.call_count == 2
+
+    assert holdings == {"bitcoin": 3}
+
+
+def test_holdings_as_of_invalid_timestamp(db):
+    with pytest.raises(HTTPException) as exc_info:
+        analytics.crud_get_holdings_as_of(db, 1, 1, "yesterday")
+
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail == "Invalid timestamp format. Expected format: YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS"
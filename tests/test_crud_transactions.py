@@ -0,0 +1,247 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from unittest.mock import patch
+from datetime import datetime
+from fastapi import HTTPException
+
+from app.database import Base
+from app.crud import transactions, wallets
+from app.models import User, Asset, AssetLot, PurchaseTransaction, SaleTransaction, WalletActivityData
+
+# Set up a test database
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+FAKE_ASSETS = {
+    "assets": {
+        "bitcoin": {"id": "bitcoin", "priceUsd": "80000"},
+        "xrp": {"id": "xrp", "priceUsd": "2.5"},
+    }
+}
+
+CSV_TRADES = """type,coin_name,quantity,price,timestamp
+purchase,bitcoin,1,50000,2024-01-01T10:00:00
+purchase,xrp,100,0.5,2024-01-01T12:00:00
+sale,bitcoin,0.5,60000,2024-01-02T09:00:00
+purchase,XRP,50,0.6,2024-01-02T15:00:00
+sale,xrp,150,0.7,2024-01-03T09:00:00
+"""
+
+
+@pytest.fixture(scope="function")
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    yield session
+    session.close()
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope="function")
+def wallet(db):
+    user = User(id=1, username="testuser", email="test@example.com")
+    db.add(user)
+    db.commit()
+
+    return wallets.crud_create_wallet(db, user_id=1)
+
+
+def test_parse_import_rows_json_array_and_lines():
+    json_array = '[{"type": "purchase", "coin_name": "xrp"}, {"type": "sale", "coin_name": "xrp"}]'
+    json_lines = '{"type": "purchase", "coin_name": "xrp"}\n\n{"type": "sale", "coin_name": "xrp"}\n'
+
+    assert [row["type"] for row in transactions.parse_import_rows(json_array, "json")] == ["purchase", "sale"]
+    assert [row["type"] for row in transactions.parse_import_rows(json_lines, "json")] == ["purchase", "sale"]
+
+
+def test_parse_import_rows_invalid_format():
+    with pytest.raises(HTTPException) as exc_info:
+        list(transactions.parse_import_rows("", "xml"))
+
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail == "Invalid import format: xml. Must be one of ['csv', 'json']"
+
+
+def test_import_transactions_csv(db, wallet):
+    with patch("app.crud.transactions.fetch_all_assets", return_value=FAKE_ASSETS):
+        result = transactions.crud_import_transactions(
+            db=db,
+            user_id=wallet.user_id,
+            wallet_id=wallet.id,
+            rows=transactions.parse_import_rows(CSV_TRADES, "csv")
+        )
+
+    assert result == {
+        "wallet_id": wallet.id,
+        "rows_imported": 5,
+        "purchases_imported": 3,
+        "sales_imported": 2,
+        "snapshots_created": 3
+    }
+
+    assert db.query(PurchaseTransaction).count() == 3
+    assert db.query(SaleTransaction).count() == 2
+
+    # xrp was sold out entirely, so only bitcoin is left as an asset
+    remaining_assets = db.query(Asset).filter(Asset.wallet_id == wallet.id).all()
+    assert [asset.coin_name for asset in remaining_assets] == ["bitcoin"]
+    assert remaining_assets[0].quantity == 0.5
+
+    snapshots = db.query(WalletActivityData).order_by(WalletActivityData.date).all()
+    assert [snapshot.date.day for snapshot in snapshots] == [1, 2, 3]
+    assert snapshots[0].total_value_usd == 50000 + 50
+    assert snapshots[1].holdings["xrp"]["quantity"] == 150
+    assert snapshots[2].holdings == {
+        "bitcoin": {"quantity": 0.5, "purchase_value_usd": 25000, "value_on_date_usd": 30000}
+    }
+
+    sales = db.query(SaleTransaction).order_by(SaleTransaction.sale_date).all()
+    assert [sale.realized_gain_loss_usd for sale in sales] == [5000, 25]
+    assert remaining_assets[0].realized_gain_loss_usd == 5000
+    assert wallet.realized_gain_loss_usd == 5025
+    assert [(lot.coin_name, lot.quantity_remaining) for lot in db.query(AssetLot)] == [("bitcoin", 0.5)]
+
+
+def test_import_transactions_is_atomic(db, wallet):
+    bad_trades = CSV_TRADES + "sale,bitcoin,5,60000,2024-01-04T09:00:00\n"
+
+    with patch("app.crud.transactions.fetch_all_assets", return_value=FAKE_ASSETS):
+        with pytest.raises(HTTPException) as exc_info:
+            transactions.crud_import_transactions(
+                db=db,
+                user_id=wallet.user_id,
+                wallet_id=wallet.id,
+                rows=transactions.parse_import_rows(bad_trades, "csv")
+            )
+
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail == "Row 6: Insufficient quantity to sell"
+    assert db.query(PurchaseTransaction).count() == 0
+    assert db.query(Asset).count() == 0
+    assert db.query(WalletActivityData).count() == 0
+
+
+def test_import_transactions_out_of_order(db, wallet):
+    trades = [
+        {"type": "purchase", "coin_name": "xrp", "quantity": 1, "price": 1, "timestamp": "2024-01-02T00:00:00"},
+        {"type": "purchase", "coin_name": "xrp", "quantity": 1, "price": 1, "timestamp": "2024-01-01T00:00:00"},
+    ]
+
+    with patch("app.crud.transactions.fetch_all_assets", return_value=FAKE_ASSETS):
+        with pytest.raises(HTTPException) as exc_info:
+            transactions.crud_import_transactions(db=db, user_id=wallet.user_id, wallet_id=wallet.id, rows=trades)
+
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail == "Row 2: Rows must be in chronological order"
+
+
+def test_import_transactions_converts_offsets_to_utc(db, wallet):
+    trades = [
+        {"type": "purchase", "coin_name": "xrp", "quantity": 1, "price": 1, "timestamp": "2024-01-02T03:00:00+05:00"},
+        {"type": "purchase", "coin_name": "xrp", "quantity": 1, "price": 1, "timestamp": "2024-01-01T23:00:00"},
+    ]
+
+    with patch("app.crud.transactions.fetch_all_assets", return_value=FAKE_ASSETS):
+        transactions.crud_import_transactions(db=db, user_id=wallet.user_id, wallet_id=wallet.id, rows=trades)
+
+    # 03:00 at +05:00 is 22:00 UTC the day before, so it comes first and both trades land on the 1st
+    purchases = db.query(PurchaseTransaction).order_by(PurchaseTransaction.id)
+    purchase_dates = [purchase.purchase_date for purchase in purchases]
+    assert purchase_dates == [datetime(2024, 1, 1, 22), datetime(2024, 1, 1, 23)]
+
+
+def test_import_transactions_invalid_row(db, wallet):
+    trades = [{"type": "gift", "coin_name": "xrp", "quantity": 1, "price": 1, "timestamp": "2024-01-01T00:00:00"}]
+
+    with patch("app.crud.transactions.fetch_all_assets", return_value=FAKE_ASSETS):
+        with pytest.raises(HTTPException) as exc_info:
+            transactions.crud_import_transactions(db=db, user_id=wallet.user_id, wallet_id=wallet.id, rows=trades)
+
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail.startswith("Row 1:")
+
+
+def test_import_transactions_wallet_does_not_belong_to_user(db, wallet):
+    user_2 = User(id=2, username="testuser2", email="test2@example.com")
+    db.add(user_2)
+    db.commit()
+
+    with pytest.raises(HTTPException) as exc_info:
+        transactions.crud_import_transactions(db=db, user_id=user_2.id, wallet_id=wallet.id, rows=[])
+
+    assert exc_info.value.status_code == 403
+    assert exc_info.value.detail == "This wallet does not belong to the user"
+
+
+def test_export_wallet_transactions_csv(db, wallet):
+    with patch("app.crud.transactions.fetch_all_assets", return_value=FAKE_ASSETS):
+        transactions.crud_import_transactions(
+            db=db,
+            user_id=wallet.user_id,
+            wallet_id=wallet.id,
+            rows=transactions.parse_import_rows(CSV_TRADES, "csv")
+        )
+
+    stream = transactions.crud_export_wallet_transactions(
+        db=db,
+        user_id=wallet.user_id,
+        wallet_id=wallet.id,
+        file_format="csv",
+        start_date="2024-01-02",
+        end_date="2024-01-02"
+    )
+    lines = b"".join(stream).decode("utf-8").splitlines()
+
+    assert lines[0] == ",".join(transactions.TRANSACTION_EXPORT_COLUMNS)
+    assert [line.split(",")[1] for line in lines[1:]] == ["sale", "purchase"]
+    assert lines[1].endswith("2024-01-02 09:00:00")
+
+
+def test_export_wallet_snapshots_parquet(db, wallet):
+    pq = pytest.importorskip("pyarrow.parquet")
+    import pyarrow as pa
+
+    with patch("app.crud.transactions.fetch_all_assets", return_value=FAKE_ASSETS):
+        transactions.crud_import_transactions(
+            db=db,
+            user_id=wallet.user_id,
+            wallet_id=wallet.id,
+            rows=transactions.parse_import_rows(CSV_TRADES, "csv")
+        )
+
+    with patch("app.crud.transactions.EXPORT_CHUNK_SIZE", 2):
+        stream = transactions.crud_export_wallet_snapshots(
+            db=db,
+            user_id=wallet.user_id,
+            wallet_id=wallet.id,
+            file_format="parquet"
+        )
+        table = pq.read_table(pa.BufferReader(b"".join(stream)))
+
+    assert table.num_rows == 3
+    assert table.column("wallet_id").to_pylist() == [wallet.id] * 3
+    assert table.column("total_value_usd").to_pylist()[-1] == 30000
+
+
+def test_export_wallet_transactions_invalid_date(db, wallet):
+    with pytest.raises(HTTPException) as exc_info:
+        transactions.crud_export_wallet_transactions(
+            db=db,
+            user_id=wallet.user_id,
+            wallet_id=wallet.id,
+            file_format="csv",
+            start_date="01-02-2024"
+        )
+
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail == "Invalid date format. Expected format: YYYY-MM-DD"
+
+
+def test_export_wallet_transactions_wrong_user(db, wallet):
+    with pytest.raises(HTTPException) as exc_info:
+        transactions.crud_export_wallet_transactions(db=db, user_id=2, wallet_id=wallet.id, file_format="csv")
+
+    assert exc_info.value.status_code == 404
+    assert exc_info.value.detail == "Wallet not found"
@@ -1,11 +1,14 @@
+import bcrypt
 import pytest
-from sqlalchemy import create_engine
+from unittest.mock import patch
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from fastapi import HTTPException
 
 from app.models import Base, User
 from app.crud import users
 from app.schemas.users import UserCreate, UserUpdate, UserLogin
+from app.utils import security
 
 
 # Database configuration for tests (in-memory SQLite database)
@@ -152,6 +155,18 @@ def test_get_all_users(db):
     assert users_list[0].email == "testuser@example.com"
 
 
+def test_get_all_users_pages_by_id(db):
+    add_users(db, ["dave", "alice", "carol", "bob", "erin"])
+
+    first_page = users.crud_get_all_users(db, limit=2)
+    second_page = users.crud_get_all_users(db, limit=2, after_id=first_page[-1].id)
+
+    assert [user.username for user in first_page] == ["dave", "alice"]
+    assert [user.username for user in second_page] == ["carol", "bob"]
+    assert users.crud_get_all_users(db, limit=2, after_id=second_page[-1].id)[0].username == "erin"
+    assert users.crud_get_all_users(db, after_id=5) == []
+
+
 def test_get_all_users_none_in_db(db):
     users_list = users.crud_get_all_users(db)
 
@@ -232,6 +247,119 @@ def test_delete_user_not_found(db):
     assert exc_info.value.detail == f"User: 1 not found"
 
 
+# Test for creating users in bulk
+def test_create_users_in_bulk(db):
+    users.crud_create_user(db, UserCreate(username="taken", email="taken@example.com", password="password123"))
+
+    response = users.crud_create_users(db, [
+        UserCreate(username="alice", email="alice@example.com", password="password123"),
+        UserCreate(username="taken", email="new@example.com", password="password123"),
+        UserCreate(username="bob", email="taken@example.com", password="password123"),
+        UserCreate(username="carol", email="alice@example.com", password="password123"),
+        UserCreate(username="dave", email="dave@example.com", password="password456"),
+    ])
+
+    assert (response["created"], response["failed"]) == (2, 3)
+    assert [result["error"] for result in response["results"]] == [
+        None, "Username already registered", "Email already registered", "Email already registered", None
+    ]
+
+    dave = db.query(User).filter(User.username == "dave").one()
+    assert response["results"][4]["id"] == dave.id
+    assert security.verify_password("password456", dave.password_hash)
+    assert db.query(User).count() == 3
+
+
+# Test for bulk creation when a user registers between the checks and the insert
+def test_create_users_in_bulk_with_concurrent_registration(db):
+    def register_alice_first(passwords):
+        db.add(User(username="alice", email="elsewhere@example.com", password_hash="hash"))
+        db.commit()
+        return ["hash"] * len(passwords)
+
+    with patch("app.crud.users.hash_passwords", side_effect=register_alice_first):
+        response = users.crud_create_users(db, [
+            UserCreate(username="alice", email="alice@example.com", password="password123"),
+            UserCreate(username="bob", email="bob@example.com", password="password123"),
+        ])
+
+    assert [result["error"] for result in response["results"]] == ["Username already registered", None]
+    assert response["results"][1]["id"] is not None
+
+
+def add_users(db, names):
+    db.add_all([User(username=name, email=f"{name}@example.com", password_hash="hash") for name in names])
+    db.commit()
+
+
+# Test for walking every page of users with keyset cursors
+def test_search_users_pages_with_cursor(db):
+    add_users(db, ["dave", "alice", "carol", "bob", "erin"])
+
+    pages, cursor = [], None
+    while True:
+        page = users.crud_search_users(db, limit=2, cursor=cursor)
+        pages.append([user["username"] for user in page["users"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert pages == [["alice", "bob"], ["carol", "dave"], ["erin"]]
+
+
+# Test for prefix search on username and email
+def test_search_users_by_prefix(db):
+    add_users(db, ["bob", "bobby", "bo", "boc", "alice"])
+
+    page = users.crud_search_users(db, prefix="bob")
+    assert [user["username"] for user in page["users"]] == ["bob", "bobby"]
+
+    page = users.crud_search_users(db, field="email", prefix="bo", limit=3)
+    assert [user["email"] for user in page["users"]] == ["bo@example.com", "bob@example.com", "bobby@example.com"]
+
+    page = users.crud_search_users(db, field="email", prefix="bo", limit=3, cursor=page["next_cursor"])
+    assert [user["username"] for user in page["users"]] == ["boc"]
+    assert page["next_cursor"] is None
+
+
+# Test for prefixes ending in the last code point, which have no next string to end the range at
+def test_search_users_by_prefix_at_the_end_of_unicode(db):
+    last = chr(0x10FFFF)
+    add_users(db, [f"a{last}", f"a{last}{last}b", "b", f"{last}x"])
+
+    assert users._prefix_end(f"a{last}") == "b"
+    assert users._prefix_end(last * 2) is None
+    assert users._prefix_end(chr(0xD7FF)) == chr(0xE000)
+
+    page = users.crud_search_users(db, prefix=f"a{last}")
+    assert [user["username"] for user in page["users"]] == [f"a{last}", f"a{last}{last}b"]
+
+    page = users.crud_search_users(db, prefix=last)
+    assert [user["username"] for user in page["users"]] == [f"{last}x"]
+
+
+# Test for a cursor from another field or a malformed one
+def test_search_users_invalid_cursor(db):
+    add_users(db, ["alice", "bob"])
+    cursor = users.crud_search_users(db, limit=1)["next_cursor"]
+
+    for field, bad_cursor in (("email", cursor), ("username", "not-a-cursor")):
+        with pytest.raises(HTTPException) as exc_info:
+            users.crud_search_users(db, field=field, cursor=bad_cursor)
+        assert exc_info.value.status_code == 400
+        assert exc_info.value.detail == "Invalid cursor"
+
+
+# Test for prefix search reading the username index instead of the table
+def test_search_users_uses_index(db):
+    plan = db.execute(text(
+        "EXPLAIN QUERY PLAN SELECT id, username, email FROM users WHERE username >= 'bob' AND username < 'boc' AND username > 'bo' "
+        "ORDER BY username LIMIT 51"
+    )).all()
+
+    assert any(row[-1].startswith("SEARCH users USING INDEX ix_users_username") for row in plan)
+
+
 # Test for user login (valid credentials)
 def test_user_login(db):
     user_data = UserCreate(
@@ -260,3 +388,64 @@ def test_user_login_invalid(db):
 
     with pytest.raises(HTTPException):
         users.crud_login_user(db, user_login_data)
+
+
+# Test for a login rehashing a password stored with an outdated cost factor
+def test_user_login_rehashes_outdated_hash(db):
+    old_hash = bcrypt.hashpw(b"password123", bcrypt.gensalt(4)).decode()
+    db.add(User(username="testuser", email="testuser@example.com", password_hash=old_hash))
+    db.commit()
+
+    user = users.crud_authenticate_user(db, "testuser", "password123")
+
+    assert user.password_hash != old_hash
+    assert user.password_hash.startswith(f"$2b${security.BCRYPT_ROUNDS:02d}$")
+    assert security.verify_password("password123", user.password_hash)
+
+
+# Test for password checks being shed once too many are pending
+def test_password_checks_beyond_limit_are_rejected():
+    hasher = security.PasswordHasher(workers=1, max_pending=0)
+
+    with pytest.raises(HTTPException) as exc_info:
+        hasher.run(security._verify, "password123", "hash")
+
+    assert exc_info.value.status_code == 503
+    assert exc_info.value.headers == {"Retry-After": "1"}
+
+
+# Test for batches holding one slot per value in flight, so they can't crowd out logins
+def test_password_hasher_map_takes_a_slot_per_value():
+    hasher = security.PasswordHasher(workers=2, max_pending=3)
+    free_slots = []
+
+    def record(value):
+        free_slots.append(hasher._slots._value)
+        return value
+
+    assert hasher.map(record, list(range(5))) == list(range(5))
+    assert free_slots == [1, 1, 1, 1, 2]
+
+    # With two checks in progress there is no room for a pair of values
+    hasher._admit(2)
+    with pytest.raises(HTTPException) as exc_info:
+        hasher.map(record, ["first", "second"])
+    assert exc_info.value.status_code == 503
+    hasher._release(2)
+
+    assert hasher._slots._value == 3
+
+
+# Test for hashing in the worker process pool
+def test_password_hasher_pool():
+    hasher = security.PasswordHasher(workers=1, max_pending=2)
+    hasher.start()
+    try:
+        hashed = hasher.run(security._hash, "password123")
+        assert hasher.run(security._verify, "password123", hashed)
+        assert not hasher.run(security._verify, "wrongpassword", hashed)
+        assert [len(hashed) for hashed in hasher.map(security._hash, ["first", "second"])] == [60, 60]
+    finally:
+        hasher.stop()
+
+    assert not hasher.running
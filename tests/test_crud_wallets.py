@@ -1,7 +1,9 @@
+import calendar
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.sql import literal
@@ -11,7 +13,12 @@ from datetime import datetime, timedelta
 
 from app.database import Base
 from app.crud import wallets
-from app.models import User, WalletActivityData, Wallet, Asset
+from app.crud.idempotency import get_stored_response, purge_expired_records
+from app.jobs.snapshot_days import run_snapshot_day_backfill
+from app.models import User, WalletActivityData, Wallet, Asset, PurchaseTransaction, SaleTransaction
+from app.models import IdempotencyRecord, AssetLot
+from app.schemas.transactions import BatchOrderLeg
+from app import CoinCapAPI
 
 # Set up a test database
 SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
@@ -28,6 +35,20 @@ def db():
     Base.metadata.drop_all(bind=engine)
 
 
+@pytest.fixture(scope="function")
+def market():
+    """Serves fixed prices from a fresh asset cache so trades don't call CoinCapAPI."""
+    fake_assets = {
+        "bitcoin": {"id": "bitcoin", "rank": "1", "symbol": "BTC", "priceUsd": "80000"},
+        "ethereum": {"id": "ethereum", "rank": "2", "symbol": "ETH", "priceUsd": "2000"},
+        "xrp": {"id": "xrp", "rank": "4", "symbol": "XRP", "priceUsd": "2.5"},
+    }
+
+    with patch.dict(CoinCapAPI._cache, {"timestamp": time.time(), "assets": fake_assets, "coins": list(fake_assets)}):
+        with patch("app.crud.wallets.time.sleep"):
+            yield fake_assets
+
+
 def test_create_wallet(db):
     user = User(id=1, username="testuser", email="test@example.com")
     db.add(user)
@@ -143,7 +164,7 @@ def test_get_wallet_by_id(db):
 
 def test_get_all_wallets_no_wallets(db):
     with pytest.raises(HTTPException) as exc_info:
-        wallets.crud_get_all_wallets(db)
+        wallets.crud_get_all_wallets(db, user_id=1)
 
     assert exc_info.value.status_code == 404
     assert exc_info.value.detail == "No wallets found"
@@ -152,13 +173,16 @@ def test_get_all_wallets_no_wallets(db):
 def test_get_all_wallets(db):
     user = User(id=1, username="testuser", email="test@example.com")
     db.add(user)
+    db.add(User(id=2, username="otheruser", email="other@example.com"))
     db.commit()
 
     wallets.crud_create_wallet(db, user_id=1)
-    wallet = wallets.crud_get_all_wallets(db)
+    wallets.crud_create_wallet(db, user_id=2)
+    wallet = wallets.crud_get_all_wallets(db, user_id=1)
 
-    # Ensure one wallet is created
+    # Ensure only the user's own wallet is returned
     assert wallet is not None
+    assert len(wallet) == 1
     assert wallet[0].id == 1
     assert wallet[0].user_id == 1
     assert wallet[0].amount_of_coins == 0
@@ -391,6 +415,158 @@ def test_get_wallet_valuation_future_date(db):
     assert type(valuation["date_requested_total_value"]) == float
 
 
+@pytest.mark.parametrize("historical_date, expected_relative, expected_snapshot_date", [
+    ("2025-03-15", "current", datetime(2025, 3, 15, 18, 0)),
+    ("2025-03-16", "past", datetime(2025, 3, 15, 18, 0)),
+    ("2025-03-01", "future", datetime(2025, 3, 10, 22, 0)),
+])
+def test_get_wallet_valuation_uses_at_most_two_snapshot_queries(
+        db, historical_date, expected_relative, expected_snapshot_date
+):
+    user = User(id=1, username="testuser", email="test@example.com")
+    db.add(user)
+    db.commit()
+
+    wallet = wallets.crud_create_wallet(db, user_id=user.id)
+
+    for snapshot_date in [
+        datetime(2025, 3, 10, 9, 0), datetime(2025, 3, 10, 22, 0),
+        datetime(2025, 3, 15, 8, 0), datetime(2025, 3, 15, 18, 0),
+    ]:
+        db.add(WalletActivityData(
+            wallet_id=wallet.id,
+            date=snapshot_date,
+            holdings={"xrp": {"quantity": 1, "purchase_value_usd": 2.50, "value_on_date_usd": 2.50}},
+            total_value_usd=2.50
+        ))
+    db.commit()
+
+    snapshot_queries = []
+
+    def count_snapshot_queries(conn, cursor, statement, parameters, context, executemany):
+        if "FROM wallet_activity_data" in statement:
+            snapshot_queries.append(statement)
+
+    event.listen(engine, "before_cursor_execute", count_snapshot_queries)
+    try:
+        with patch("app.crud.wallets.fetch_dated_coin_price", return_value=[{"priceUsd": "3.0"}]):
+            valuation = wallets.crud_get_wallet_valuation(
+                db=db, user_id=user.id, wallet_id=wallet.id, historical_date=historical_date
+            )
+    finally:
+        event.remove(engine, "before_cursor_execute", count_snapshot_queries)
+
+    assert valuation["snap_shot_date_relative_to_historic_date"] == expected_relative
+    assert valuation["snap_shot_date"] == expected_snapshot_date.strftime("%Y-%m-%d %H:%M:%S")
+    assert len(snapshot_queries) <= 2
+    assert all("date(wallet_activity_data.date)" not in query for query in snapshot_queries)
+
+
+def test_get_wallet_valuations_resolves_every_date_in_one_query(db):
+    user = User(id=1, username="testuser", email="test@example.com")
+    db.add(user)
+    db.commit()
+
+    wallet = wallets.crud_create_wallet(db, user_id=user.id)
+
+    for snapshot_date, quantity in [(datetime(2025, 3, 10, 9, 0), 1), (datetime(2025, 3, 15, 18, 0), 2)]:
+        db.add(WalletActivityData(
+            wallet_id=wallet.id,
+            date=snapshot_date,
+            holdings={"xrp": {"quantity": quantity, "purchase_value_usd": 2.50, "value_on_date_usd": 2.50}},
+            total_value_usd=2.50 * quantity
+        ))
+    db.commit()
+
+    snapshot_queries = []
+
+    def count_snapshot_queries(conn, cursor, statement, parameters, context, executemany):
+        if "FROM wallet_activity_data" in statement:
+            snapshot_queries.append(statement)
+
+    candles = [
+        {"time": calendar.timegm(datetime(2025, 3, day).timetuple()) * 1000, "priceUsd": price}
+        for day, price in [(11, "3.0"), (18, "4.0")]
+    ]
+
+    event.listen(engine, "before_cursor_execute", count_snapshot_queries)
+    try:
+        with patch("app.crud.wallets.fetch_dated_coin_price", return_value=candles) as fetch_prices:
+            valuations = wallets.crud_get_wallet_valuations(
+                db, user.id, wallet.id, ["2025-03-20", "2025-03-01", "2025-03-12", "2025-03-15", "2025-03-12"]
+            )
+    finally:
+        event.remove(engine, "before_cursor_execute", count_snapshot_queries)
+
+    assert len(snapshot_queries) == 1
+    fetch_prices.assert_called_once_with(
+        coin_name="xrp",
+        start_timestamp=calendar.timegm(datetime(2025, 3, 12).timetuple()),
+        end_timestamp=calendar.timegm(datetime(2025, 3, 20).timetuple())
+    )
+
+    assert valuations["missing_prices"] == []
+    assert [
+        (
+            valuation["historical_date"].isoformat(),
+            valuation["snap_shot_date"],
+            valuation["snap_shot_date_relative_to_historic_date"],
+            valuation["date_requested_total_value"],
+        )
+        for valuation in valuations["valuations"]
+    ] == [
+        ("2025-03-01", "2025-03-10 09:00:00", "future", 2.50),
+        ("2025-03-12", "2025-03-10 09:00:00", "past", 1 * 3.0),
+        ("2025-03-15", "2025-03-15 18:00:00", "current", 5.0),
+        ("2025-03-20", "2025-03-15 18:00:00", "past", 2 * 4.0),
+    ]
+
+
+def test_snapshot_day_backfill_lets_valuations_find_older_snapshots(db):
+    db.add(User(id=1, username="testuser", email="test@example.com"))
+    db.commit()
+    wallet = wallets.crud_create_wallet(db, user_id=1)
+
+    # Written before snapshot_day existed, so only their timestamps say which day they belong to
+    for day in (4, 5):
+        db.add(WalletActivityData(wallet_id=wallet.id, date=datetime(2025, 3, day, 9), holdings={}, total_value_usd=0))
+    db.commit()
+    db.query(WalletActivityData).update({WalletActivityData.snapshot_day: None})
+    db.commit()
+
+    assert run_snapshot_day_backfill(db, chunk_size=1) == {"snapshots_updated": 2, "completed": True}
+    assert [day.isoformat() for (day,) in db.query(WalletActivityData.snapshot_day).order_by(
+        WalletActivityData.id
+    )] == ["2025-03-04", "2025-03-05"]
+    assert run_snapshot_day_backfill(db)["snapshots_updated"] == 0
+
+    valuations = wallets.crud_get_wallet_valuations(db, 1, wallet.id, ["2025-03-01", "2025-03-06"])
+    valuation = wallets.crud_get_wallet_valuation(db, 1, wallet.id, "2025-03-01")
+
+    assert [
+        (valuation["historical_date"].isoformat(), valuation["snap_shot_date_relative_to_historic_date"])
+        for valuation in valuations["valuations"]
+    ] == [("2025-03-01", "future"), ("2025-03-06", "past")]
+    assert valuation["snap_shot_date"] == "2025-03-04 09:00:00"
+
+
+@pytest.mark.parametrize("historical_dates, status_code, detail", [
+    (["2025-03-32"], 400, "Invalid date format. Expected format: YYYY-MM-DD"),
+    ([], 400, f"Between 1 and {wallets.MAX_VALUATION_DATES} dates can be valued at once"),
+    (["2025-03-01"], 404, "No wallet activity data found for the given date or nearby dates"),
+])
+def test_get_wallet_valuations_errors(db, historical_dates, status_code, detail):
+    db.add(User(id=1, username="testuser", email="test@example.com"))
+    db.commit()
+    wallet = wallets.crud_create_wallet(db, user_id=1)
+
+    with pytest.raises(HTTPException) as exc_info:
+        wallets.crud_get_wallet_valuations(db, 1, wallet.id, historical_dates)
+
+    assert exc_info.value.status_code == status_code
+    assert exc_info.value.detail == detail
+
+
 def test_get_wallet_valuation_no_user(db):
     with pytest.raises(HTTPException) as exc_info:
         wallets.crud_get_wallet_valuation(
@@ -983,3 +1159,414 @@ def test_wallet_deletion_removes_assets(db):
 
     assert db.query(Wallet).filter(Wallet.id == literal(wallet_id)).first() is None
     assert db.query(Asset).filter(Asset.wallet_id == literal(wallet_id)).count() == 0
+
+
+def test_batch_order(db, market):
+    user = User(id=1, username="testuser", email="test@example.com")
+    db.add(user)
+    db.commit()
+
+    wallet = wallets.crud_create_wallet(db, user_id=user.id)
+
+    wallets.crud_purchase_asset(db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=10)
+
+    result = wallets.crud_batch_order(
+        db=db,
+        user_id=user.id,
+        wallet_id=wallet.id,
+        legs=[
+            BatchOrderLeg(side="buy", coin_name="bitcoin", quantity=0.5),
+            BatchOrderLeg(side="buy", coin_name="Ethereum", quantity=2),
+            BatchOrderLeg(side="sell", coin_name="xrp", quantity=10),
+            BatchOrderLeg(side="sell", coin_name="bitcoin", quantity=0.25),
+        ]
+    )
+
+    assert result["wallet_id"] == wallet.id
+    assert [purchase.coin_name for purchase in result["purchases"]] == ["bitcoin", "ethereum"]
+    assert [sale.coin_name for sale in result["sales"]] == ["xrp", "bitcoin"]
+    assert result["sales"][1].remaining_coin_quantity == 0.25
+
+    holdings = {asset.coin_name: asset.quantity for asset in db.query(Asset).filter(Asset.wallet_id == wallet.id)}
+    assert holdings == {"bitcoin": 0.25, "ethereum": 2}
+
+    # One snapshot for the single purchase and one for the whole batch
+    assert db.query(WalletActivityData).count() == 2
+
+
+def test_batch_order_is_atomic(db, market):
+    user = User(id=1, username="testuser", email="test@example.com")
+    db.add(user)
+    db.commit()
+
+    wallet = wallets.crud_create_wallet(db, user_id=user.id)
+
+    with pytest.raises(HTTPException) as exc_info:
+        wallets.crud_batch_order(
+            db=db,
+            user_id=user.id,
+            wallet_id=wallet.id,
+            legs=[
+                BatchOrderLeg(side="buy", coin_name="bitcoin", quantity=1),
+                BatchOrderLeg(side="sell", coin_name="bitcoin", quantity=2),
+            ]
+        )
+
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail == "Leg 2: Insufficient quantity to sell"
+    assert db.query(Asset).count() == 0
+    assert db.query(PurchaseTransaction).count() == 0
+    assert db.query(SaleTransaction).count() == 0
+    assert db.query(WalletActivityData).count() == 0
+
+
+def test_batch_order_invalid_coin_name(db, market):
+    user = User(id=1, username="testuser", email="test@example.com")
+    db.add(user)
+    db.commit()
+
+    wallet = wallets.crud_create_wallet(db, user_id=user.id)
+
+    with pytest.raises(HTTPException) as exc_info:
+        wallets.crud_batch_order(
+            db=db,
+            user_id=user.id,
+            wallet_id=wallet.id,
+            legs=[BatchOrderLeg(side="buy", coin_name="xrg", quantity=1)]
+        )
+
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail == "Leg 1: Invalid coin name 'xrg'"
+
+
+def test_purchase_asset_idempotency_key_replays_response(db, market):
+    user = User(id=1, username="testuser", email="test@example.com")
+    db.add(user)
+    db.commit()
+
+    wallet = wallets.crud_create_wallet(db, user_id=user.id)
+
+    first = wallets.crud_purchase_asset(
+        db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=1, idempotency_key="abc"
+    )
+
+    with patch("app.crud.wallets.get_current_coin_data") as mock_coin_data:
+        replay = wallets.crud_purchase_asset(
+            db=db, user_id=user.id, wallet_id=wallet.id, coin_name="XRP", quantity=1, idempotency_key="abc"
+        )
+        mock_coin_data.assert_not_called()
+
+    assert replay["id"] == first.id
+    assert replay["updated_coin_quantity"] == 1
+    assert db.query(PurchaseTransaction).count() == 1
+    assert db.query(Asset).filter(Asset.wallet_id == wallet.id).one().quantity == 1
+
+
+def test_sell_asset_idempotency_key_reused_for_different_request(db, market):
+    user = User(id=1, username="testuser", email="test@example.com")
+    db.add(user)
+    db.commit()
+
+    wallet = wallets.crud_create_wallet(db, user_id=user.id)
+
+    wallets.crud_purchase_asset(db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=2)
+    wallets.crud_sell_asset(
+        db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=0.5, idempotency_key="sell-1"
+    )
+
+    with pytest.raises(HTTPException) as exc_info:
+        wallets.crud_sell_asset(
+            db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=1, idempotency_key="sell-1"
+        )
+
+    assert exc_info.value.status_code == 422
+    assert exc_info.value.detail == "Idempotency-Key has already been used for a different request"
+    assert db.query(SaleTransaction).count() == 1
+
+
+def test_purchase_asset_expired_idempotency_key_executes_again(db, market):
+    user = User(id=1, username="testuser", email="test@example.com")
+    db.add(user)
+    db.commit()
+
+    wallet = wallets.crud_create_wallet(db, user_id=user.id)
+
+    wallets.crud_purchase_asset(
+        db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=1, idempotency_key="abc"
+    )
+
+    record = db.query(IdempotencyRecord).one()
+    record.expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+
+    second = wallets.crud_purchase_asset(
+        db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=1, idempotency_key="abc"
+    )
+
+    assert second.updated_coin_quantity == 2
+    assert db.query(IdempotencyRecord).count() == 1
+
+
+def test_expired_idempotency_key_is_deleted_with_the_callers_transaction(db, market):
+    user = User(id=1, username="testuser", email="test@example.com")
+    db.add(user)
+    db.commit()
+
+    wallet = wallets.crud_create_wallet(db, user_id=user.id)
+    wallets.crud_purchase_asset(
+        db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=1, idempotency_key="abc"
+    )
+    db.query(IdempotencyRecord).update({IdempotencyRecord.expires_at: datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+
+    assert get_stored_response(db, user.id, "purchase_asset", "abc", "any") is None
+    db.rollback()
+
+    # Nothing was committed on the way, so rolling back keeps the record for the purge job
+    assert db.query(IdempotencyRecord).count() == 1
+
+
+def test_purge_expired_idempotency_records(db, market):
+    user = User(id=1, username="testuser", email="test@example.com")
+    db.add(user)
+    db.commit()
+
+    wallet = wallets.crud_create_wallet(db, user_id=user.id)
+    for key in ("old", "new"):
+        wallets.crud_purchase_asset(
+            db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=1, idempotency_key=key
+        )
+    db.query(IdempotencyRecord).filter(IdempotencyRecord.key == "old").update(
+        {IdempotencyRecord.expires_at: datetime.utcnow() - timedelta(seconds=1)}
+    )
+    db.commit()
+
+    assert purge_expired_records(db) == 1
+    assert [record.key for record in db.query(IdempotencyRecord)] == ["new"]
+
+
+def test_concurrent_trades_on_same_wallet_lose_no_updates(tmp_path, market):
+    # Threads need their own connections, so this test uses a file database instead of the shared in-memory one
+    file_engine = create_engine(f"sqlite:///{tmp_path / 'stress.db'}", connect_args={"timeout": 30})
+    Base.metadata.create_all(bind=file_engine)
+    FileSession = sessionmaker(autocommit=False, autoflush=False, bind=file_engine)
+
+    setup = FileSession()
+    setup.add(User(id=1, username="testuser", email="test@example.com"))
+    setup.add(Wallet(id=1, user_id=1))
+    setup.commit()
+    setup.close()
+
+    threads = 8
+    trades_per_thread = 25
+
+    def trade(side):
+        session = FileSession()
+        completed = 0
+        try:
+            for _ in range(trades_per_thread):
+                try:
+                    if side == "buy":
+                        wallets.crud_purchase_asset(session, user_id=1, wallet_id=1, coin_name="xrp", quantity=1)
+                    else:
+                        wallets.crud_sell_asset(session, user_id=1, wallet_id=1, coin_name="xrp", quantity=1)
+                    completed += 1
+                except HTTPException as e:
+                    assert e.status_code in (400, 404)
+        finally:
+            session.close()
+        return completed
+
+    with patch("app.crud.wallets.create_wallet_activity_snapshot"):
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            bought = sum(pool.map(trade, ["buy"] * threads))
+
+        check = FileSession()
+        assert bought == threads * trades_per_thread
+        assert check.query(Asset).one().quantity == threads * trades_per_thread
+        assert check.query(PurchaseTransaction).count() == threads * trades_per_thread
+        check.close()
+
+        # Twice as many sell attempts as coins held: exactly the held amount may succeed
+        with ThreadPoolExecutor(max_workers=threads * 2) as pool:
+            sold = sum(pool.map(trade, ["sell"] * threads * 2))
+
+    check = FileSession()
+    assert sold == threads * trades_per_thread
+    assert check.query(SaleTransaction).count() == threads * trades_per_thread
+    assert all(sale.remaining_coin_quantity >= 0 for sale in check.query(SaleTransaction))
+    assert check.query(Asset).count() == 0
+    check.close()
+    file_engine.dispose()
+
+
+@pytest.mark.parametrize("cost_basis_method, expected_cost_basis", [
+    ("fifo", 1.0 * 2.0 + 0.5 * 2.5),
+    ("lifo", 1.0 * 2.5 + 0.5 * 2.0),
+    ("average", 1.5 * (2.0 + 2.5) / 2),
+])
+def test_sell_asset_realizes_gain_against_cost_basis(db, market, cost_basis_method, expected_cost_basis):
+    user = User(id=1, username="testuser", email="test@example.com")
+    db.add(user)
+    db.commit()
+
+    wallet = wallets.crud_create_wallet(db, user_id=user.id, cost_basis_method=cost_basis_method)
+
+    market["xrp"]["priceUsd"] = "2.0"
+    wallets.crud_purchase_asset(db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=1)
+    market["xrp"]["priceUsd"] = "2.5"
+    wallets.crud_purchase_asset(db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=1)
+    market["xrp"]["priceUsd"] = "3.0"
+
+    sale = wallets.crud_sell_asset(db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=1.5)
+
+    assert sale.cost_basis_usd == pytest.approx(expected_cost_basis)
+    assert sale.realized_gain_loss_usd == pytest.approx(4.5 - expected_cost_basis)
+
+    asset = db.query(Asset).filter(Asset.wallet_id == wallet.id).one()
+    assert asset.purchase_value_usd == pytest.approx(4.5 - expected_cost_basis)
+    assert asset.realized_gain_loss_usd == pytest.approx(4.5 - expected_cost_basis)
+
+    db.refresh(wallet)
+    assert wallet.realized_gain_loss_usd == pytest.approx(4.5 - expected_cost_basis)
+    assert db.query(AssetLot).count() == (0 if cost_basis_method == "average" else 1)
+
+
+def test_sell_all_of_asset_releases_cost_basis_and_lots(db, market):
+    user = User(id=1, username="testuser", email="test@example.com")
+    db.add(user)
+    db.commit()
+
+    wallet = wallets.crud_create_wallet(db, user_id=user.id)
+
+    wallets.crud_purchase_asset(db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=0.1)
+    wallets.crud_purchase_asset(db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=0.2)
+    sale = wallets.crud_sell_asset(db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=0.3)
+
+    assert sale.realized_gain_loss_usd == pytest.approx(0)
+    assert db.query(Asset).count() == 0
+    assert db.query(AssetLot).count() == 0
+
+
+def test_set_cost_basis_method(db, market):
+    user = User(id=1, username="testuser", email="test@example.com")
+    db.add(user)
+    db.commit()
+
+    wallet = wallets.crud_create_wallet(db, user_id=user.id)
+    wallets.crud_purchase_asset(db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=1)
+
+    assert wallets.crud_set_cost_basis_method(db, user.id, wallet.id, "lifo").cost_basis_method == "lifo"
+
+    with pytest.raises(HTTPException) as exc_info:
+        wallets.crud_set_cost_basis_method(db, user.id, wallet.id, "average")
+
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail == "Average cost can only be switched to or from while the wallet holds no assets"
+
+
+def test_create_wallet_invalid_cost_basis_method(db):
+    user = User(id=1, username="testuser", email="test@example.com")
+    db.add(user)
+    db.commit()
+
+    with pytest.raises(HTTPException) as exc_info:
+        wallets.crud_create_wallet(db, user_id=user.id, cost_basis_method="hifo")
+
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.detail == "Invalid cost basis method: hifo. Must be one of ['fifo', 'lifo', 'average']"
+
+
+def test_incremental_snapshot_matches_full_recomputation(db, market):
+    user = User(id=1, username="testuser", email="test@example.com")
+    db.add(user)
+    db.commit()
+
+    wallet = wallets.crud_create_wallet(db, user_id=user.id)
+
+    wallets.crud_purchase_asset(db=db, user_id=user.id, wallet_id=wallet.id, coin_name="bitcoin", quantity=0.5)
+    wallets.crud_purchase_asset(db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=100)
+    market["bitcoin"]["priceUsd"] = "85000"
+    wallets.crud_batch_order(db, user.id, wallet.id, [
+        BatchOrderLeg(side="buy", coin_name="ethereum", quantity=2),
+        BatchOrderLeg(side="sell", coin_name="xrp", quantity=40),
+    ])
+    market["ethereum"]["priceUsd"] = "2100"
+    wallets.crud_sell_asset(db=db, user_id=user.id, wallet_id=wallet.id, coin_name="bitcoin", quantity=0.5)
+
+    with patch("app.crud.wallets.build_wallet_holdings", wraps=wallets.build_wallet_holdings) as full_valuation:
+        wallets.crud_purchase_asset(db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=10)
+
+    full_valuation.assert_not_called()
+
+    snapshot = db.query(WalletActivityData).order_by(WalletActivityData.id.desc()).first()
+    expected_holdings = wallets.build_wallet_holdings(db, wallet.id, market)
+
+    assert set(snapshot.holdings) == {"ethereum", "xrp"}
+    for coin, holding in expected_holdings.items():
+        assert snapshot.holdings[coin] == pytest.approx(holding)
+    assert snapshot.total_value_usd == pytest.approx(
+        sum(holding["value_on_date_usd"] for holding in expected_holdings.values())
+    )
+
+
+def test_trades_bump_wallet_version(db, market):
+    user = User(id=1, username="testuser", email="test@example.com")
+    db.add(user)
+    db.commit()
+
+    wallet = wallets.crud_create_wallet(db, user_id=user.id)
+    assert wallet.version == 0
+
+    wallets.crud_purchase_asset(db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=2)
+    wallets.crud_sell_asset(db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=1)
+    wallets.crud_batch_order(db, user.id, wallet.id, [
+        BatchOrderLeg(side="buy", coin_name="bitcoin", quantity=0.1),
+        BatchOrderLeg(side="sell", coin_name="xrp", quantity=1),
+    ])
+
+    db.refresh(wallet)
+    assert wallet.version == 4
+
+
+def test_user_portfolio_groups_holdings_across_wallets(db, market):
+    db.add(User(id=1, username="testuser", email="test@example.com"))
+    db.add(User(id=2, username="otheruser", email="other@example.com"))
+    db.add_all([Wallet(id=1, user_id=1), Wallet(id=2, user_id=1), Wallet(id=3, user_id=1), Wallet(id=4, user_id=2)])
+    db.add_all([
+        Asset(wallet_id=1, coin_name="bitcoin", quantity=0.5, purchase_value_usd=30000),
+        Asset(wallet_id=1, coin_name="xrp", quantity=10, purchase_value_usd=20),
+        Asset(wallet_id=2, coin_name="xrp", quantity=30, purchase_value_usd=90),
+        Asset(wallet_id=2, coin_name="dogecoin", quantity=100, purchase_value_usd=15),
+        Asset(wallet_id=4, coin_name="bitcoin", quantity=9, purchase_value_usd=1),
+    ])
+    db.commit()
+
+    with patch("app.crud.wallets.fetch_all_assets", wraps=CoinCapAPI.fetch_all_assets) as fetch_prices:
+        portfolio = wallets.crud_get_user_portfolio(db, 1)
+
+    fetch_prices.assert_called_once()
+    assert portfolio["missing_prices"] == ["dogecoin"]
+    assert [(coin["coin_name"], coin["quantity"], coin["current_value_usd"], coin["wallet_count"])
+            for coin in portfolio["coins"]] == [
+        ("bitcoin", 0.5, 40000, 1),
+        ("dogecoin", 100, 0, 1),
+        ("xrp", 40, 100, 2),
+    ]
+    assert [(wallet["wallet_id"], wallet["coin_count"], wallet["current_value_usd"], wallet["net_gain_loss"])
+            for wallet in portfolio["wallets"]] == [
+        (1, 2, 40025, 10005),
+        (2, 2, 75, -30),
+        (3, 0, 0, 0),
+    ]
+    assert portfolio["total_value_usd"] == 40100
+    assert portfolio["total_purchase_value_usd"] == 30125
+    assert portfolio["net_gain_loss"] == 9975
+
+
+def test_user_portfolio_no_user(db):
+    with pytest.raises(HTTPException) as exc_info:
+        wallets.crud_get_user_portfolio(db, 1)
+
+    assert exc_info.value.status_code == 404
+    assert exc_info.value.detail == "User not found"
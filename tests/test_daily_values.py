@@ -0,0 +1,204 @@
+import calendar
+
+import pytest
+from sqlalchemy import create_engine, null
+from sqlalchemy.orm import sessionmaker
+from unittest.mock import patch
+from datetime import date, datetime
+
+from app.database import Base
+from app.crud import analytics, wallets
+from app.jobs.daily_values import run_daily_value_refresh
+from app.models import User, Wallet, PurchaseTransaction, SaleTransaction, WalletActivityData
+from app.models import WalletDailyValue, WalletDailyValueState
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture(scope="function")
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    session.add(User(id=1, username="testuser", email="test@example.com"))
+    session.add(Wallet(id=1, user_id=1))
+    session.commit()
+    yield session
+    session.close()
+    Base.metadata.drop_all(bind=engine)
+
+
+def candles(prices_by_day):
+    return [
+        {"time": calendar.timegm(day.timetuple()) * 1000, "priceUsd": str(price)}
+        for day, price in prices_by_day.items()
+    ]
+
+
+def buy(db, coin, quantity, total_price, when):
+    db.add(PurchaseTransaction(
+        user_id=1, wallet_id=1, coin_name=coin, quantity_purchased=quantity, total_purchase_price=total_price,
+        purchase_date=when
+    ))
+    db.query(Wallet).filter(Wallet.id == 1).update({Wallet.version: Wallet.version + 1})
+
+
+def sell(db, coin, quantity, cost_basis, when):
+    db.add(SaleTransaction(
+        user_id=1, wallet_id=1, coin_name=coin, quantity_sold=quantity, cost_basis_usd=cost_basis, sale_date=when
+    ))
+    db.query(Wallet).filter(Wallet.id == 1).update({Wallet.version: Wallet.version + 1})
+
+
+def daily_values(db):
+    return {
+        row.day: (row.total_value_usd, row.cost_basis_usd, row.prices_final)
+        for row in db.query(WalletDailyValue).filter(WalletDailyValue.wallet_id == 1)
+    }
+
+
+BITCOIN = {date(2025, 3, 1): 100, date(2025, 3, 2): 110, date(2025, 3, 3): 120, date(2025, 3, 4): 130}
+
+
+def refresh(db, through_day, prices=BITCOIN):
+    with patch("app.crud.analytics.fetch_dated_coin_price", return_value=candles(prices)) as fetch_prices:
+        report = run_daily_value_refresh(db, through_day)
+    return report, fetch_prices
+
+
+def test_daily_values_are_materialized_from_first_trade(db):
+    buy(db, "bitcoin", 2, 190, datetime(2025, 3, 1, 9))
+    sell(db, "bitcoin", 1, 95, datetime(2025, 3, 3, 9))
+    db.commit()
+
+    report, fetch_prices = refresh(db, date(2025, 3, 4))
+
+    assert report == {"through_day": date(2025, 3, 4), "wallets_refreshed": 1, "days_written": 4, "completed": True}
+    fetch_prices.assert_called_once()
+    assert daily_values(db) == {
+        date(2025, 3, 1): (200, 190, True),
+        date(2025, 3, 2): (220, 190, True),
+        date(2025, 3, 3): (120, 95, True),
+        date(2025, 3, 4): (130, 95, True),
+    }
+    state = db.query(WalletDailyValueState).one()
+    assert (state.version, state.last_purchase_id, state.last_sale_id) == (2, 1, 1)
+
+    # Nothing changed, so nothing is recomputed or fetched
+    report, fetch_prices = refresh(db, date(2025, 3, 4))
+    assert report["wallets_refreshed"] == 0
+    fetch_prices.assert_not_called()
+
+
+def test_only_affected_days_are_recomputed(db):
+    buy(db, "bitcoin", 1, 100, datetime(2025, 3, 1, 9))
+    db.commit()
+    refresh(db, date(2025, 3, 3), {day: price for day, price in BITCOIN.items() if day <= date(2025, 3, 2)})
+
+    # The 3rd was valued before its candle was out
+    assert daily_values(db)[date(2025, 3, 3)] == (110, 100, False)
+    first_day_id = db.query(WalletDailyValue.id).filter(WalletDailyValue.day == date(2025, 3, 1)).scalar()
+
+    # A backdated trade and a new day: recompute from the trade's day through the new one
+    buy(db, "bitcoin", 1, 110, datetime(2025, 3, 2, 12))
+    db.commit()
+    report, _ = refresh(db, date(2025, 3, 4))
+
+    assert report["days_written"] == 3
+    assert db.query(WalletDailyValue.id).filter(WalletDailyValue.day == date(2025, 3, 1)).scalar() == first_day_id
+    assert daily_values(db) == {
+        date(2025, 3, 1): (100, 100, True),
+        date(2025, 3, 2): (220, 210, True),
+        date(2025, 3, 3): (240, 210, True),
+        date(2025, 3, 4): (260, 210, True),
+    }
+
+
+def test_value_series_reads_materialized_values(db):
+    buy(db, "bitcoin", 1, 100, datetime(2025, 3, 1, 9))
+    db.commit()
+    refresh(db, date(2025, 3, 4))
+
+    with patch("app.crud.analytics.fetch_dated_coin_price") as fetch_prices, \
+            patch("app.crud.analytics._held_coins") as held_coins:
+        series = analytics.crud_get_wallet_value_series(db, 1, 1, "2025-03-02", "2025-03-04")
+
+    fetch_prices.assert_not_called()
+    held_coins.assert_not_called()
+    assert series["coins"] == ["bitcoin"]
+    assert [point["total_value_usd"] for point in series["series"]] == [110, 120, 130]
+
+    # A trade the job has not seen yet makes the rows stale, so the series is computed live again
+    buy(db, "bitcoin", 1, 100, datetime(2025, 3, 3, 9))
+    db.commit()
+
+    with patch("app.crud.analytics.fetch_dated_coin_price", return_value=candles(BITCOIN)) as fetch_prices:
+        series = analytics.crud_get_wallet_value_series(db, 1, 1, "2025-03-02", "2025-03-04")
+
+    fetch_prices.assert_called_once()
+    assert [point["total_value_usd"] for point in series["series"]] == [110, 240, 260]
+
+
+def test_valuation_of_past_snapshot_reads_materialized_value(db):
+    buy(db, "bitcoin", 1, 100, datetime(2025, 3, 1, 9))
+    db.add(WalletActivityData(
+        wallet_id=1,
+        date=datetime(2025, 3, 1, 9),
+        holdings={"bitcoin": {"quantity": 1, "purchase_value_usd": 100, "value_on_date_usd": 100}},
+        total_value_usd=100
+    ))
+    db.commit()
+    refresh(db, date(2025, 3, 4))
+
+    with patch("app.crud.wallets.fetch_dated_coin_price") as fetch_prices:
+        valuation = wallets.crud_get_wallet_valuation(db, 1, 1, "2025-03-03")
+        valuations = wallets.crud_get_wallet_valuations(db, 1, 1, ["2025-03-02", "2025-03-04"])
+
+    fetch_prices.assert_not_called()
+    assert valuation["snap_shot_date_relative_to_historic_date"] == "past"
+    assert valuation["date_requested_total_value"] == 120
+    assert valuation["holdings"]["bitcoin"]["value_on_date_requested"] == 120
+    assert [valuation["date_requested_total_value"] for valuation in valuations["valuations"]] == [110, 130]
+    assert [
+        valuation["holdings"]["bitcoin"]["value_on_date_requested"] for valuation in valuations["valuations"]
+    ] == [110, 130]
+
+
+def test_days_materialized_without_coin_prices_are_recomputed(db):
+    buy(db, "bitcoin", 1, 100, datetime(2025, 3, 1, 9))
+    sell(db, "bitcoin", 1, 100, datetime(2025, 3, 3, 9))
+    buy(db, "ethereum", 2, 20, datetime(2025, 3, 3, 10))
+    db.commit()
+    refresh(db, date(2025, 3, 4))
+
+    assert {row.day: row.coin_prices for row in db.query(WalletDailyValue)}[date(2025, 3, 2)] == {"bitcoin": 110}
+    assert db.query(WalletDailyValue.coin_prices).filter(WalletDailyValue.day == date(2025, 3, 3)).scalar() == {
+        "ethereum": 120
+    }
+
+    # Rows written before the coin prices were stored are read live, until the job fills them in
+    db.query(WalletDailyValue).filter(WalletDailyValue.day >= date(2025, 3, 2)).update(
+        {WalletDailyValue.coin_prices: null()}
+    )
+    db.commit()
+    with patch("app.crud.analytics.fetch_dated_coin_price", return_value=candles(BITCOIN)) as fetch_prices:
+        analytics.crud_get_wallet_value_series(db, 1, 1, "2025-03-01", "2025-03-04")
+    fetch_prices.assert_called()
+
+    report, _ = refresh(db, date(2025, 3, 4))
+
+    assert report["days_written"] == 3
+    series = analytics.crud_get_wallet_value_series(db, 1, 1, "2025-03-01", "2025-03-04")
+    assert series["coins"] == ["bitcoin", "ethereum"]
+
+
+def test_deleting_wallet_removes_daily_values(db):
+    buy(db, "bitcoin", 1, 100, datetime(2025, 3, 1, 9))
+    db.commit()
+    refresh(db, date(2025, 3, 2))
+
+    wallets.crud_delete_wallet(db, 1, 1)
+
+    assert db.query(WalletDailyValue).count() == 0
+    assert db.query(WalletDailyValueState).count() == 0
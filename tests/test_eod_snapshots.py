@@ -0,0 +1,140 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from unittest.mock import patch
+from datetime import date, datetime
+
+from app.database import Base
+from app.crud import wallets
+from app.jobs.eod_snapshots import run_eod_snapshots
+from app.jobs.scheduler import JobScheduler
+from app.models import User, Wallet, Asset, PurchaseTransaction, SaleTransaction, WalletActivityData, JobCheckpoint
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+FAKE_ASSETS = {"assets": {"bitcoin": {"priceUsd": "80000"}, "xrp": {"priceUsd": "2.5"}}}
+DAY = date(2025, 3, 15)
+
+
+def add_purchase(session, wallet_id, coin_name, quantity, cost, when):
+    asset = session.query(Asset).filter(Asset.wallet_id == wallet_id, Asset.coin_name == coin_name).first()
+    if asset is None:
+        asset = Asset(wallet_id=wallet_id, coin_name=coin_name, quantity=0, purchase_value_usd=0)
+        session.add(asset)
+    asset.quantity += quantity
+    asset.purchase_value_usd += cost
+    session.add(PurchaseTransaction(
+        user_id=1, wallet_id=wallet_id, coin_name=coin_name, quantity_purchased=quantity,
+        total_purchase_price=cost, purchase_date=when
+    ))
+
+
+@pytest.fixture(scope="function")
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    session.add(User(id=1, username="testuser", email="test@example.com"))
+    session.add_all([Wallet(id=wallet_id, user_id=1) for wallet_id in range(1, 6)])
+    add_purchase(session, 1, "bitcoin", 0.5, 30000, datetime(2025, 3, 14, 9, 0))
+    add_purchase(session, 1, "xrp", 10, 20, datetime(2025, 3, 15, 9, 0))
+    add_purchase(session, 4, "xrp", 4, 8, datetime(2025, 3, 15, 23, 0))
+    session.commit()
+    with patch("app.jobs.eod_snapshots.fetch_all_assets", return_value=FAKE_ASSETS):
+        yield session
+    session.close()
+    Base.metadata.drop_all(bind=engine)
+
+
+def test_eod_snapshots_cover_every_wallet(db):
+    report = run_eod_snapshots(db, DAY, chunk_size=2)
+
+    assert report == {"snapshot_day": DAY, "snapshots_written": 5, "completed": True}
+
+    snapshots = {snapshot.wallet_id: snapshot for snapshot in db.query(WalletActivityData)}
+    assert sorted(snapshots) == [1, 2, 3, 4, 5]
+    assert all(snapshot.date == datetime(2025, 3, 15, 23, 59, 59, 999999) for snapshot in snapshots.values())
+    assert snapshots[1].holdings == {
+        "bitcoin": {"quantity": 0.5, "purchase_value_usd": 30000, "value_on_date_usd": 40000},
+        "xrp": {"quantity": 10, "purchase_value_usd": 20, "value_on_date_usd": 25},
+    }
+    assert snapshots[1].total_value_usd == 40025
+    assert snapshots[2].holdings == {}
+    assert snapshots[4].total_value_usd == 10
+
+    # The day is done, so running it again writes nothing
+    assert run_eod_snapshots(db, DAY)["snapshots_written"] == 0
+    assert db.query(WalletActivityData).count() == 5
+
+
+def test_eod_snapshots_resume_from_checkpoint(db):
+    polls = iter([False, True])
+    report = run_eod_snapshots(db, DAY, chunk_size=2, should_stop=lambda: next(polls))
+
+    assert report == {"snapshot_day": DAY, "snapshots_written": 2, "completed": False}
+    checkpoint = db.query(JobCheckpoint).filter(JobCheckpoint.job_name == "eod_snapshots:2025-03-15").one()
+    assert checkpoint.position == 2
+    assert checkpoint.completed_at is None
+
+    report = run_eod_snapshots(db, DAY, chunk_size=2)
+
+    assert report == {"snapshot_day": DAY, "snapshots_written": 3, "completed": True}
+    assert sorted(wallet_id for (wallet_id,) in db.query(WalletActivityData.wallet_id)) == [1, 2, 3, 4, 5]
+
+
+def test_eod_snapshots_leave_out_trades_after_the_day(db):
+    # Made the next morning, before the job ran
+    add_purchase(db, 1, "xrp", 5, 10, datetime(2025, 3, 16, 0, 1))
+    add_purchase(db, 2, "bitcoin", 1, 60000, datetime(2025, 3, 16, 0, 2))
+    db.query(Asset).filter(Asset.wallet_id == 4).delete()
+    db.add(SaleTransaction(
+        user_id=1, wallet_id=4, coin_name="xrp", quantity_sold=4, cost_basis_usd=8,
+        sale_date=datetime(2025, 3, 16, 0, 3)
+    ))
+    db.commit()
+
+    run_eod_snapshots(db, DAY)
+
+    snapshots = {snapshot.wallet_id: snapshot for snapshot in db.query(WalletActivityData)}
+    assert snapshots[1].holdings["xrp"] == {"quantity": 10, "purchase_value_usd": 20, "value_on_date_usd": 25}
+    assert snapshots[2].holdings == {}
+    # Sold out since, so the asset row is gone, but it was held at the end of the day
+    assert snapshots[4].holdings == {"xrp": {"quantity": 4, "purchase_value_usd": 8, "value_on_date_usd": 10}}
+
+    # The late end-of-day row is written last but misses the morning's bitcoin, so it is not built on
+    with patch("app.crud.wallets.fetch_all_assets", return_value=FAKE_ASSETS):
+        snapshot = wallets.build_wallet_activity_snapshot(db, 2, ["xrp"])
+    assert snapshot.holdings["bitcoin"]["quantity"] == 1
+
+
+@pytest.mark.parametrize("now, expected_seconds", [
+    (datetime(2025, 3, 15, 0, 0), 5 * 60),
+    (datetime(2025, 3, 15, 0, 5), 24 * 3600),
+    (datetime(2025, 3, 15, 23, 0), 3600 + 5 * 60),
+])
+def test_scheduler_waits_until_daily_run_time(now, expected_seconds):
+    assert JobScheduler(run_at="00:05").seconds_until_next_run(now) == expected_seconds
+
+
+def test_scheduler_runs_jobs_on_start_and_stops(db):
+    scheduler = JobScheduler(session_factory=TestingSessionLocal, run_at="00:05")
+
+    last_job_ran = threading.Event()
+
+    with patch("app.jobs.scheduler.run_eod_snapshots") as eod_snapshots, \
+            patch("app.jobs.scheduler.run_daily_value_refresh") as daily_values, \
+            patch("app.jobs.scheduler.run_snapshot_compaction") as compaction, \
+            patch("app.jobs.scheduler.run_purge") as purge, \
+            patch("app.jobs.scheduler.purge_expired_records", side_effect=lambda db: last_job_ran.set()) as keys:
+        scheduler.start()
+        assert last_job_ran.wait(timeout=5)
+        scheduler.stop()
+
+    eod_snapshots.assert_called_once()
+    daily_values.assert_called_once()
+    compaction.assert_called_once()
+    purge.assert_called_once()
+    keys.assert_called_once()
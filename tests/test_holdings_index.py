@@ -0,0 +1,52 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.utils.holdings_index import HoldingsIndex
+
+START = datetime(2025, 1, 1)
+
+
+def replay(trades, as_of):
+    holdings = {}
+    for timestamp, coin, quantity in trades:
+        if timestamp <= as_of:
+            holdings[coin] = holdings.get(coin, 0.0) + quantity
+    return holdings
+
+
+@pytest.mark.parametrize("checkpoint_interval", [1, 4, 64])
+def test_holdings_as_of_matches_full_replay(checkpoint_interval):
+    rng = random.Random(3)
+    trades = [(START + timedelta(hours=i), rng.choice(["bitcoin", "xrp", "solana"]), rng.uniform(-1, 2))
+              for i in range(500)]
+    index = HoldingsIndex(trades, checkpoint_interval=checkpoint_interval)
+
+    for as_of in [START - timedelta(seconds=1), START, START + timedelta(hours=123, minutes=30),
+                  START + timedelta(hours=499), START + timedelta(days=365)]:
+        expected = replay(trades, as_of)
+        holdings = index.holdings_as_of(as_of, epsilon=float("-inf"))
+
+        for coin in ["bitcoin", "xrp", "solana"]:
+            assert holdings.get(coin, 0.0) == pytest.approx(expected.get(coin, 0.0))
+            assert index.quantity_as_of(coin, as_of) == pytest.approx(expected.get(coin, 0.0))
+
+
+def test_holdings_as_of_drops_closed_positions():
+    index = HoldingsIndex([
+        (START, "bitcoin", 1.0),
+        (START, "xrp", 5.0),
+        (START + timedelta(days=1), "xrp", -5.0),
+    ])
+
+    assert index.holdings_as_of(START) == {"bitcoin": 1.0, "xrp": 5.0}
+    assert index.holdings_as_of(START + timedelta(days=1)) == {"bitcoin": 1.0}
+    assert index.quantity_as_of("dogecoin", START) == 0.0
+
+
+def test_empty_index():
+    index = HoldingsIndex([])
+
+    assert len(index) == 0
+    assert index.holdings_as_of(START) == {}
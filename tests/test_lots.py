@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.utils.lots import LotBook
+
+DAY_1 = datetime(2024, 1, 1)
+DAY_2 = DAY_1 + timedelta(days=1)
+DAY_3 = DAY_1 + timedelta(days=2)
+
+
+def build_book(method):
+    book = LotBook(method)
+    book.add(1, 100, DAY_1)
+    book.add(1, 200, DAY_2)
+    book.add(2, 300, DAY_3)
+    return book
+
+
+def test_fifo_consumes_oldest_lots_first():
+    book = build_book("fifo")
+
+    assert book.consume(1.5) == 100 + 0.5 * 200
+    assert book.quantity == 2.5
+    assert book.cost_basis == 0.5 * 200 + 2 * 300
+
+
+def test_lifo_consumes_newest_lots_first():
+    book = build_book("lifo")
+
+    assert book.consume(2.5) == 2 * 300 + 0.5 * 200
+    assert list(book.lots) == [[1, 100, DAY_1], [0.5, 200, DAY_2]]
+
+
+def test_average_pools_lots():
+    book = build_book("average")
+
+    assert len(book.lots) == 1
+    assert book.consume(2) == 2 * (100 + 200 + 600) / 4
+    assert book.cost_basis == pytest.approx(2 * 900 / 4)
+
+
+def test_consume_more_than_held():
+    book = build_book("fifo")
+
+    with pytest.raises(ValueError):
+        book.consume(5)
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        LotBook("hifo")
@@ -0,0 +1,124 @@
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from datetime import datetime
+
+from app.database import Base
+from app.crud import users, wallets
+from app.jobs.purge import run_purge
+from app.models import User, Wallet, Asset, AssetLot, PurchaseTransaction, SaleTransaction, WalletActivityData
+from app.models import WalletDailyValue, WalletDailyValueState, IdempotencyRecord, PurgeRequest
+from app.crud.deletion import WALLET_TABLES
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture(scope="function")
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = TestingSessionLocal()
+    session.add(User(id=1, username="alice", email="alice@example.com"))
+    session.add(User(id=2, username="bob", email="bob@example.com"))
+    for wallet_id, user_id in ((1, 1), (2, 1), (3, 2)):
+        session.add(Wallet(id=wallet_id, user_id=user_id))
+        fill_wallet(session, wallet_id, user_id)
+    session.add(IdempotencyRecord(
+        user_id=1, endpoint="buy", key="k", request_hash="h", response={}, expires_at=datetime(2030, 1, 1)
+    ))
+    session.commit()
+    yield session
+    session.close()
+    Base.metadata.drop_all(bind=engine)
+
+
+def fill_wallet(db, wallet_id, user_id, trades=3, positions=True):
+    when = datetime(2025, 3, 1)
+    for _ in range(trades):
+        db.add(PurchaseTransaction(user_id=user_id, wallet_id=wallet_id, coin_name="xrp", purchase_date=when))
+        db.add(SaleTransaction(user_id=user_id, wallet_id=wallet_id, coin_name="xrp", sale_date=when))
+        db.add(WalletActivityData(wallet_id=wallet_id, date=when, holdings={}, total_value_usd=0))
+        db.add(AssetLot(wallet_id=wallet_id, coin_name="xrp", acquired_at=when, quantity_remaining=1, cost_per_unit=1))
+    if not positions:
+        return
+    db.add(Asset(wallet_id=wallet_id, coin_name="xrp", quantity=1, purchase_value_usd=1))
+    db.add(WalletDailyValue(wallet_id=wallet_id, day=when.date(), total_value_usd=0, cost_basis_usd=0))
+    db.add(WalletDailyValueState(wallet_id=wallet_id, version=0))
+
+
+def remaining(db, wallet_id):
+    return {model.__tablename__: db.query(model).filter(model.wallet_id == wallet_id).count() for model in WALLET_TABLES}
+
+
+def test_wallet_deletion_removes_everything_with_bulk_statements(db):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        wallets.crud_delete_wallet(db, wallet_id=1, user_id=1)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    assert set(remaining(db, 1).values()) == {0}
+    assert db.query(Wallet).filter(Wallet.id == 1).first() is None
+    assert set(remaining(db, 2).values()) != {0}
+    deletes = [statement for statement in statements if statement.startswith("DELETE")]
+    assert len(deletes) == len(WALLET_TABLES) + 1
+    assert all("IN" in statement for statement in deletes)
+
+
+def test_user_deletion_cascades(db):
+    users.crud_delete_user(db, 1)
+
+    for wallet_id in (1, 2):
+        assert set(remaining(db, wallet_id).values()) == {0}
+    assert db.query(Wallet).filter(Wallet.user_id == 1).count() == 0
+    assert db.query(IdempotencyRecord).count() == 0
+    assert db.query(User).filter(User.id == 1).first() is None
+    # Other users keep everything
+    assert set(remaining(db, 3).values()) != {0}
+
+
+def test_background_user_purge_runs_in_chunks(db):
+    fill_wallet(db, 1, 1, trades=20, positions=False)
+    db.commit()
+
+    response = users.crud_delete_user(db, 1, background=True)
+    assert response.message == "User deletion scheduled"
+    # Nothing is deleted until the purge runs, and asking twice queues it once
+    users.crud_delete_user(db, 1, background=True)
+    assert db.query(PurgeRequest).count() == 1
+    assert db.query(User).filter(User.id == 1).first() is not None
+
+    commits = []
+    event.listen(db, "after_commit", lambda session: commits.append(1))
+    report = run_purge(db, chunk_size=5)
+
+    assert report["requests_completed"] == 1
+    assert report["completed"]
+    assert len(commits) > 10
+    assert db.query(User).filter(User.id == 1).first() is None
+    for wallet_id in (1, 2):
+        assert set(remaining(db, wallet_id).values()) == {0}
+    assert db.query(PurgeRequest).count() == 0
+    assert set(remaining(db, 3).values()) != {0}
+
+
+def test_interrupted_purge_resumes(db):
+    wallets.crud_delete_wallet(db, wallet_id=3, user_id=2, background=True)
+
+    stops = iter([False, False, True])
+    report = run_purge(db, chunk_size=1, should_stop=lambda: next(stops, True))
+
+    assert not report["completed"]
+    assert db.query(Wallet).filter(Wallet.id == 3).first() is not None
+
+    report = run_purge(db, chunk_size=1)
+
+    assert report["requests_completed"] == 1
+    assert db.query(Wallet).filter(Wallet.id == 3).first() is None
+    assert set(remaining(db, 3).values()) == {0}
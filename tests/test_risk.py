@@ -0,0 +1,169 @@
+import calendar
+import threading
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from unittest.mock import patch
+from datetime import date, datetime
+
+from app.database import Base
+from app.crud import analytics
+from app.models import User, Wallet, PurchaseTransaction
+from app.utils.risk import daily_returns, risk_metrics
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture(scope="function")
+def db():
+    Base.metadata.create_all(bind=engine)
+    analytics._risk_cache.clear()
+    session = TestingSessionLocal()
+    session.add(User(id=1, username="testuser", email="test@example.com"))
+    session.add(Wallet(id=1, user_id=1))
+    session.add(Wallet(id=2, user_id=1))
+    session.commit()
+    yield session
+    session.close()
+    analytics._risk_cache.clear()
+    Base.metadata.drop_all(bind=engine)
+
+
+def candles(prices_by_day):
+    return [
+        {"time": calendar.timegm(day.timetuple()) * 1000, "priceUsd": str(price)}
+        for day, price in prices_by_day.items()
+    ]
+
+
+def buy(db, wallet_id, coin, quantity, when):
+    db.add(PurchaseTransaction(
+        user_id=1, wallet_id=wallet_id, coin_name=coin, quantity_purchased=quantity, total_purchase_price=100,
+        purchase_date=when
+    ))
+    db.query(Wallet).filter(Wallet.id == wallet_id).update({Wallet.version: Wallet.version + 1})
+    db.commit()
+
+
+PRICES = {
+    "bitcoin": {date(2025, 3, 1): 100, date(2025, 3, 2): 110, date(2025, 3, 3): 99, date(2025, 3, 4): 121},
+    "xrp": {date(2025, 3, 1): 10, date(2025, 3, 2): 10, date(2025, 3, 3): 12, date(2025, 3, 4): 12},
+}
+
+
+def fake_prices(coin_name, start_timestamp, end_timestamp):
+    return candles(PRICES[coin_name])
+
+
+def test_returns_ignore_trades_and_split_by_coin():
+    # One bitcoin throughout, a second one bought on day 2 at that day's price
+    holdings = np.array([[1.0, 0.0], [2.0, 0.0], [2.0, 10.0]])
+    prices = np.array([[100.0, 1.0], [110.0, 1.0], [99.0, 2.0]])
+
+    returns, contributions = daily_returns(holdings, prices)
+
+    np.testing.assert_allclose(returns, [0.1, -0.1])
+    np.testing.assert_allclose(contributions, [[0.1, 0.0], [-0.1, 0.0]])
+
+
+def test_risk_metrics():
+    returns = np.array([np.nan, 0.1, -0.1, 0.1])
+    contributions = np.array([[np.nan], [0.1], [-0.1], [0.1]])
+
+    metrics = risk_metrics(returns, contributions, ["bitcoin"])
+
+    assert metrics["total_return"] == pytest.approx(1.1 * 0.9 * 1.1 - 1)
+    assert metrics["max_drawdown"] == pytest.approx(-0.1)
+    assert metrics["annualized_volatility"] == pytest.approx(np.std([0.1, -0.1, 0.1], ddof=1) * np.sqrt(365))
+    assert metrics["sharpe_ratio"] == pytest.approx(0.1 / 3 * np.sqrt(365) / np.std([0.1, -0.1, 0.1], ddof=1))
+    assert metrics["sortino_ratio"] == pytest.approx(0.1 / 3 * np.sqrt(365) / np.sqrt(0.01 / 3))
+    assert metrics["contributions"] == {"bitcoin": pytest.approx(0.1)}
+
+
+def test_risk_metrics_without_holdings():
+    metrics = risk_metrics(np.array([np.nan]), np.zeros((1, 0)), [])
+
+    assert metrics["total_return"] == 0.0
+    assert metrics["sharpe_ratio"] is None
+
+
+def test_wallet_risk_is_memoized_until_wallet_changes(db):
+    buy(db, 1, "bitcoin", 1, datetime(2025, 3, 1, 9))
+
+    with patch("app.crud.analytics.fetch_dated_coin_price", side_effect=fake_prices) as fetch_prices:
+        first = analytics.crud_get_wallet_risk(db, 1, 1, "2025-03-01", "2025-03-04")
+        second = analytics.crud_get_wallet_risk(db, 1, 1, "2025-03-01", "2025-03-04")
+
+    fetch_prices.assert_called_once()
+    assert second == first
+    assert first["total_return"] == pytest.approx(0.21)
+    assert first["max_drawdown"] == pytest.approx(-0.1)
+    assert [point["daily_return"] for point in first["daily_returns"]] == pytest.approx([0.1, -0.1, 22 / 99])
+
+    buy(db, 1, "xrp", 10, datetime(2025, 3, 2, 9))
+
+    with patch("app.crud.analytics.fetch_dated_coin_price", side_effect=fake_prices) as fetch_prices:
+        third = analytics.crud_get_wallet_risk(db, 1, 1, "2025-03-01", "2025-03-04")
+
+    assert fetch_prices.call_count == 2
+    assert third["coins"] == ["bitcoin", "xrp"]
+    assert third["contributions"]["xrp"] == pytest.approx(20 / 210)
+
+
+def test_wallet_risk_is_recomputed_while_candles_are_missing(db):
+    buy(db, 1, "bitcoin", 1, datetime(2025, 3, 1, 9))
+    partial = candles({day: price for day, price in PRICES["bitcoin"].items() if day <= date(2025, 3, 2)})
+
+    with patch("app.crud.analytics.fetch_dated_coin_price", return_value=partial) as fetch_prices:
+        analytics.crud_get_wallet_risk(db, 1, 1, "2025-03-01", "2025-03-04")
+        analytics.crud_get_wallet_risk(db, 1, 1, "2025-03-01", "2025-03-04")
+
+    assert fetch_prices.call_count == 2
+
+
+def test_user_risk_combines_wallets(db):
+    buy(db, 1, "bitcoin", 1, datetime(2025, 3, 1, 9))
+    buy(db, 2, "bitcoin", 1, datetime(2025, 3, 1, 9))
+    buy(db, 2, "xrp", 10, datetime(2025, 3, 1, 9))
+
+    with patch("app.crud.analytics.fetch_dated_coin_price", side_effect=fake_prices):
+        report = analytics.crud_get_user_risk(db, 1, "2025-03-01", "2025-03-02")
+
+    assert report["wallet_ids"] == [1, 2]
+    # 2 bitcoin and 10 xrp, worth 300, gain 20 on bitcoin
+    assert report["total_return"] == pytest.approx(20 / 300)
+    assert report["contributions"] == {"bitcoin": pytest.approx(20 / 300), "xrp": 0.0}
+
+
+def test_risk_cache_is_safe_to_share_between_threads():
+    errors = []
+
+    def fill(offset):
+        try:
+            for i in range(2000):
+                key = ("wallet", (offset + i) % 50, date(2025, 3, 1), date(2025, 3, 4))
+                analytics._remember(analytics._risk_cache, key, ((1,), None, {}), analytics.RISK_CACHE_SIZE)
+                analytics._cached(analytics._risk_cache, key)
+        except Exception as e:
+            errors.append(e)
+
+    def forget():
+        try:
+            for i in range(2000):
+                analytics.forget_wallet(i % 50)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=fill, args=(offset,)) for offset in range(4)] + [threading.Thread(target=forget)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(analytics._risk_cache) <= analytics.RISK_CACHE_SIZE
+    analytics._risk_cache.clear()
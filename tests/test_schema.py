@@ -0,0 +1,111 @@
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base
+from app.crud import wallets
+from app.jobs.snapshot_days import run_snapshot_day_backfill
+from app.models import User, Wallet, WalletActivityData
+from app.utils.schema import upgrade_schema
+
+# The tables as the first release created them, before any column was added
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER NOT NULL PRIMARY KEY, username VARCHAR, email VARCHAR, password_hash VARCHAR
+);
+CREATE UNIQUE INDEX ix_users_username ON users (username);
+CREATE UNIQUE INDEX ix_users_email ON users (email);
+CREATE INDEX ix_users_id ON users (id);
+CREATE TABLE wallets (
+    id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER REFERENCES users (id)
+);
+CREATE INDEX ix_wallets_id ON wallets (id);
+CREATE TABLE wallet_activity_data (
+    id INTEGER NOT NULL PRIMARY KEY, wallet_id INTEGER REFERENCES wallets (id), date DATETIME NOT NULL,
+    holdings JSON NOT NULL, total_value_usd FLOAT NOT NULL
+);
+CREATE INDEX ix_wallet_activity_data_id ON wallet_activity_data (id);
+CREATE TABLE assets (
+    id INTEGER NOT NULL PRIMARY KEY, wallet_id INTEGER REFERENCES wallets (id), coin_name VARCHAR,
+    quantity FLOAT, purchase_value_usd FLOAT, initial_purchase_date DATETIME
+);
+CREATE INDEX ix_assets_id ON assets (id);
+CREATE INDEX ix_assets_coin_name ON assets (coin_name);
+CREATE TABLE purchase_transactions (
+    id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER REFERENCES users (id), wallet_id INTEGER REFERENCES wallets (id),
+    asset_id INTEGER REFERENCES assets (id), coin_name VARCHAR, quantity_purchased FLOAT, purchase_price FLOAT,
+    total_purchase_price FLOAT, updated_coin_quantity FLOAT, purchase_date DATETIME
+);
+CREATE TABLE sale_transactions (
+    id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER REFERENCES users (id), wallet_id INTEGER REFERENCES wallets (id),
+    asset_id INTEGER REFERENCES assets (id), coin_name VARCHAR, quantity_sold FLOAT, sale_price FLOAT,
+    total_sale_price FLOAT, remaining_coin_quantity FLOAT, sale_date DATETIME
+);
+INSERT INTO users (id, username, email, password_hash) VALUES (1, 'alice', 'alice@example.com', 'hash');
+INSERT INTO wallets (id, user_id) VALUES (1, 1);
+INSERT INTO wallet_activity_data (wallet_id, date, holdings, total_value_usd)
+    VALUES (1, '2025-03-04 09:00:00.000000', '{}', 0), (1, '2025-03-05 09:00:00.000000', '{}', 0);
+"""
+
+
+@pytest.fixture(scope="function")
+def baseline_engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'baseline.db'}", connect_args={"check_same_thread": False})
+    with engine.begin() as connection:
+        for statement in BASELINE_SCHEMA.split(";"):
+            if statement.strip():
+                connection.exec_driver_sql(statement)
+    yield engine
+    engine.dispose()
+
+
+def test_upgrade_adds_what_later_models_need(baseline_engine):
+    upgrade_schema(baseline_engine, Base.metadata)
+
+    inspector = inspect(baseline_engine)
+    assert {"version", "cost_basis_method", "realized_gain_loss_usd"} <= {
+        column["name"] for column in inspector.get_columns("wallets")
+    }
+    assert {"snapshot_day", "holdings_blob"} <= {
+        column["name"] for column in inspector.get_columns("wallet_activity_data")
+    }
+    assert "cost_basis_usd" in {column["name"] for column in inspector.get_columns("sale_transactions")}
+    assert "uq_assets_wallet_coin" in {index["name"] for index in inspector.get_indexes("assets")}
+    assert "ix_wallet_activity_data_wallet_day_date" in {
+        index["name"] for index in inspector.get_indexes("wallet_activity_data")
+    }
+
+    with baseline_engine.connect() as connection:
+        # Rows older than a column get its default
+        assert connection.execute(text("SELECT version, cost_basis_method FROM wallets")).all() == [(0, "fifo")]
+        # Binary snapshots leave holdings NULL, which the first release did not allow
+        connection.execute(text(
+            "INSERT INTO wallet_activity_data (wallet_id, date, holdings_blob, total_value_usd) "
+            "VALUES (1, '2025-03-06 09:00:00.000000', x'00', 0)"
+        ))
+        assert connection.execute(text("SELECT count(*) FROM wallet_activity_data")).scalar() == 3
+
+    # Running it again finds nothing to do
+    upgrade_schema(baseline_engine, Base.metadata)
+
+
+def test_snapshot_day_backfill_on_a_baseline_database(baseline_engine):
+    upgrade_schema(baseline_engine, Base.metadata)
+    db = sessionmaker(bind=baseline_engine)()
+    try:
+        assert run_snapshot_day_backfill(db, chunk_size=1) == {"snapshots_updated": 2, "completed": True}
+        assert [day for (day,) in db.query(WalletActivityData.snapshot_day).order_by(WalletActivityData.id)] == [
+            date(2025, 3, 4), date(2025, 3, 5)
+        ]
+
+        wallet = db.query(Wallet).one()
+        assert (wallet.version, db.query(User).one().username) == (0, "alice")
+
+        valuation = wallets.crud_get_wallet_valuation(db, 1, 1, "2025-03-01")
+        assert valuation["snap_shot_date"] == "2025-03-04 09:00:00"
+        assert valuation["snap_shot_date_relative_to_historic_date"] == "future"
+        assert datetime.strptime(valuation["snap_shot_date"], "%Y-%m-%d %H:%M:%S").date() == date(2025, 3, 4)
+    finally:
+        db.close()
@@ -0,0 +1,133 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+from unittest.mock import patch
+from datetime import datetime
+
+from app.database import Base
+from app.crud import snapshots, wallets
+from app.models import User, WalletActivityData, SnapshotCoin
+from app.utils.snapshot_codec import HOLDING_DTYPE, HoldingsView, decode_records, encode_holdings
+from app import CoinCapAPI
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+HOLDINGS = {
+    "bitcoin": {"quantity": 0.5, "purchase_value_usd": 30000.0, "value_on_date_usd": 40000.0},
+    "xrp": {"quantity": 10.0, "purchase_value_usd": 20.0, "value_on_date_usd": 25.0},
+}
+
+
+@pytest.fixture(scope="function")
+def db():
+    Base.metadata.create_all(bind=engine)
+    snapshots.forget_coin_dictionary()
+    session = TestingSessionLocal()
+    yield session
+    session.close()
+    snapshots.forget_coin_dictionary()
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture(scope="function")
+def binary_format():
+    with patch("app.crud.snapshots.SNAPSHOT_HOLDINGS_FORMAT", "binary"):
+        yield
+
+
+@pytest.fixture(scope="function")
+def market():
+    fake_assets = {
+        "bitcoin": {"id": "bitcoin", "priceUsd": "80000"},
+        "xrp": {"id": "xrp", "priceUsd": "2.5"},
+    }
+
+    with patch.dict(CoinCapAPI._cache, {"timestamp": time.time(), "assets": fake_assets, "coins": list(fake_assets)}):
+        with patch("app.crud.wallets.time.sleep"):
+            yield fake_assets
+
+
+def test_codec_round_trip_decodes_lazily():
+    blob = encode_holdings(HOLDINGS, {"bitcoin": 7, "xrp": 3})
+
+    assert len(blob) == 1 + 2 * HOLDING_DTYPE.itemsize
+    records = decode_records(blob)
+    assert records["coin_id"].tolist() == [7, 3]
+
+    view = HoldingsView(records, {7: "bitcoin", 3: "xrp"})
+    assert len(view) == 2
+    assert view._positions is None  # Nothing is looked up until a coin is read
+    assert view["xrp"] == HOLDINGS["xrp"]
+    assert list(view) == ["bitcoin", "xrp"]
+    assert view.to_dict() == HOLDINGS
+
+
+def test_codec_rejects_unknown_encoding():
+    with pytest.raises(ValueError):
+        decode_records(b"\x09")
+
+
+def test_binary_snapshots_round_trip_through_trades(db, market, binary_format):
+    user = User(id=1, username="testuser", email="test@example.com")
+    db.add(user)
+    db.commit()
+    wallet = wallets.crud_create_wallet(db, user_id=user.id)
+
+    wallets.crud_purchase_asset(db=db, user_id=user.id, wallet_id=wallet.id, coin_name="bitcoin", quantity=0.5)
+    wallets.crud_purchase_asset(db=db, user_id=user.id, wallet_id=wallet.id, coin_name="xrp", quantity=10)
+
+    # The second snapshot was built incrementally from the first, binary, one
+    snapshot = db.query(WalletActivityData).order_by(WalletActivityData.id.desc()).first()
+    assert snapshot.holdings is None
+    assert dict(snapshots.read_holdings(db, snapshot)) == {
+        "bitcoin": {"quantity": 0.5, "purchase_value_usd": 40000.0, "value_on_date_usd": 40000.0},
+        "xrp": {"quantity": 10.0, "purchase_value_usd": 25.0, "value_on_date_usd": 25.0},
+    }
+    assert sorted(coin for (coin,) in db.query(SnapshotCoin.coin_name)) == ["bitcoin", "xrp"]
+
+    valuation = wallets.crud_get_wallet_valuation(
+        db=db, user_id=user.id, wallet_id=wallet.id, historical_date=snapshot.date.strftime("%Y-%m-%d")
+    )
+    assert valuation["holdings"]["xrp"]["value_on_date_usd"] == 25.0
+
+
+def test_json_and_binary_snapshots_are_both_readable(db, binary_format):
+    db.add(User(id=1, username="testuser", email="test@example.com"))
+    db.add(WalletActivityData(wallet_id=1, date=datetime(2025, 3, 1), holdings=HOLDINGS, total_value_usd=40025))
+    db.add(WalletActivityData(
+        wallet_id=1, date=datetime(2025, 3, 2), **snapshots.holdings_columns(db, HOLDINGS), total_value_usd=40025
+    ))
+    db.commit()
+
+    for snapshot in db.query(WalletActivityData):
+        assert dict(snapshots.read_holdings(db, snapshot)) == HOLDINGS
+
+
+def test_holdings_are_not_loaded_for_totals(db):
+    db.add(WalletActivityData(wallet_id=1, date=datetime(2025, 3, 1), holdings=HOLDINGS, total_value_usd=40025))
+    db.commit()
+    db.expunge_all()
+
+    snapshot = db.query(WalletActivityData).one()
+
+    assert snapshot.total_value_usd == 40025
+    assert {"holdings", "holdings_blob"} <= inspect(snapshot).unloaded
+
+
+def test_coin_ids_from_rolled_back_transaction_are_not_cached(db, binary_format):
+    snapshots.holdings_columns(db, {"dogecoin": HOLDINGS["xrp"]})
+    db.rollback()
+
+    assert "dogecoin" not in snapshots._coin_ids
+
+    # Another coin takes the id the rolled back one had
+    columns = snapshots.holdings_columns(db, {"xrp": HOLDINGS["xrp"]})
+    assert "xrp" not in snapshots._coin_ids
+    db.commit()
+
+    assert list(snapshots._coin_ids) == ["xrp"]
+    assert decode_records(columns["holdings_blob"])["coin_id"].tolist() == [snapshots._coin_ids["xrp"]]
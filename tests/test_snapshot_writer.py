@@ -0,0 +1,185 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from unittest.mock import patch
+from fastapi import HTTPException
+
+from app.database import Base
+from app.crud import wallets
+from app.jobs.snapshot_writer import SnapshotWriter
+from app.models import User, WalletActivityData
+from app import CoinCapAPI
+
+
+@pytest.fixture(scope="function")
+def session_factory(tmp_path):
+    # A file database, so the writer thread and the test see the same data through separate connections
+    file_engine = create_engine(f"sqlite:///{tmp_path / 'snapshots.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=file_engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=file_engine)
+    file_engine.dispose()
+
+
+@pytest.fixture(scope="function")
+def market():
+    fake_assets = {
+        "bitcoin": {"id": "bitcoin", "rank": "1", "symbol": "BTC", "priceUsd": "80000"},
+        "xrp": {"id": "xrp", "rank": "4", "symbol": "XRP", "priceUsd": "2.5"},
+    }
+
+    with patch.dict(CoinCapAPI._cache, {"timestamp": time.time(), "assets": fake_assets, "coins": list(fake_assets)}):
+        yield fake_assets
+
+
+@pytest.fixture(scope="function")
+def wallet(session_factory):
+    db = session_factory()
+    db.add(User(id=1, username="testuser", email="test@example.com"))
+    db.commit()
+    wallet = wallets.crud_create_wallet(db, user_id=1)
+    wallet_id = wallet.id
+    db.close()
+    return wallet_id
+
+
+def test_trades_within_window_share_one_snapshot(session_factory, market, wallet):
+    writer = SnapshotWriter(session_factory, coalesce_seconds=60)
+    writer.start()
+
+    db = session_factory()
+    with patch("app.crud.wallets.snapshot_writer", writer):
+        wallets.crud_purchase_asset(db=db, user_id=1, wallet_id=wallet, coin_name="bitcoin", quantity=0.5)
+        wallets.crud_purchase_asset(db=db, user_id=1, wallet_id=wallet, coin_name="xrp", quantity=100)
+
+        # Nothing is written on the request path
+        assert db.query(WalletActivityData).count() == 0
+
+        writer.stop()
+
+    snapshots = db.query(WalletActivityData).all()
+    assert len(snapshots) == 1
+    assert snapshots[0].holdings == wallets.build_wallet_holdings(db, wallet, market)
+    assert snapshots[0].total_value_usd == pytest.approx(0.5 * 80000 + 100 * 2.5)
+    db.close()
+
+
+def test_writer_commits_once_window_elapses(session_factory, market, wallet):
+    writer = SnapshotWriter(session_factory, coalesce_seconds=0.05)
+    writer.start()
+
+    db = session_factory()
+    with patch("app.crud.wallets.snapshot_writer", writer):
+        wallets.crud_purchase_asset(db=db, user_id=1, wallet_id=wallet, coin_name="xrp", quantity=10)
+
+    deadline = time.monotonic() + 5
+    while db.query(WalletActivityData).count() == 0 and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+    assert db.query(WalletActivityData).count() == 1
+    writer.stop()
+    db.close()
+
+
+def test_trade_writes_snapshot_synchronously_when_writer_stopped(session_factory, market, wallet):
+    writer = SnapshotWriter(session_factory)
+
+    db = session_factory()
+    with patch("app.crud.wallets.snapshot_writer", writer):
+        wallets.crud_purchase_asset(db=db, user_id=1, wallet_id=wallet, coin_name="xrp", quantity=10)
+        wallets.crud_purchase_asset(db=db, user_id=1, wallet_id=wallet, coin_name="xrp", quantity=5)
+
+    assert not writer.submit(user_id=1, wallet_id=wallet, coin_names=["xrp"])
+    assert db.query(WalletActivityData).count() == 2
+    db.close()
+
+
+def test_writer_skips_deleted_wallets(session_factory, market, wallet):
+    writer = SnapshotWriter(session_factory, coalesce_seconds=60)
+    writer.start()
+
+    assert writer.submit(user_id=1, wallet_id=wallet + 1, coin_names=["xrp"])
+    writer.stop()
+
+    db = session_factory()
+    assert db.query(WalletActivityData).count() == 0
+    db.close()
+
+
+def wait_for_snapshots(db, count: int):
+    deadline = time.monotonic() + 5
+    while db.query(WalletActivityData).count() < count and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return db.query(WalletActivityData).count()
+
+
+def test_writer_retries_snapshots_after_non_database_errors(session_factory, market, wallet):
+    writer = SnapshotWriter(session_factory, coalesce_seconds=0.01)
+    writer.start()
+    build_snapshot = wallets.build_wallet_activity_snapshot
+    calls = []
+
+    # CoinCap being down surfaces as an HTTPException from the price lookup
+    def flaky_build_snapshot(*args, **kwargs):
+        calls.append(1)
+        if len(calls) <= 2:
+            raise HTTPException(status_code=503, detail="Unable to fetch assets")
+        return build_snapshot(*args, **kwargs)
+
+    db = session_factory()
+    with patch("app.crud.wallets.build_wallet_activity_snapshot", side_effect=flaky_build_snapshot):
+        assert writer.submit(user_id=1, wallet_id=wallet, coin_names=["xrp"])
+        assert wait_for_snapshots(db, 1) == 1
+
+    # The batch and the one-at-a-time write both failed, the retry a second later succeeded
+    assert len(calls) == 3
+    assert writer.running
+    writer.stop()
+    db.close()
+
+
+def test_writer_thread_survives_errors_outside_the_batch(session_factory, market, wallet):
+    opened = []
+
+    def flaky_session_factory():
+        opened.append(1)
+        if len(opened) == 1:
+            raise RuntimeError("database unavailable")
+        return session_factory()
+
+    writer = SnapshotWriter(flaky_session_factory, coalesce_seconds=0.01)
+    writer.start()
+    assert writer.submit(user_id=1, wallet_id=wallet, coin_names=["xrp"])
+
+    db = session_factory()
+    assert wait_for_snapshots(db, 1) == 1
+    assert writer.running
+    writer.stop()
+    db.close()
+
+
+def test_snapshot_after_one_given_up_on_revalues_the_wallet(session_factory, market, wallet):
+    writer = SnapshotWriter(session_factory, coalesce_seconds=0.01)
+    writer.start()
+
+    db = session_factory()
+    with patch("app.crud.wallets.snapshot_writer", writer), patch("app.jobs.snapshot_writer.SNAPSHOT_MAX_ATTEMPTS", 1):
+        wallets.crud_purchase_asset(db=db, user_id=1, wallet_id=wallet, coin_name="bitcoin", quantity=0.5)
+        assert wait_for_snapshots(db, 1) == 1
+
+        with patch("app.crud.wallets.build_wallet_activity_snapshot", side_effect=RuntimeError("disk full")):
+            wallets.crud_purchase_asset(db=db, user_id=1, wallet_id=wallet, coin_name="xrp", quantity=100)
+            deadline = time.monotonic() + 5
+            while wallet not in writer._stale_wallets and time.monotonic() < deadline:
+                time.sleep(0.02)
+
+        # The xrp snapshot was dropped, so the next one can't build on the bitcoin-only snapshot
+        wallets.crud_purchase_asset(db=db, user_id=1, wallet_id=wallet, coin_name="bitcoin", quantity=0.25)
+        assert wait_for_snapshots(db, 2) == 2
+
+    latest = db.query(WalletActivityData).order_by(WalletActivityData.id.desc()).first()
+    assert wallets.read_holdings(db, latest)["xrp"]["quantity"] == 100
+    assert wallets.read_holdings(db, latest)["bitcoin"]["quantity"] == 0.75
+    writer.stop()
+    db.close()